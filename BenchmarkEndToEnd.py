@@ -0,0 +1,173 @@
+"""
+End-to-end benchmark of CreateUsageReport_MOD.py against MockArcGISServer.py, reporting the wall time, request count,
+and bytes transferred of every phase of the script so that regressions in the crawl and report pipeline can be caught
+without touching the production machines.
+
+The phases are the endpoints the script calls: token generation, the machine probe, the folders list, the per-folder
+services crawl, and report creation, query, and deletion. Their stats are recorded by the mock server, so a phase's
+wall time runs from the first request of the phase being received to the last response being sent. The whole run is
+timed by the benchmark. Each run uses its own temporary folder, so every run crawls the site and builds its report
+from scratch unless --warm-inventory is given. With --persistent-report the report is kept on the server between
+runs, so a warm run only queries it when its definition has not changed.
+The results can be saved to a json file and later runs compared against it; the comparison exits with status 1 when
+a phase has become slower by more than the tolerance or makes more requests or transfers more bytes.
+Date: 20261016
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import CreateUsageReport_MOD
+import MockArcGISServer
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare benchmark results to a baseline and print every phase that regressed.
+    :param results: results of this benchmark, as returned by run_benchmark()
+    :param baseline: results of an earlier benchmark, read from a file written with --save
+    :param tolerance: fraction by which a wall time may grow before it counts as a regression
+    :return: list of regression descriptions
+    """
+    regressions = []
+
+    # Injected errors are random, so with an error rate the number of retries, and so of requests, varies between runs
+    count_keys = () if results["settings"]["error_rate"] else ("requests", "bytes_sent", "bytes_received")
+    phases = dict(results["phases"], total=results["total"])
+    baseline_phases = dict(baseline["phases"], total=baseline["total"])
+    for phase_name, phase in phases.items():
+        baseline_phase = baseline_phases.get(phase_name)
+        if baseline_phase is None:
+            continue
+        if phase["wall_time"] > baseline_phase["wall_time"] * (1 + tolerance):
+            regressions.append(f"{phase_name}: wall time {baseline_phase['wall_time'] * 1000:.1f} ms -> "
+                               f"{phase['wall_time'] * 1000:.1f} ms")
+        for key in count_keys:
+            if key in phase and phase[key] > baseline_phase.get(key, phase[key]):
+                regressions.append(f"{phase_name}: {key} {baseline_phase[key]} -> {phase[key]}")
+    if results["settings"] != baseline["settings"]:
+        print("WARNING: The baseline was run with different settings")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'phase':<14} {'wall':>10} {'requests':>9} {'errors':>7} {'request KiB':>12} {'response KiB':>13}")
+    for phase_name in MockArcGISServer.MockServerObject.ENDPOINT_NAMES:
+        phase = results["phases"].get(phase_name)
+        if phase is None:
+            continue
+        print(f"{phase_name:<14} {phase['wall_time'] * 1000:>7.1f} ms {phase['requests']:>9.0f} "
+              f"{phase['errors']:>7.0f} {phase['bytes_received'] / 1024:>12.1f} {phase['bytes_sent'] / 1024:>13.1f}")
+    print(f"{'total':<14} {results['total']['wall_time'] * 1000:>7.1f} ms")
+
+
+def run_benchmark(arguments):
+    """
+    Run the script against a fresh mock server repeatedly and take the median of every stat of every phase.
+    :param arguments: parsed command line arguments
+    :return: dictionary of settings, per-phase medians, and the median total wall time
+    """
+    settings = {"folders": arguments.folders,
+                "services_per_folder": arguments.services_per_folder,
+                "request_latency": arguments.request_latency,
+                "load_latency": arguments.load_latency,
+                "error_rate": arguments.error_rate,
+                "metric_count": arguments.metric_count,
+                "report_window_hours": arguments.report_window_hours,
+                "warm_inventory": arguments.warm_inventory,
+                "persistent_report": arguments.persistent_report}
+    mock_server_object = MockArcGISServer.MockServerObject(folder_count=arguments.folders,
+                                                           services_per_folder=arguments.services_per_folder,
+                                                           request_latency=arguments.request_latency,
+                                                           load_latency=arguments.load_latency,
+                                                           error_rate=arguments.error_rate,
+                                                           report_base_latency=arguments.report_base_latency,
+                                                           report_uri_latency=arguments.report_uri_latency,
+                                                           metric_count=arguments.metric_count,
+                                                           seed=0).start()
+    run_stats = []
+    run_wall_times = []
+    try:
+        for _ in range(arguments.repeat):
+            with tempfile.TemporaryDirectory() as run_folder:
+                config_path = os.path.join(run_folder, "benchmark.cfg")
+                mock_server_object.write_config(
+                    config_path=config_path,
+                    settings={"collection_state_path": os.path.join(run_folder, "collection_state.json"),
+                              "csv_output_file_path": os.path.join(run_folder, "UsageStatistics.csv"),
+                              "inventory_cache_path": os.path.join(run_folder, "inventory.bin"),
+                              "machine_stats_path": "",
+                              "persistent_report_name": "BenchmarkReport" if arguments.persistent_report else "",
+                              "prometheus_textfile_path": "",
+                              "report_window_hours": arguments.report_window_hours,
+                              "request_backoff_base_seconds": 0.01,
+                              "run_metrics_path": os.path.join(run_folder, "run_metrics.json"),
+                              "token_cache_path": ""})
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if arguments.warm_inventory:
+                        CreateUsageReport_MOD.main(["--config", config_path])
+                    mock_server_object.reset_stats()
+                    start = time.perf_counter()
+                    CreateUsageReport_MOD.main(["--config", config_path])
+                    run_wall_times.append(time.perf_counter() - start)
+                run_stats.append(mock_server_object.stats())
+    finally:
+        mock_server_object.stop()
+
+    phases = {}
+    for phase_name in MockArcGISServer.MockServerObject.ENDPOINT_NAMES:
+        phase_runs = [stats[phase_name] for stats in run_stats if phase_name in stats]
+        if phase_runs:
+            phases[phase_name] = {key: statistics.median(phase_run[key] for phase_run in phase_runs)
+                                  for key in ("wall_time", "requests", "errors", "bytes_sent", "bytes_received")}
+    return {"settings": settings, "phases": phases, "total": {"wall_time": statistics.median(run_wall_times)}}
+
+
+def main():
+    """
+    Run the benchmark, print the stats of every phase, and save or compare them when asked to.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark every phase of the script against the mock server")
+    parser.add_argument("--folders", type=int, default=50)
+    parser.add_argument("--services-per-folder", type=int, default=20)
+    parser.add_argument("--request-latency", type=float, default=0.002)
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="seconds added to a request for every other request answered at once")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--report-base-latency", type=float, default=0.05)
+    parser.add_argument("--report-uri-latency", type=float, default=0.0001)
+    parser.add_argument("--metric-count", type=int, default=1, help="metric rows per resourceURI in the report csv")
+    parser.add_argument("--report-window-hours", type=int, default=48)
+    parser.add_argument("--warm-inventory", action="store_true", help="time runs with a warm inventory cache")
+    parser.add_argument("--persistent-report", action="store_true", help="keep one named report on the server")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="path of a json file to save the results to, for later comparison")
+    parser.add_argument("--compare", help="path of a json file saved by an earlier run to compare the results to")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction a wall time may grow by")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments=arguments)
+    print_results(results=results)
+    if arguments.save:
+        with open(arguments.save, "w") as results_file_handler:
+            json.dump(results, results_file_handler, indent=2)
+    if arguments.compare:
+        with open(arguments.compare, "r") as baseline_file_handler:
+            baseline = json.load(baseline_file_handler)
+        regressions = compare_results(results=results, baseline=baseline, tolerance=arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
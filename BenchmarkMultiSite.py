@@ -0,0 +1,120 @@
+"""
+Benchmark multi-site collection with MultiSiteCollection.py against MockArcGISServer.py and check that the sites stay
+isolated from each other.
+
+Every site is a [site:<name>] section pointing at the same mock server. With --crash-sites the worker process of those
+sites ends abruptly with os._exit(), as a process killed for running out of memory would, before it collects anything.
+Several cycles are run, as a daemon would, and for each the wall time, the sites that failed, and the rows in the
+combined csv are printed. The benchmark exits with status 1 when a site that was not crashed fails or is missing from
+the combined csv in any cycle.
+Date: 20261017
+"""
+import argparse
+import configparser
+import contextlib
+import csv
+import functools
+import io
+import os
+import sys
+import tempfile
+import time
+
+import MockArcGISServer
+import MultiSiteCollection
+
+
+def run_site_or_crash(config_path, site_name, crash_site_names=()):
+    """
+    Run a site as MultiSiteCollection.run_site() does, or end the worker process at once for a crashed site.
+    :param config_path: path of the config file
+    :param site_name: name of the site
+    :param crash_site_names: names of the sites whose process is ended
+    :return: tuple of success boolean, printed output, and seconds taken
+    """
+    if site_name in crash_site_names:
+        os._exit(1)
+    return MultiSiteCollection.run_site(config_path=config_path, site_name=site_name)
+
+
+def combined_site_names(csv_path):
+    """
+    List the sites in the Site column of a combined csv.
+    :param csv_path: path of the combined csv
+    :return: tuple of the set of site names and the number of rows
+    """
+    if not os.path.exists(csv_path):
+        return set(), 0
+    with open(csv_path, "r", newline="") as csv_file_handler:
+        reader = csv.DictReader(csv_file_handler)
+        site_names = [row["Site"] for row in reader]
+    return set(site_names), len(site_names)
+
+
+def main():
+    """
+    Run the benchmark and print every cycle.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark multi-site collection and check site isolation")
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--crash-sites", default="site2", help="comma separated names of sites whose process crashes")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--folder-count", type=int, default=10)
+    parser.add_argument("--services-per-folder", type=int, default=10)
+    arguments = parser.parse_args()
+    site_names = [f"site{index + 1}" for index in range(arguments.sites)]
+    crash_site_names = tuple(site_name for site_name in arguments.crash_sites.split(",") if site_name)
+    healthy_site_names = set(site_names) - set(crash_site_names)
+
+    mock_server_object = MockArcGISServer.MockServerObject(folder_count=arguments.folder_count,
+                                                           services_per_folder=arguments.services_per_folder).start()
+    isolated = True
+    try:
+        with tempfile.TemporaryDirectory() as run_folder:
+            config_path = os.path.join(run_folder, "sites.cfg")
+            mock_server_object.write_config(config_path=config_path,
+                                            settings={"machine_stats_path": "",
+                                                      "report_sweep_interval_seconds": 0,
+                                                      "run_metrics_path": "",
+                                                      "token_cache_path": ""})
+            config = configparser.ConfigParser(interpolation=None)
+            config.read(config_path)
+            for site_name in site_names:
+                site_section = dict(config["ags_prod_machine_names"])
+                for option in ("csv_output_file_path", "inventory_cache_path", "collection_state_path"):
+                    site_section[option] = os.path.join(run_folder, f"{site_name}_{option}")
+                config[f"{MultiSiteCollection.SITE_SECTION_PREFIX}{site_name}"] = site_section
+            with open(config_path, "w") as config_file_handler:
+                config.write(config_file_handler)
+            combined_csv_path = os.path.join(run_folder, "combined.csv")
+
+            print(f"{'cycle':>5} {'seconds':>8} {'rows':>6}  failed sites")
+            for cycle in range(arguments.cycles):
+                if os.path.exists(combined_csv_path):
+                    os.remove(combined_csv_path)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    failed_site_names = MultiSiteCollection.collect_sites_once(
+                        config_path=config_path,
+                        site_names=site_names,
+                        combined_csv_path=combined_csv_path,
+                        max_workers=arguments.max_workers,
+                        run_function=functools.partial(run_site_or_crash, crash_site_names=crash_site_names))
+                seconds = time.perf_counter() - start
+                collected_site_names, row_count = combined_site_names(csv_path=combined_csv_path)
+                print(f"{cycle + 1:>5} {seconds:>8.2f} {row_count:>6}  {sorted(failed_site_names)}")
+                if set(failed_site_names) & healthy_site_names or not healthy_site_names <= collected_site_names:
+                    isolated = False
+    finally:
+        mock_server_object.stop()
+
+    if not isolated:
+        print("FAILED: a site that did not crash failed or is missing from the combined csv")
+        sys.exit(1)
+    print(f"Sites isolated: {len(healthy_site_names)} healthy site(s) collected in every cycle")
+
+
+if __name__ == "__main__":
+    main()
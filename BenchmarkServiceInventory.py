@@ -0,0 +1,258 @@
+"""
+Benchmark ServiceInventory.ServiceInventoryObject against the FolderObject and ServiceObject classes it replaced in
+CreateUsageReport_MOD.py.
+
+Copies of the replaced classes are kept here as the baseline. For each inventory size a synthetic site of folders and
+services is built both ways from the same folder json, and the build time, the memory allocated while building
+(measured with tracemalloc), the time to create the master url list, and the time to find the services of a type are
+reported. The time and size of saving the inventory are compared too: the replaced classes were saved as a json
+snapshot, the new inventory in its binary format.
+Date: 20261016
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+import ServiceInventory
+
+SERVICE_TYPES = ("MapServer", "FeatureServer", "GPServer", "ImageServer", "GeocodeServer")
+
+
+class AdminObject:
+    """Copy of the AdminObject class of CreateUsageReport_MOD.py, the base of the replaced classes."""
+
+    ADMIN_SERVICES_ENDING = "arcgis/admin/services"
+    GEODATA_ROOT = "https://geodata.md.gov/imap/rest/services"
+    REST_URL_ENDING = "arcgis/rest/services"
+
+    def __init__(self, root_machine_url):
+        self.root_machine_url = root_machine_url
+        self.admin_services_url = root_machine_url
+        self.rest_url_machine_root = root_machine_url
+
+    @property
+    def admin_services_url(self):
+        return self.__admin_services_url
+
+    @admin_services_url.setter
+    def admin_services_url(self, value):
+        self.__admin_services_url = f"{value}/{AdminObject.ADMIN_SERVICES_ENDING}"
+
+    @property
+    def rest_url_machine_root(self):
+        return self.__rest_url_machine_root
+
+    @rest_url_machine_root.setter
+    def rest_url_machine_root(self, value):
+        self.__rest_url_machine_root = f"{value}/{AdminObject.REST_URL_ENDING}"
+
+
+class FolderObject(AdminObject):
+    """Copy of the replaced FolderObject class."""
+
+    def __init__(self, name, root_machine_url):
+        super().__init__(root_machine_url=root_machine_url)
+        self.name = name
+        self.folder_geodata_url = name
+        self.folder_machine_url = name
+        self.folder_short_services_url = name
+        self.service_objects_list = []
+
+    @property
+    def folder_geodata_url(self):
+        return self.__folder_geodata_url
+
+    @folder_geodata_url.setter
+    def folder_geodata_url(self, value):
+        self.__folder_geodata_url = f"{AdminObject.GEODATA_ROOT}/{value}"
+
+    @property
+    def folder_machine_url(self):
+        return self.__folder_machine_url
+
+    @folder_machine_url.setter
+    def folder_machine_url(self, value):
+        self.__folder_machine_url = f"{self.rest_url_machine_root}/{value}"
+
+    @property
+    def folder_short_services_url(self):
+        return self.__folder_short_service_url
+
+    @folder_short_services_url.setter
+    def folder_short_services_url(self, value):
+        self.__folder_short_service_url = f"services/{value}"
+
+
+class ServiceObject(AdminObject):
+    """Copy of the replaced ServiceObject class."""
+
+    def __init__(self, folder, service_json, root_machine_url):
+        super().__init__(root_machine_url=root_machine_url)
+        self.folder = folder
+        self.service_name = service_json
+        self.service_type = service_json
+        self.service_short_services_url = None
+
+    @property
+    def service_name(self):
+        return self.__service_name
+
+    @service_name.setter
+    def service_name(self, value):
+        self.__service_name = value['name']
+
+    @property
+    def service_type(self):
+        return self.__service_type
+
+    @service_type.setter
+    def service_type(self, value):
+        self.__service_type = value['type']
+
+    @property
+    def service_short_services_url(self):
+        return self.__service_short_services_url
+
+    @service_short_services_url.setter
+    def service_short_services_url(self, value):
+        self.__service_short_services_url = f"services/{self.service_name}.{self.service_type}"
+
+
+def build_legacy(folders_json, root_machine_url):
+    folder_objects_list = []
+    for folder_name, services_json in folders_json:
+        fold_obj = FolderObject(name=folder_name, root_machine_url=root_machine_url)
+        for service_json in services_json:
+            fold_obj.service_objects_list.append(ServiceObject(folder=folder_name,
+                                                               service_json=service_json,
+                                                               root_machine_url=root_machine_url))
+        folder_objects_list.append(fold_obj)
+    return folder_objects_list
+
+
+def build_inventory(folders_json):
+    service_inventory_object = ServiceInventory.ServiceInventoryObject()
+    for folder_name, services_json in folders_json:
+        service_inventory_object.add_folder(folder_name=folder_name)
+        service_inventory_object.add_services_json(folder_name=folder_name, services_json=services_json)
+    return service_inventory_object
+
+
+def create_folders_json(folder_count, service_count):
+    """
+    Create the folder contents a crawl of a synthetic site would return, with the services spread across the folders
+    and the service types in turn.
+    :param folder_count: number of folders, not counting the root folder
+    :param service_count: number of services
+    :return: list of (folder name, list of service json objects) tuples, root folder first
+    """
+    folder_names = [""] + [f"Folder{folder_index:03d}" for folder_index in range(folder_count)]
+    folders_json = [(folder_name, []) for folder_name in folder_names]
+    for service_index in range(service_count):
+        folder_name, services_json = folders_json[service_index % len(folders_json)]
+        service_name = f"{folder_name}/Service{service_index:05d}" if folder_name else f"Service{service_index:05d}"
+        services_json.append({"name": service_name, "type": SERVICE_TYPES[service_index % len(SERVICE_TYPES)]})
+    return folders_json
+
+
+def legacy_master_url_list(folder_objects_list):
+    master_list = []
+    for obj_fold in folder_objects_list:
+        if obj_fold.folder_short_services_url != "services/":
+            master_list.append(obj_fold.folder_short_services_url)
+            for obj_serv in obj_fold.service_objects_list:
+                master_list.append(obj_serv.service_short_services_url)
+    return master_list
+
+
+def legacy_snapshot_bytes(folder_objects_list):
+    folders = {fold_obj.name: {"crawled": 0.0,
+                               "services": [{"name": serv_obj.service_name, "type": serv_obj.service_type}
+                                            for serv_obj in fold_obj.service_objects_list]}
+               for fold_obj in folder_objects_list}
+    return json.dumps({"checked": 0.0, "folders": folders}).encode("utf-8")
+
+
+def measure_memory(function):
+    """
+    Measure the memory still allocated by the result of a call.
+    :param function: function to be called
+    :return: tuple of the result and the number of bytes allocated
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        allocated, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, allocated
+
+
+def time_call(function, repeat):
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start)
+    return statistics.median(wall_times)
+
+
+def main():
+    """
+    Run the benchmark for every inventory size and print the replaced classes and the new inventory side by side.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the compact service inventory against the replaced classes")
+    parser.add_argument("--services", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--folders", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    root_machine_url = "https://gis-ags-imap01p.mdgov.maryland.gov:6443"
+    for service_count in arguments.services:
+        folders_json = create_folders_json(folder_count=arguments.folders, service_count=service_count)
+        folder_objects_list, legacy_bytes = measure_memory(
+            lambda: build_legacy(folders_json=folders_json, root_machine_url=root_machine_url))
+        service_inventory_object, inventory_bytes = measure_memory(
+            lambda: build_inventory(folders_json=folders_json))
+        if legacy_master_url_list(folder_objects_list) != service_inventory_object.master_url_list():
+            raise RuntimeError("The inventory's master url list differs from the replaced classes'")
+
+        legacy_snapshot = legacy_snapshot_bytes(folder_objects_list=folder_objects_list)
+        inventory_snapshot = service_inventory_object.to_bytes()
+        measurements = [
+            ("build", time_call(lambda: build_legacy(folders_json=folders_json, root_machine_url=root_machine_url),
+                                repeat=arguments.repeat),
+             time_call(lambda: build_inventory(folders_json=folders_json), repeat=arguments.repeat)),
+            ("master url list", time_call(lambda: legacy_master_url_list(folder_objects_list), arguments.repeat),
+             time_call(service_inventory_object.master_url_list, arguments.repeat)),
+            ("services of type",
+             time_call(lambda: [serv_obj for fold_obj in folder_objects_list
+                                for serv_obj in fold_obj.service_objects_list
+                                if serv_obj.service_type == "FeatureServer"], arguments.repeat),
+             time_call(lambda: service_inventory_object.services_of_type(service_type="FeatureServer"),
+                       arguments.repeat)),
+            ("save", time_call(lambda: legacy_snapshot_bytes(folder_objects_list=folder_objects_list),
+                               arguments.repeat),
+             time_call(service_inventory_object.to_bytes, arguments.repeat)),
+            ("load", time_call(lambda: json.loads(legacy_snapshot), arguments.repeat),
+             time_call(lambda: ServiceInventory.ServiceInventoryObject.from_bytes(content=inventory_snapshot),
+                       arguments.repeat)),
+        ]
+
+        print(f"{service_count} services in {arguments.folders + 1} folders")
+        print(f"{'':<18} {'replaced':>12} {'inventory':>12} {'ratio':>7}")
+        print(f"{'memory':<18} {legacy_bytes / 2 ** 20:>8.1f} MiB {inventory_bytes / 2 ** 20:>8.1f} MiB "
+              f"{legacy_bytes / inventory_bytes:>6.1f}x")
+        print(f"{'saved size':<18} {len(legacy_snapshot) / 2 ** 20:>8.1f} MiB "
+              f"{len(inventory_snapshot) / 2 ** 20:>8.1f} MiB {len(legacy_snapshot) / len(inventory_snapshot):>6.1f}x")
+        for name, legacy_time, inventory_time in measurements:
+            print(f"{name:<18} {legacy_time * 1000:>9.1f} ms {inventory_time * 1000:>9.1f} ms "
+                  f"{legacy_time / inventory_time:>6.1f}x")
+        print()
+
+
+if __name__ == "__main__":
+    main()
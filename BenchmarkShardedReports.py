@@ -0,0 +1,166 @@
+"""
+Benchmark the sharded usage report mode of CreateUsageReport_MOD.py against the single report path and find the
+number of resourceURIs at which sharding starts to pay off.
+
+By default every run is made against MockArcGISServer.py, whose report query time grows with the number of
+resourceURIs and which works on a limited number of report queries at once. The crossover found that way depends on
+those settings, so they can be adjusted to match a real site. With --config the shard sizes are compared against a
+real site instead, for its current number of services.
+Each run uses its own temporary folder for the csv and caches. The inventory cache is warmed by an untimed run first
+so that the timings are dominated by report creation, querying, merging, and deletion. Against the mock server it is
+first checked that a persistent report name is rejected together with a shard size, as sharded reports are temporary;
+the benchmark exits with status 1 when the script runs with both instead.
+Date: 20261016
+"""
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import CreateUsageReport_MOD
+import MockArcGISServer
+
+
+def check_persistent_report_rejected(mock_server_object):
+    """
+    Run the script with both a persistent report name and a shard size and check that it exits before it creates any
+    report on the server.
+    :param mock_server_object: started MockArcGISServer.MockServerObject
+    :return: True when the combination was rejected
+    """
+    mock_server_object.reports.clear()
+    with tempfile.TemporaryDirectory() as run_folder:
+        config_path = os.path.join(run_folder, "persistent_sharded.cfg")
+        mock_server_object.write_config(config_path=config_path,
+                                        settings={"csv_output_file_path": os.path.join(run_folder, "Usage.csv"),
+                                                  "inventory_cache_path": "",
+                                                  "machine_stats_path": "",
+                                                  "persistent_report_name": "BenchmarkReport",
+                                                  "report_shard_size": 1,
+                                                  "token_cache_path": ""})
+        exited = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                CreateUsageReport_MOD.main(["--config", config_path])
+            except SystemExit:
+                exited = True
+        csv_written = os.path.exists(os.path.join(run_folder, "Usage.csv"))
+    return exited and not csv_written and not mock_server_object.reports
+
+
+def time_script_runs(config_path, repeat):
+    """
+    Run the script once untimed to warm the caches and then time it repeatedly.
+    :param config_path: path of the config file the script is run with
+    :param repeat: number of timed runs
+    :return: median wall time in seconds
+    """
+    wall_times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        CreateUsageReport_MOD.main(["--config", config_path])
+        for _ in range(repeat):
+            start = time.perf_counter()
+            CreateUsageReport_MOD.main(["--config", config_path])
+            wall_times.append(time.perf_counter() - start)
+    return statistics.median(wall_times)
+
+
+def write_settings(config_path, base_config_path, settings):
+    """
+    Copy a config file, replacing options in its usage_report_settings section.
+    :param config_path: path of the config file to be written
+    :param base_config_path: path of the config file to be copied
+    :param settings: dictionary of usage_report_settings options
+    :return: None
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(base_config_path)
+    if not config.has_section("usage_report_settings"):
+        config.add_section("usage_report_settings")
+    for key, value in settings.items():
+        config["usage_report_settings"][key] = str(value)
+    with open(config_path, "w") as config_file_handler:
+        config.write(config_file_handler)
+
+
+def main():
+    """
+    Run the benchmark and print the median wall time of every shard size for every site size.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark sharded usage reports against the single report path")
+    parser.add_argument("--config", help="benchmark against the site in this config rather than the mock server")
+    parser.add_argument("--folder-counts", default="5,20,50,100", help="comma separated mock site sizes, in folders")
+    parser.add_argument("--services-per-folder", type=int, default=20)
+    parser.add_argument("--shard-sizes", default="0,100,250,500", help="comma separated, 0 is the single report path")
+    parser.add_argument("--shard-workers", type=int, default=4)
+    parser.add_argument("--report-base-latency", type=float, default=0.05)
+    parser.add_argument("--report-uri-latency", type=float, default=0.001)
+    parser.add_argument("--report-concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+    shard_sizes = [int(value) for value in arguments.shard_sizes.split(",")]
+    folder_counts = [None] if arguments.config else [int(value) for value in arguments.folder_counts.split(",")]
+
+    print(f"{'resourceURIs':>12} " + " ".join(f"{f'shard {size}' if size else 'single':>12}" for size in shard_sizes))
+    crossover = {}
+    for folder_count in folder_counts:
+        mock_server_object = None
+        if folder_count is not None:
+            mock_server_object = MockArcGISServer.MockServerObject(
+                folder_count=folder_count,
+                services_per_folder=arguments.services_per_folder,
+                report_base_latency=arguments.report_base_latency,
+                report_uri_latency=arguments.report_uri_latency,
+                report_concurrency=arguments.report_concurrency).start()
+            if not check_persistent_report_rejected(mock_server_object=mock_server_object):
+                mock_server_object.stop()
+                print("FAILED: the script ran with both persistent_report_name and report_shard_size")
+                sys.exit(1)
+        try:
+            with tempfile.TemporaryDirectory() as run_folder:
+                base_config_path = arguments.config
+                if mock_server_object is not None:
+                    base_config_path = os.path.join(run_folder, "base.cfg")
+                    mock_server_object.write_config(config_path=base_config_path)
+                median_times = []
+                for shard_size in shard_sizes:
+                    config_path = os.path.join(run_folder, f"shard_{shard_size}.cfg")
+                    write_settings(config_path=config_path,
+                                   base_config_path=base_config_path,
+                                   settings={"csv_output_file_path": os.path.join(run_folder, "UsageStatistics.csv"),
+                                             "inventory_cache_path": os.path.join(run_folder, "inventory.bin"),
+                                             "inventory_cache_ttl_seconds": 86400,
+                                             "machine_stats_path": "",
+                                             "report_shard_size": shard_size,
+                                             "report_shard_workers": arguments.shard_workers,
+                                             "report_sweep_interval_seconds": 0,
+                                             "run_metrics_path": "",
+                                             "token_cache_path": ""})
+                    median_times.append(time_script_runs(config_path=config_path, repeat=arguments.repeat))
+        finally:
+            if mock_server_object is not None:
+                mock_server_object.stop()
+
+        uri_count = "site" if folder_count is None else folder_count * (arguments.services_per_folder + 1)
+        print(f"{uri_count:>12} " + " ".join(f"{median_time:>11.3f}s" for median_time in median_times))
+        single_time = median_times[shard_sizes.index(0)] if 0 in shard_sizes else None
+        for shard_size, median_time in zip(shard_sizes, median_times):
+            # A shard size at least as large as the site runs the single report path, which is not a crossover
+            is_sharded = shard_size and (folder_count is None or shard_size < uri_count)
+            if is_sharded and single_time is not None and median_time < single_time and shard_size not in crossover:
+                crossover[shard_size] = uri_count
+
+    for shard_size in shard_sizes:
+        if shard_size:
+            print(f"shard {shard_size}: faster than the single report from {crossover.get(shard_size, 'never')} "
+                  f"resourceURIs")
+
+
+if __name__ == "__main__":
+    main()
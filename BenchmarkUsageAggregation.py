@@ -0,0 +1,173 @@
+"""
+Benchmark the vectorized rollups in UsageAggregation.py on a synthetic usage report against the row by row Python
+loops they replace.
+
+A synthetic report of 5,000 services by 2,880 one-minute buckets (48 hours) is generated, written to a csv, and
+parsed with read_usage_matrix(). Every rollup is then timed on the full matrix. The row by row baseline is timed on a
+subset of the rows, because it takes minutes on the full matrix, and scaled up to the full row count; the scaled
+figures are marked as estimates. Every tenth folder has a dot in its name, and the benchmark exits with status 1
+when the folder totals do not hold exactly the synthetic folders with the sums of their services.
+Date: 20261016
+"""
+import argparse
+import csv
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import UsageAggregation
+
+
+def baseline_folder_totals(rows):
+    totals = {}
+    for resource_name, values in rows:
+        folder_name, is_service = UsageAggregation.folder_of_resource(resource_uri=resource_name)
+        if not is_service:
+            continue
+        folder_totals = totals.setdefault(folder_name, [0.0] * len(values))
+        for index, value in enumerate(values):
+            folder_totals[index] += value
+    return totals
+
+
+def baseline_hourly_rollup(rows, buckets_per_hour=60):
+    return [(resource_name, [sum(values[index:index + buckets_per_hour])
+                             for index in range(0, len(values), buckets_per_hour)]) for resource_name, values in rows]
+
+
+def baseline_percentiles(rows, percentile=95):
+    result = []
+    for resource_name, values in rows:
+        ordered = sorted(values)
+        result.append((resource_name, ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]))
+    return result
+
+
+def baseline_top_services(rows, count=10):
+    totals = [(sum(values), resource_name) for resource_name, values in rows
+              if UsageAggregation.folder_of_resource(resource_uri=resource_name)[1]]
+    return sorted(totals, reverse=True)[:count]
+
+
+def create_synthetic_report(csv_path, service_count, bucket_count, folder_count, seed=0):
+    """
+    Write a synthetic usage report csv with a folder row for every folder and a row for every service. Every tenth
+    folder is named like 'Dept.Data010', with a dot that must not be taken for a service type.
+    :param csv_path: path of the csv to be written
+    :param service_count: number of service rows
+    :param bucket_count: number of one-minute time buckets
+    :param folder_count: number of folders the services are spread across
+    :param seed: random seed, so that runs are comparable
+    :return: dictionary of the name of every folder with services to its values, which are the sums of its services
+    """
+    random_generator = np.random.default_rng(seed)
+    start_milliseconds = 1_700_000_000_000 - 1_700_000_000_000 % 86_400_000
+    time_slices = start_milliseconds + np.arange(bucket_count, dtype=np.int64) * 60_000
+    service_rates = random_generator.gamma(shape=0.5, scale=20.0, size=service_count)
+    folder_totals = {}
+    with open(csv_path, "w", newline="") as csv_file_handler:
+        writer = csv.writer(csv_file_handler, lineterminator="\n")
+        writer.writerow(["Resource", "Metric"] + [str(time_slice) for time_slice in time_slices])
+        for folder_index in range(folder_count):
+            folder_name = f"Dept.Data{folder_index:03d}" if folder_index % 10 == 0 else f"Folder{folder_index:03d}"
+            service_indexes = range(folder_index, service_count, folder_count)
+            folder_values = np.zeros(bucket_count, dtype=np.int64)
+            service_lines = []
+            for service_index in service_indexes:
+                values = random_generator.poisson(lam=service_rates[service_index], size=bucket_count)
+                folder_values += values
+                service_lines.append(f"services/{folder_name}/Service{service_index:05d}.MapServer,RequestCount,"
+                                     + ",".join(map(str, values.tolist())))
+            csv_file_handler.write(f"services/{folder_name},RequestCount," + ",".join(map(str, folder_values.tolist()))
+                                   + "\n")
+            csv_file_handler.write("\n".join(service_lines) + "\n")
+            if service_lines:
+                folder_totals[folder_name] = folder_values
+    return folder_totals
+
+
+def time_call(function, repeat):
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start)
+    return statistics.median(wall_times)
+
+
+def main():
+    """
+    Run the benchmark and print the median time of each rollup, vectorized and row by row.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark vectorized usage rollups against row by row loops")
+    parser.add_argument("--services", type=int, default=5000)
+    parser.add_argument("--buckets", type=int, default=2880)
+    parser.add_argument("--folders", type=int, default=100)
+    parser.add_argument("--baseline-rows", type=int, default=250, help="rows the row by row baseline is timed on")
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as run_folder:
+        csv_path = os.path.join(run_folder, "UsageStatistics.csv")
+        expected_folder_totals = create_synthetic_report(csv_path=csv_path,
+                                                         service_count=arguments.services,
+                                                         bucket_count=arguments.buckets,
+                                                         folder_count=arguments.folders)
+        print(f"Synthetic report: {arguments.services} services x {arguments.buckets} buckets, "
+              f"{os.path.getsize(csv_path) / 2 ** 20:.1f} MiB")
+
+        parse_time = time_call(lambda: UsageAggregation.read_usage_matrix(csv_path=csv_path), repeat=1)
+        usage_matrix_object = UsageAggregation.read_usage_matrix(csv_path=csv_path)
+
+        with open(csv_path, "r", newline="") as csv_file_handler:
+            reader = csv.reader(csv_file_handler)
+            next(reader)
+            baseline_rows = []
+            for row in reader:
+                baseline_rows.append((row[0], [float(value) for value in row[2:]]))
+                if len(baseline_rows) >= arguments.baseline_rows:
+                    break
+
+    folder_names, folder_totals = usage_matrix_object.folder_totals()
+    if folder_names.tolist() != sorted(expected_folder_totals) or not all(
+            np.array_equal(totals, expected_folder_totals[folder_name])
+            for folder_name, totals in zip(folder_names, folder_totals)):
+        print("FAILED: the folder totals do not match the synthetic folders, dotted folder names included")
+        sys.exit(1)
+
+    row_count = len(usage_matrix_object.resource_names)
+    scale = row_count / max(1, len(baseline_rows))
+    rollups = [
+        ("top 10 services", lambda: usage_matrix_object.top_services(count=10),
+         lambda: baseline_top_services(rows=baseline_rows)),
+        ("folder totals", lambda: usage_matrix_object.folder_totals(),
+         lambda: baseline_folder_totals(rows=baseline_rows)),
+        ("p50/p95/p99", lambda: usage_matrix_object.percentiles(percentiles=(50, 95, 99)),
+         lambda: baseline_percentiles(rows=baseline_rows)),
+        ("resample 5m", lambda: usage_matrix_object.resample(rule="5m"), None),
+        ("resample 1h", lambda: usage_matrix_object.resample(rule="1h"),
+         lambda: baseline_hourly_rollup(rows=baseline_rows)),
+        ("resample 1d", lambda: usage_matrix_object.resample(rule="1d"), None),
+    ]
+
+    print(f"{'parse csv':<16} {parse_time * 1000:>10.1f} ms")
+    print(f"{'rollup':<16} {'vectorized':>13} {'row by row (est.)':>19} {'speedup':>9}")
+    for name, vectorized_function, baseline_function in rollups:
+        # The first call also fills the zero-filled counts that later rollups share, so it is not timed
+        vectorized_function()
+        vectorized_time = time_call(vectorized_function, repeat=arguments.repeat)
+        if baseline_function is None:
+            print(f"{name:<16} {vectorized_time * 1000:>10.1f} ms {'-':>19} {'-':>9}")
+            continue
+        baseline_time = time_call(baseline_function, repeat=1) * scale
+        print(f"{name:<16} {vectorized_time * 1000:>10.1f} ms {baseline_time * 1000:>16.1f} ms "
+              f"{baseline_time / vectorized_time:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,9 @@ randomly and frequently. We first adapted using a while loop for handling failur
 until a call when through and this is how we bypassed the issue. The issue appeared on multiple scripts so an overhaul
 was performed and we abandoned calls to the web adaptor and instead hit the machiens by their direct path referencing
 their name rather than using the domain.
-Contains AdminObject, FolderObject, MachineObject, ReportObject, ServiceObject, and NotJSONException classes.
+Contains AdminObject, ClientObject, ConcurrencyGovernorObject, InventoryCacheObject, MachineObject,
+MachineSelectorObject, PipelineObject, ReportObject, ReportQueryException, RunMetricsObject, TokenCacheObject,
+TransientResponseException, and NotJSONException classes.
 Original Design: JCahoon
 Overhaul Author: CJuice
 Date: 20180831
@@ -18,49 +20,246 @@ Revised: This script is an overhaul of a previous script. The previous script us
  the requests module and is consequently significantly different. This script was designed at ArcGIS Server 10.6
 Revised: 20180911, JC: Revised the create_master_url_list() function. Needed to skip the root 'services/' folder when
     inventorying services. Added a check for this root folder.
+Revised: 20261016: Folder services are inventoried concurrently by a bounded pool of worker threads
+    (usage_report_settings/crawl_max_workers). Results are kept in folder order and a failed folder is reported
+    without stopping the crawl.
+Revised: 20261016: All requests go through ClientObject, which keeps a pooled keep-alive requests Session per
+    machine with configurable pool size and connect/read timeouts, so the TLS handshake is paid once per machine.
+Revised: 20261016: The report query is streamed and write_response_to_csv() writes it in large chunks to a temporary
+    file that is atomically renamed onto CSV_OUTPUT_FILE_PATH.
+Revised: 20261016: Tokens come from TokenCacheObject, which stores each token and its expiry in a locked local file
+    keyed by machine and username, reuses it until shortly before expiry, and refreshes it when the server rejects it.
+Revised: 20261016: The folder and service inventory is cached by InventoryCacheObject. Within the TTL no inventory
+    requests are made; after it, only the folders list is requested and only added or stale folders are re-crawled.
+Revised: 20261016: MachineSelectorObject replaces the random machine choice. All machines are probed concurrently,
+    the fastest healthy one is used, latency and error rates are remembered between runs, and requests fail over to the
+    next-best machine on connection errors or html error pages.
+Revised: 20261016: Optional sharded report mode (usage_report_settings/report_shard_size). The master url list is split
+    into batches, one report per batch is created, queried, and deleted in parallel, and the shard csv files are merged
+    into one csv with a single header. The config path (--config), csv output path, and machine root url template
+    are configurable so that the script can be benchmarked against a local stand-in server.
+Revised: 20261016: Optional incremental collection (usage_report_settings/incremental_collection). Only the time since
+    the last successful collection, plus an overlap, is requested and merged into the csv with UsageReportCSV, which
+    de-duplicates the overlap and trims the csv to the report window.
+Revised: 20261016: Optional local time series store (usage_report_settings/time_series_store_path). Each report is
+    appended to memory-mapped NumPy segments with a resource name index by UsageTimeSeriesStore, so history can be
+    kept for weeks and queried without re-parsing csv text.
+Revised: 20261016: Transient failures no longer exit the script. get_response() retries connection errors, timeouts,
+    html error pages, http 429, 502, 503, and 504 answers, ArcGIS errors with a known transient message, and token
+    rejections with bounded exponential backoff within a per-call deadline, failing over between machines, and only
+    gives up once the attempts or the deadline run out. A report query that has not been answered after
+    usage_report_settings/report_hedge_after_seconds is duplicated to a second machine and the first answer is used.
+Revised: 20261016: RunMetricsObject times every phase of a run and records the status, response size, and latency of
+    every request attempt per machine. At the end of each run, including a failed one, it can write a json run record
+    (usage_report_settings/run_metrics_path) and a Prometheus textfile collector file with per-machine latency
+    histograms (usage_report_settings/prometheus_textfile_path). Both are off by default.
+Revised: 20261016: Daemon mode (--daemon). The pipeline is collect_usage_report() and runs once by default or, as a
+    daemon, every usage_report_settings/daemon_interval_seconds plus jitter, with cycles that never overlap. Sessions,
+    tokens, machine statistics, and the inventory snapshot stay warm between cycles. SIGTERM and SIGINT stop the
+    daemon once the current cycle has finished.
+Revised: 20261016: The FolderObject and ServiceObject classes are replaced by ServiceInventory.ServiceInventoryObject,
+    which keeps folder and service names in compact arrays with lazily built indexes by folder, service type, and short
+    url. InventoryCacheObject stores it in its binary format (inventory_cache.bin) instead of json.
+Revised: 20261017: Optional persistent report (usage_report_settings/persistent_report_name). One named report is kept
+    on the server, edited only when its urls or time span change, and otherwise only queried; a 24 hour or one week
+    window uses a relative time span so that its definition does not change from run to run. Temporary reports left
+    behind by interrupted runs are swept every usage_report_settings/report_sweep_interval_seconds.
+Revised: 20261017: Multi-site collection. --site <name> collects the site in a [site:<name>] section of the config,
+    with its own machines, credentials, settings, and site-named files, and --all-sites runs every site in its own
+    worker process with MultiSiteCollection and combines the site csv files. Any number of machine<N> options is read.
+Revised: 20261017: ConcurrencyGovernorObject limits the admin requests in flight to each machine. The limit rises
+    additively while the machine answers promptly and falls multiplicatively on failures, html error pages, and
+    latency above usage_report_settings/concurrency_latency_tolerance times the usual latency, up to
+    usage_report_settings/concurrency_max_limit. The limits and queues are part of the run metrics.
+Revised: 20261017: Backfill mode (--backfill START END). The range is split into report-sized windows
+    (usage_report_settings/backfill_window_hours) that are collected in parallel into csv files in
+    usage_report_settings/backfill_path, and into the time series store when there is one. Completed windows are
+    checkpointed, so an interrupted backfill resumes where it stopped. inventory_site() is shared with the regular run.
+Revised: 20261017: The time series store keeps 15 minute, hourly, and daily rollups that are updated as each report is
+    ingested and pruned by their own retention (usage_report_settings/time_series_retention_days_15m, _1h, and _1d).
+Revised: 20261017: Optional dashboard payload (usage_report_settings/dashboard_payload_path). DashboardPayload writes
+    the site, folder, and service totals and sparklines of the csv as compact json with gzip and brotli precompressed
+    copies, each rewritten only when its content hash changes.
+Revised: 20261017: Optional machine breakdown (usage_report_settings/machine_breakdown_csv_path). The report is also
+    queried once per machine with a machine filter, concurrently and each on its own machine, alongside the query of
+    the whole site, and the results are combined into one csv with a Machine column.
+Revised: 20261017: Profiling mode (--profile <folder>). RunProfiler profiles every run metrics phase with cProfile,
+    including worker threads, and tracemalloc, and writes the sorted stats and top allocation sites of each phase to a
+    folder for the run. RunProfiler.py compares two profiled runs and reports the phases and functions that regressed.
+Revised: 20261017: Pipelined execution (usage_report_settings/pipelined_execution). PipelineObject runs the steps the
+    report does not wait for in the background: the inventory cache is read while the machines are probed, the time
+    series store is opened while the site is inventoried, and stale reports are swept and the report is deleted while
+    it is collected and stored. The report is parsed into a usage matrix for the store and the dashboard payload as it
+    downloads rather than read back from the csv.
 """
 
 
-def main():
+def main(argv=None):
     """
     Run the script if it is the primary call and not an import to another script.
+    :param argv: list of command line arguments, defaults to the arguments the script was called with
     :return: None
     """
 
     # IMPORTS
+    import argparse
     import calendar
+    import concurrent.futures
     import configparser
+    import contextlib
     import datetime
+    import hashlib
     import json
+    import MultiSiteCollection
     import os
     import random
+    import re
     import requests
+    import ServiceInventory
+    import signal
+    import struct
+    import tempfile
+    import threading
+    import time
     import uuid
+    import UsageReportCSV
     # NOTE: Believe urllib3 is included in requests module but to manage InsecureRequestWarning was also imported.
     #   Without disabled warnings, every request would print a red warning. This is because we have chosen
     #   'verify=False' when making requests to secure services.
     import urllib3
     from urllib3.exceptions import InsecureRequestWarning
     urllib3.disable_warnings(InsecureRequestWarning)
+    # NOTE: File locking is platform specific. Production runs on Windows, development may not.
+    if os.name == "nt":
+        import msvcrt
+    else:
+        import fcntl
 
     # VARIABLES
     _ROOT_PROJECT_PATH = os.path.dirname(__file__)
-    CREDENTIALS_PATH = os.path.join(_ROOT_PROJECT_PATH, "Docs/credentials.cfg")
+    parser = argparse.ArgumentParser(description="Create, query, and delete a usage report for all services in a site")
+    parser.add_argument("--config", default=os.path.join(_ROOT_PROJECT_PATH, "Docs/credentials.cfg"),
+                        help="path of the credentials and settings file")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running, collecting every usage_report_settings/daemon_interval_seconds")
+    site_group = parser.add_mutually_exclusive_group()
+    site_group.add_argument("--site", help="collect the site in the [site:<name>] section of the config")
+    site_group.add_argument("--all-sites", action="store_true",
+                            help="collect every [site:<name>] section in parallel and combine the csv files")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"),
+                        help="collect the usage between two UTC times, YYYY-MM-DD or YYYY-MM-DDTHH:MM, in checkpointed "
+                             "windows, resuming an interrupted backfill of the same range")
+    parser.add_argument("--profile", metavar="PROFILE_FOLDER",
+                        help="profile the run's CPU time and memory allocations phase by phase into a folder for the "
+                             "run in this folder, to be read and compared with RunProfiler.py")
+    arguments = parser.parse_args(argv)
+    if arguments.backfill and (arguments.daemon or arguments.all_sites):
+        parser.error("--backfill cannot be combined with --daemon or --all-sites")
+    if arguments.profile and (arguments.daemon or arguments.all_sites):
+        parser.error("--profile cannot be combined with --daemon or --all-sites")
+    CREDENTIALS_PATH = arguments.config
     config = configparser.ConfigParser()
     config.read(filenames=CREDENTIALS_PATH)
 
+    #   A site run uses the machines, credentials, and settings of its [site:<name>] section and names its files after
+    #       the site. With --all-sites this process collects nothing itself: each site is run with --site in a worker
+    #       process of its own and the site csv files are combined.
+    if arguments.all_sites:
+        MultiSiteCollection.collect_sites(config_path=CREDENTIALS_PATH, config=config, daemon=arguments.daemon)
+        return
+    if arguments.site:
+        try:
+            MultiSiteCollection.apply_site_section(config=config, site_name=arguments.site)
+        except ValueError as ve:
+            print(ve)
+            exit()
+
     # CSV_OUTPUT_FILE_PATH = r"D:\inetpub\wwwroot\DOIT\StatusDashboard\temp\UsageStatistics.csv"               # PRODUCTION.
     # *********DOIT folder DNE on imap01d
-    CSV_OUTPUT_FILE_PATH = f"{_ROOT_PROJECT_PATH}/UsageStatistics.csv"                                          # TESTING
+    CSV_OUTPUT_FILE_PATH = config.get("usage_report_settings", "csv_output_file_path",
+                                      fallback=f"{_ROOT_PROJECT_PATH}/UsageStatistics.csv")                  # TESTING
+    BACKFILL_MAX_WORKERS = config.getint("usage_report_settings", "backfill_max_workers", fallback=4)
+    BACKFILL_PATH = config.get("usage_report_settings", "backfill_path", fallback=f"{_ROOT_PROJECT_PATH}/backfill")
+    BACKFILL_WINDOW_HOURS = config.getint("usage_report_settings", "backfill_window_hours",
+                                          fallback=config.getint("usage_report_settings", "report_window_hours",
+                                                                 fallback=48))
+    CSV_CHUNK_SIZE = config.getint("usage_report_settings", "csv_chunk_size", fallback=1024 * 1024)
+    CONCURRENCY_GOVERNOR = config.getboolean("usage_report_settings", "concurrency_governor", fallback=True)
+    CONCURRENCY_INITIAL_LIMIT = config.getint("usage_report_settings", "concurrency_initial_limit", fallback=4)
+    CONCURRENCY_LATENCY_TOLERANCE = config.getfloat("usage_report_settings", "concurrency_latency_tolerance",
+                                                    fallback=2.0)
+    CONCURRENCY_MAX_LIMIT = config.getint("usage_report_settings", "concurrency_max_limit", fallback=8)
+    CRAWL_MAX_WORKERS = config.getint("usage_report_settings", "crawl_max_workers", fallback=8)
+    DAEMON_INTERVAL_SECONDS = config.getfloat("usage_report_settings", "daemon_interval_seconds", fallback=300.0)
+    DAEMON_JITTER_SECONDS = config.getfloat("usage_report_settings", "daemon_jitter_seconds", fallback=30.0)
+    DASHBOARD_BUCKET_MINUTES = config.getint("usage_report_settings", "dashboard_bucket_minutes", fallback=60)
+    DASHBOARD_PAYLOAD_PATH = config.get("usage_report_settings", "dashboard_payload_path", fallback="")
+    DASHBOARD_TOP_SERVICES = config.getint("usage_report_settings", "dashboard_top_services", fallback=50)
+    HTTP_CONNECT_TIMEOUT = config.getfloat("usage_report_settings", "http_connect_timeout", fallback=10.0)
+    HTTP_KEEP_ALIVE = config.getboolean("usage_report_settings", "http_keep_alive", fallback=True)
+    HTTP_POOL_SIZE = config.getint("usage_report_settings", "http_pool_size", fallback=10)
+    HTTP_READ_TIMEOUT = config.getfloat("usage_report_settings", "http_read_timeout", fallback=300.0)
+    COLLECTION_STATE_PATH = config.get("usage_report_settings", "collection_state_path",
+                                       fallback=f"{_ROOT_PROJECT_PATH}/collection_state.json")
+    INCREMENTAL_COLLECTION = config.getboolean("usage_report_settings", "incremental_collection", fallback=False)
+    INCREMENTAL_OVERLAP_MINUTES = config.getint("usage_report_settings", "incremental_overlap_minutes", fallback=5)
+    INVENTORY_CACHE_PATH = config.get("usage_report_settings", "inventory_cache_path",
+                                      fallback=f"{_ROOT_PROJECT_PATH}/inventory_cache.bin")
+    INVENTORY_CACHE_TTL_SECONDS = config.getint("usage_report_settings", "inventory_cache_ttl_seconds", fallback=3600)
+    INVENTORY_FOLDER_MAX_AGE_SECONDS = config.getint("usage_report_settings", "inventory_folder_max_age_seconds",
+                                                     fallback=86400)
+    MACHINE_BREAKDOWN_CSV_PATH = config.get("usage_report_settings", "machine_breakdown_csv_path", fallback="")
+    MACHINE_BREAKDOWN_FILTER_TEMPLATE = config.get("usage_report_settings", "machine_breakdown_filter_template",
+                                                   fallback="{machine_name}")
+    MACHINE_PROBE_TIMEOUT = config.getfloat("usage_report_settings", "machine_probe_timeout", fallback=5.0)
+    MACHINE_STATS_PATH = config.get("usage_report_settings", "machine_stats_path",
+                                    fallback=f"{_ROOT_PROJECT_PATH}/machine_stats.json")
     PASSWORD = config["ags_server_credentials"]["password"]
-    SERVER_MACHINE_NAMES = {0: config['ags_prod_machine_names']["machine1"],
-                            1: config['ags_prod_machine_names']["machine2"],
-                            2: config['ags_prod_machine_names']["machine3"],
-                            3: config['ags_prod_machine_names']["machine4"]}
+    PERSISTENT_REPORT_NAME = config.get("usage_report_settings", "persistent_report_name", fallback="")
+    PIPELINED_EXECUTION = config.getboolean("usage_report_settings", "pipelined_execution", fallback=True)
+    PIPELINE_MAX_WORKERS = config.getint("usage_report_settings", "pipeline_max_workers", fallback=4)
+    PROMETHEUS_TEXTFILE_PATH = config.get("usage_report_settings", "prometheus_textfile_path", fallback="")
+    REPORT_WINDOW_HOURS = config.getint("usage_report_settings", "report_window_hours", fallback=48)
+    REPORT_SHARD_SIZE = config.getint("usage_report_settings", "report_shard_size", fallback=0)
+    REPORT_SHARD_WORKERS = config.getint("usage_report_settings", "report_shard_workers", fallback=4)
+    REPORT_SWEEP_INTERVAL_SECONDS = config.getfloat("usage_report_settings", "report_sweep_interval_seconds",
+                                                    fallback=86400.0)
+    REPORT_SWEEP_MIN_AGE_SECONDS = config.getfloat("usage_report_settings", "report_sweep_min_age_seconds",
+                                                   fallback=7200.0)
+    REPORT_HEDGE_AFTER_SECONDS = config.getfloat("usage_report_settings", "report_hedge_after_seconds", fallback=60.0)
+    REPORT_QUERY_DEADLINE_SECONDS = config.getfloat("usage_report_settings", "report_query_deadline_seconds",
+                                                    fallback=1800.0)
+    REQUEST_BACKOFF_BASE_SECONDS = config.getfloat("usage_report_settings", "request_backoff_base_seconds",
+                                                   fallback=1.0)
+    REQUEST_BACKOFF_MAX_SECONDS = config.getfloat("usage_report_settings", "request_backoff_max_seconds",
+                                                  fallback=30.0)
+    REQUEST_DEADLINE_SECONDS = config.getfloat("usage_report_settings", "request_deadline_seconds", fallback=600.0)
+    REQUEST_MAX_ATTEMPTS = config.getint("usage_report_settings", "request_max_attempts", fallback=5)
+    RUN_METRICS_PATH = config.get("usage_report_settings", "run_metrics_path", fallback="")
+    SERVER_MACHINE_NAMES = {index: config['ags_prod_machine_names'][option] for index, option in enumerate(
+        sorted((option for option in config['ags_prod_machine_names'] if re.fullmatch(r"machine\d+", option)),
+               key=lambda option: int(option[len("machine"):])))}
     SERVER_PORT_SECURE = config['ags_prod_machine_names']["secureport"]
-    SERVER_ROOT_URL = "https://{machine_name}.mdgov.maryland.gov:{port}"
+    SERVER_ROOT_URL = config.get('ags_prod_machine_names', "root_url",
+                                 fallback="https://{machine_name}.mdgov.maryland.gov:{port}")
+    TIME_SERIES_RETENTION_DAYS = config.getint("usage_report_settings", "time_series_retention_days", fallback=35)
+    TIME_SERIES_ROLLUP_RETENTION_DAYS = {
+        900: config.getint("usage_report_settings", "time_series_retention_days_15m", fallback=180),
+        3600: config.getint("usage_report_settings", "time_series_retention_days_1h", fallback=730),
+        86400: config.getint("usage_report_settings", "time_series_retention_days_1d", fallback=0)}
+    TIME_SERIES_STORE_PATH = config.get("usage_report_settings", "time_series_store_path", fallback="")
+    TOKEN_CACHE_PATH = config.get("usage_report_settings", "token_cache_path",
+                                  fallback=f"{_ROOT_PROJECT_PATH}/token_cache.json")
+    TOKEN_EXPIRY_MARGIN_SECONDS = config.getint("usage_report_settings", "token_expiry_margin_seconds", fallback=120)
     USERNAME = config["ags_server_credentials"]["username"]
 
+    #   Sharded reports are temporary, each created and deleted by its shard, so a persistent report cannot be kept
+    #       together with them.
+    if PERSISTENT_REPORT_NAME and REPORT_SHARD_SIZE > 0:
+        print("usage_report_settings/persistent_report_name cannot be combined with report_shard_size, as sharded "
+              "reports are temporary. Set report_shard_size = 0 to keep the persistent report.")
+        exit()
+
     # CLASSES
     class AdminObject:
         """
@@ -101,64 +300,382 @@ def main():
         def rest_url_machine_root(self, value):
             self.__rest_url_machine_root = f"{value}/{AdminObject.REST_URL_ENDING}"
 
-    class FolderObject(AdminObject):
+    class ClientObject:
         """
-        The FolderObject class represents a service folder in the server services and inherits from AdminObject.
+        The ClientObject class owns a pooled, keep-alive requests Session for each server machine and is the single
+        path through which the script makes requests.
 
-        This class overrides the __str__ builtin from AdminObject to provide meaningful printing of the object.
-        Machine Name Path Example: 'https://gis-ags-imap02p.mdgov.maryland.gov:6443/arcgis/rest/services/Weather'
+        Reusing a session keeps the connection to the machine open between calls so that only the first request to a
+        machine pays for the TCP and TLS handshake. Requests to a url that does not belong to a known machine go
+        through a shared fallback session.
         """
 
-        def __init__(self, name, root_machine_url):
+        def __init__(self, machine_root_urls, pool_size, keep_alive, connect_timeout, read_timeout):
             """
-            Instantiate the FolderObject, first instantiating the inherited AdminObject using super(), and set
-            attributes using the setter/getter mutator methods. Name is the name of the folder, folder_machine_url is
-            the url to the folder using the machine path, folder_geodata_url is the url to the folder using the
-            geodata.md.gov path, folder_short_services_url is the short/relative path for making calls for services when
-            building usage report (doesn't reference the machine or geodata root portion of the url), and
-            service_objects_list is a list intended for storing all ServiceObject objects for services within a folder.
-            :param name: Name of the services folder
-            :param root_machine_url: url for the machine, rather than the web adaptor path
+            Instantiate the ClientObject, creating one session per machine root url.
+
+            :param machine_root_urls: list of root urls, one for each server machine
+            :param pool_size: maximum number of pooled connections kept open to each machine
+            :param keep_alive: keep connections open between requests when True, close after each request when False
+            :param connect_timeout: seconds to wait for a connection to a machine to be established
+            :param read_timeout: seconds to wait between bytes received from a machine
             """
-            super().__init__(root_machine_url=root_machine_url)     # Needs to be instantiated before folder_url
-            self.name = name
-            self.folder_geodata_url = name
-            self.folder_machine_url = name
-            self.folder_short_services_url = name
-            # self.services_json = None   # TODO: Used?
-            self.service_objects_list = []
+            self.pool_size = max(1, pool_size)
+            self.keep_alive = keep_alive
+            self.timeout = (connect_timeout, read_timeout)
+            self.sessions = {root_url: self.create_session() for root_url in machine_root_urls}
+            self.fallback_session = self.create_session()
 
-        @property
-        def folder_geodata_url(self):
-            return self.__folder_geodata_url
+        def create_session(self):
+            """
+            Create a session with a connection pool sized for the concurrent requests made to a single machine.
+            :return: requests Session
+            """
+            session = requests.Session()
 
-        @folder_geodata_url.setter
-        def folder_geodata_url(self, value):
-            self.__folder_geodata_url = f"{AdminObject.GEODATA_ROOT}/{value}"
+            # Jessie discovered "verify" option and set to False to bypass the ssl issue
+            session.verify = False
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            return session
+
+        def close(self):
+            """Close every session and the pooled connections they hold."""
+            for session in self.sessions.values():
+                session.close()
+            self.fallback_session.close()
+
+        def post(self, url, data, stream=False, timeout=None):
+            """
+            Submit a POST request through the session belonging to the machine in the url.
 
-        @property
-        def folder_machine_url(self):
-            return self.__folder_machine_url
+            :param url: url to which to make a request
+            :param data: parameters to accompany the request
+            :param stream: defer downloading the response body until it is accessed when True
+            :param timeout: seconds to wait instead of the client's connect and read timeouts
+            :return: requests Response
+            """
+            return self.session_for_url(url=url).post(url=url,
+                                                      data=data,
+                                                      timeout=self.timeout if timeout is None else timeout,
+                                                      stream=stream)
 
-        @folder_machine_url.setter
-        def folder_machine_url(self, value):
-            self.__folder_machine_url = f"{self.rest_url_machine_root}/{value}"
+        def session_for_url(self, url):
+            """
+            Return the session for the machine whose root url begins the url, or the fallback session.
+            :param url: url to which a request will be made
+            :return: requests Session
+            """
+            for root_url, session in self.sessions.items():
+                if url.startswith(root_url):
+                    return session
+            return self.fallback_session
 
-        @property
-        def folder_short_services_url(self):
-            return self.__folder_short_service_url
+    class ConcurrencyGovernorObject:
+        """
+        The ConcurrencyGovernorObject class limits the number of requests in flight to each server machine and adapts
+        the limit to how the machine is coping, so that collecting usage does not overload the machines while they
+        serve production traffic.
+
+        The limit is adjusted additive-increase, multiplicative-decrease (AIMD), as in TCP congestion control. A healthy
+        answer while the machine's limit is in use raises the limit by 1/limit, about one per round of requests, up to
+        the per-machine cap. A failed request (connection error, timeout, html error page, or server error) halves the
+        limit. When the smoothed latency exceeds the latency tolerance times the machine's baseline latency, the lowest
+        smoothed latency of the run, the limit is lowered by a fifth; this is the latency gradient. A baseline that
+        followed the average would rise with the load and stop protecting the machine, and a rise of less than
+        LATENCY_NOISE_SECONDS is noise rather than load. The limit is lowered at most
+        once per round, because requests sent before the last decrease do not lower it again. Requests over the limit
+        wait in a queue for a free slot. Only json requests feed the latency gradient, as a report query takes as long
+        as the report does. Limits are kept between daemon cycles; baselines are measured again and the queue
+        statistics describe the current run.
+        """
 
-        @folder_short_services_url.setter
-        def folder_short_services_url(self, value):
-            self.__folder_short_service_url = f"services/{value}"
+        ERROR_BACKOFF_RATIO = 0.5
+        LATENCY_BACKOFF_RATIO = 0.8
+        LATENCY_NOISE_SECONDS = 0.05
+        LATENCY_SMOOTHING_FACTOR = 0.3
+        MIN_LIMIT = 1
+        WARMUP_SAMPLES = 5
 
-        def __str__(self):
+        def __init__(self, machine_names, initial_limit, max_limit, latency_tolerance, enabled=True):
             """
-            Override the __str__ builtin to control the appearance of the object print-out for readability.
-            :return: string
+            Instantiate the ConcurrencyGovernorObject with every machine at the initial limit.
+
+            :param machine_names: list of server machine names
+            :param initial_limit: requests allowed in flight to a machine before anything is known about it
+            :param max_limit: most requests ever allowed in flight to a machine
+            :param latency_tolerance: factor by which the smoothed latency may exceed the usual latency before the
+                limit is lowered
+            :param enabled: govern requests when True, let every request through at once when False
+            """
+            self.max_limit = max(ConcurrencyGovernorObject.MIN_LIMIT, max_limit)
+            self.latency_tolerance = latency_tolerance
+            self.enabled = enabled
+            self.condition = threading.Condition()
+            self.machines = {machine_name: {"limit": float(max(ConcurrencyGovernorObject.MIN_LIMIT,
+                                                               min(initial_limit, self.max_limit))),
+                                            "in_flight": 0,
+                                            "waiting": 0,
+                                            "latency": None,
+                                            "baseline": None,
+                                            "samples": 0,
+                                            "decreased": float("-inf")}
+                             for machine_name in machine_names}
+            self.start_run()
+
+        def acquire(self, machine_name):
+            """
+            Wait until the machine has a free slot under its limit and take it. Requests to a url that is not on a
+            known machine, and every request when the governor is disabled, go through at once.
+            :param machine_name: name of the server machine, or None
+            :return: monotonic time the slot was taken, to be passed to release()
+            """
+            machine_state = self.machines.get(machine_name)
+            if not self.enabled or machine_state is None:
+                return time.monotonic()
+            with self.condition:
+                if machine_state["in_flight"] >= int(machine_state["limit"]):
+                    run_stats = self.run_stats[machine_name]
+                    machine_state["waiting"] += 1
+                    run_stats["queued_requests"] += 1
+                    run_stats["queue_depth_peak"] = max(run_stats["queue_depth_peak"], machine_state["waiting"])
+                    wait_start = time.monotonic()
+                    while machine_state["in_flight"] >= int(machine_state["limit"]):
+                        self.condition.wait()
+                    machine_state["waiting"] -= 1
+                    run_stats["queue_wait_seconds"] += time.monotonic() - wait_start
+                machine_state["in_flight"] += 1
+                return time.monotonic()
+
+        def decrease(self, machine_name, ratio, sent, reason):
+            """
+            Lower a machine's limit by a ratio, unless it was lowered after the request was sent. Called with the
+            condition held.
+            :param machine_name: name of the server machine
+            :param ratio: factor to multiply the limit by
+            :param sent: monotonic time the request that prompted the decrease took its slot
+            :param reason: description of what prompted the decrease, for the log
+            :return: None
+            """
+            machine_state = self.machines[machine_name]
+            if sent < machine_state["decreased"] or machine_state["limit"] <= ConcurrencyGovernorObject.MIN_LIMIT:
+                return
+            previous_limit = int(machine_state["limit"])
+            machine_state["limit"] = max(float(ConcurrencyGovernorObject.MIN_LIMIT), machine_state["limit"] * ratio)
+            machine_state["decreased"] = time.monotonic()
+            run_stats = self.run_stats[machine_name]
+            run_stats["decreases"] += 1
+            run_stats["limit_min"] = min(run_stats["limit_min"], int(machine_state["limit"]))
+            if int(machine_state["limit"]) < previous_limit:
+                print(f"Concurrency limit for {machine_name} lowered to {int(machine_state['limit'])} ({reason})")
+
+        def release(self, machine_name, sent, healthy, latency=None):
+            """
+            Give back a slot taken by acquire() and adjust the machine's limit by how the request went.
+            :param machine_name: name of the server machine, or None
+            :param sent: value returned by acquire()
+            :param healthy: True when the machine answered properly, False when the request failed, and None when the
+                answer says nothing about the machine's load, such as a rejected token
+            :param latency: seconds the machine took to answer, or None when the latency should not be used
+            :return: None
+            """
+            machine_state = self.machines.get(machine_name)
+            if not self.enabled or machine_state is None:
+                return
+            with self.condition:
+                at_limit = machine_state["in_flight"] >= int(machine_state["limit"]) or machine_state["waiting"] > 0
+                machine_state["in_flight"] -= 1
+                if healthy is False:
+                    self.decrease(machine_name=machine_name,
+                                  ratio=ConcurrencyGovernorObject.ERROR_BACKOFF_RATIO,
+                                  sent=sent,
+                                  reason="failed request")
+                elif healthy:
+                    slow = False
+                    if latency is not None:
+                        alpha = ConcurrencyGovernorObject.LATENCY_SMOOTHING_FACTOR
+                        previous_latency = machine_state["latency"]
+                        machine_state["latency"] = latency if previous_latency is None else (
+                                (1 - alpha) * previous_latency + alpha * latency)
+                        machine_state["baseline"] = min(machine_state["baseline"] or machine_state["latency"],
+                                                        machine_state["latency"])
+                        machine_state["samples"] += 1
+                        slow = (machine_state["samples"] > ConcurrencyGovernorObject.WARMUP_SAMPLES
+                                and machine_state["latency"] > self.latency_tolerance * machine_state["baseline"]
+                                and machine_state["latency"] - machine_state["baseline"]
+                                > ConcurrencyGovernorObject.LATENCY_NOISE_SECONDS)
+                    if slow:
+                        self.decrease(machine_name=machine_name,
+                                      ratio=ConcurrencyGovernorObject.LATENCY_BACKOFF_RATIO,
+                                      sent=sent,
+                                      reason=f"latency {machine_state['latency'] * 1000:.0f} ms against a usual "
+                                             f"{machine_state['baseline'] * 1000:.0f} ms")
+                    elif at_limit:
+                        machine_state["limit"] = min(float(self.max_limit),
+                                                     machine_state["limit"] + 1 / machine_state["limit"])
+                        self.run_stats[machine_name]["limit_max"] = max(self.run_stats[machine_name]["limit_max"],
+                                                                        int(machine_state["limit"]))
+                self.condition.notify_all()
+
+        def run_record(self):
+            """
+            Describe each machine's limit and queue for the run record.
+            :return: dictionary of machine name to dictionary of current values and run statistics, empty when the
+                governor is disabled
+            """
+            if not self.enabled:
+                return {}
+            with self.condition:
+                return {machine_name: dict(self.run_stats[machine_name],
+                                           limit=int(machine_state["limit"]),
+                                           in_flight=machine_state["in_flight"],
+                                           queue_depth=machine_state["waiting"],
+                                           latency_baseline=machine_state["baseline"])
+                        for machine_name, machine_state in self.machines.items()}
+
+        def start_run(self):
+            """
+            Clear the baselines and queue statistics of the last run, keeping the limits, for the next cycle of a
+            daemon. The baseline is measured again so that a machine that has become slower for good is not held to
+            the latency it used to have.
+            """
+            with self.condition:
+                for machine_state in self.machines.values():
+                    machine_state["latency"] = None
+                    machine_state["baseline"] = None
+                    machine_state["samples"] = 0
+                self.run_stats = {machine_name: {"limit_min": int(machine_state["limit"]),
+                                                 "limit_max": int(machine_state["limit"]),
+                                                 "decreases": 0,
+                                                 "queued_requests": 0,
+                                                 "queue_depth_peak": 0,
+                                                 "queue_wait_seconds": 0.0}
+                                  for machine_name, machine_state in self.machines.items()}
+
+    class InventoryCacheObject:
+        """
+        The InventoryCacheObject class persists the folder and service inventory between runs so that it does not have
+        to be rebuilt from scratch every time.
+
+        The snapshot records when the folders list was last checked and a ServiceInventoryObject holding, for each
+        folder, when it was last crawled and the name and type of its services. It is stored in the inventory's binary
+        format behind the checked time. A snapshot checked within the TTL is used without making any requests. Once
+        the TTL has passed, only the folders list is requested and just the folders that were added, or that were
+        crawled longer ago than the folder max age, are crawled again. Removed folders are dropped from the snapshot.
+        The cache file is read the first time the snapshot is needed, so that it can be read while the machines are
+        probed, and only once in a daemon. An empty cache path keeps the snapshot in memory only, so every folder is
+        crawled on every run but a daemon still reuses the snapshot between its cycles. A cache file that cannot be
+        read, such as one written in the earlier json format, is treated as no cache.
+        """
+
+        CHECKED_FORMAT = "<d"
+
+        def __init__(self, cache_path, ttl_seconds, folder_max_age_seconds):
+            """
+            Instantiate the InventoryCacheObject. The snapshot is loaded by ensure_loaded().
+
+            :param cache_path: path of the file in which the snapshot is stored, or empty for no cache
+            :param ttl_seconds: seconds after the folders list was checked during which the snapshot is used as is
+            :param folder_max_age_seconds: seconds after a folder was crawled after which it is crawled again
+            """
+            self.cache_path = cache_path
+            self.ttl_seconds = ttl_seconds
+            self.folder_max_age_seconds = folder_max_age_seconds
+            self.checked, self.inventory = 0.0, ServiceInventory.ServiceInventoryObject()
+            self.loaded = False
+            self.thread_lock = threading.Lock()
+
+        def ensure_loaded(self):
+            """Load the snapshot from the cache file, if there is one, unless it has been loaded already."""
+            with self.thread_lock:
+                if not self.loaded:
+                    self.checked, self.inventory = self.load()
+                    self.loaded = True
+
+        def folder_names(self):
+            return sorted(self.inventory.folder_names)
+
+        def folder_names_to_crawl(self, folder_names):
             """
-            return f"FOLDER: {self.name}-->\n\turl on machine = {self.folder_machine_url}\n\t" \
-                   f"url on geodata = {self.folder_geodata_url}"
+            Determine which folders need to be crawled because they are new or their cached services are stale.
+            :param folder_names: current list of folder names
+            :return: set of folder names
+            """
+            now = time.time()
+            folder_ids = self.inventory.folder_ids
+            folder_crawled = self.inventory.folder_crawled
+            return {folder_name for folder_name in folder_names
+                    if folder_name not in folder_ids
+                    or now - folder_crawled[folder_ids[folder_name]] > self.folder_max_age_seconds}
+
+        def is_fresh(self):
+            """Determine whether the snapshot's folders list was checked within the TTL and can be used as is."""
+            return time.time() - self.checked <= self.ttl_seconds
+
+        def load(self):
+            empty_snapshot = (0.0, ServiceInventory.ServiceInventoryObject())
+            if not self.cache_path:
+                return empty_snapshot
+            try:
+                with open(self.cache_path, "rb") as cache_file_handler:
+                    content = cache_file_handler.read()
+                checked_size = struct.calcsize(InventoryCacheObject.CHECKED_FORMAT)
+                checked, = struct.unpack_from(InventoryCacheObject.CHECKED_FORMAT, content)
+                return checked, ServiceInventory.ServiceInventoryObject.from_bytes(content=content[checked_size:])
+            except (FileNotFoundError, ValueError, struct.error):
+                return empty_snapshot
+
+        def restore_services(self, service_inventory_object, folder_name):
+            """
+            Add the services cached for a folder to an inventory.
+            :param service_inventory_object: ServiceInventoryObject to be populated
+            :param folder_name: name of the folder
+            :return: True if the folder was in the snapshot, otherwise False
+            """
+            if folder_name not in self.inventory.folder_ids:
+                return False
+            service_inventory_object.add_folder(folder_name=folder_name)
+            for service_index in self.inventory.services_in_folder(folder_name=folder_name):
+                service_inventory_object.add_service(
+                    folder_name=folder_name,
+                    service_name=self.inventory.service_names[service_index],
+                    service_type=self.inventory.type_names[self.inventory.service_type_ids[service_index]])
+            return True
+
+        def save(self, service_inventory_object, crawled_folder_names):
+            """
+            Replace the snapshot with the current inventory and write it to the cache file.
+
+            The folders list is recorded as checked now. Folders that were crawled successfully are recorded as crawled
+            now while the rest keep the time they were last crawled. Folders that have never been crawled successfully
+            are left out so that they are crawled on the next run.
+            :param service_inventory_object: ServiceInventoryObject of the current folders and services
+            :param crawled_folder_names: set of names of the folders that were crawled successfully in this run
+            :return: None
+            """
+            now = time.time()
+            inventory = ServiceInventory.ServiceInventoryObject()
+            for folder_name in service_inventory_object.folder_names:
+                if folder_name in crawled_folder_names:
+                    crawled = now
+                elif folder_name in self.inventory.folder_ids:
+                    crawled = self.inventory.folder_crawled[self.inventory.folder_ids[folder_name]]
+                else:
+                    continue
+                inventory.add_folder(folder_name=folder_name, crawled=crawled)
+                for service_index in service_inventory_object.services_in_folder(folder_name=folder_name):
+                    inventory.add_service(folder_name=folder_name,
+                                          service_name=service_inventory_object.service_names[service_index],
+                                          service_type=service_inventory_object.type_names[
+                                              service_inventory_object.service_type_ids[service_index]])
+            self.checked, self.inventory = now, inventory
+            if self.cache_path:
+                content = struct.pack(InventoryCacheObject.CHECKED_FORMAT, now) + inventory.to_bytes()
+                write_bytes_atomically(file_path=self.cache_path, content=content)
+            return
 
     class MachineObject:
         """
@@ -193,6 +710,171 @@ def main():
             return f"MACHINE: {self.machine_name}-->\n\troot url = {self.root_url}\n\ttoken = {self.token}\n\t" \
                    f"folders list = {self.folder_names_list}"
 
+    class MachineSelectorObject:
+        """
+        The MachineSelectorObject class chooses which server machine to make requests to and fails over to another
+        machine when the current one stops answering.
+
+        Every configured machine is probed concurrently with a cheap unauthenticated request and the fastest healthy
+        machine is chosen. Latency and error rates are kept as exponentially weighted averages in a local json file so
+        that a machine that has been slow or failing in recent runs is ranked lower even when its probe succeeds. An
+        empty stats path keeps the averages for the current run only.
+        """
+
+        ERROR_RATE_PENALTY = 4.0
+        PROBE_ENDING = "arcgis/rest/info"
+        SMOOTHING_FACTOR = 0.3
+
+        def __init__(self, machine_names, stats_path, probe_timeout):
+            """
+            Instantiate the MachineSelectorObject and load the machine statistics from previous runs.
+
+            :param machine_names: list of server machine names
+            :param stats_path: path of the json file in which machine statistics are stored, or empty for no file
+            :param probe_timeout: seconds to wait for a machine to answer the probe
+            """
+            self.machine_names = list(machine_names)
+            self.stats_path = stats_path
+            self.probe_timeout = probe_timeout
+            self.stats = self.load()
+            self.healthy_machine_names = list(self.machine_names)
+            self.failed_machine_names = set()
+            self.current_machine_name = None
+            self.thread_lock = threading.Lock()
+
+        def fail_over(self, failed_machine_name):
+            """
+            Record that a machine failed and move the current machine to the next-best healthy machine.
+
+            When another request already failed over from the machine the current machine is returned unchanged.
+            :param failed_machine_name: name of the machine that failed
+            :return: name of the new current machine, or None when there is no healthy machine left
+            """
+            with self.thread_lock:
+                if failed_machine_name not in self.failed_machine_names:
+                    self.failed_machine_names.add(failed_machine_name)
+                    self.record(machine_name=failed_machine_name, latency=None, healthy=False)
+                if self.current_machine_name not in self.failed_machine_names:
+                    return self.current_machine_name
+                candidates = [machine_name for machine_name in self.ranked_machine_names()
+                              if machine_name not in self.failed_machine_names]
+                self.current_machine_name = candidates[0] if candidates else None
+                return self.current_machine_name
+
+        def hedge_machine_name(self, machine_name):
+            """
+            Choose the machine to send a hedged duplicate of a request to, the best healthy machine other than the one
+            the request was sent to.
+            :param machine_name: name of the machine the request was sent to
+            :return: machine name, or None when there is no other healthy machine
+            """
+            with self.thread_lock:
+                candidates = [candidate_name for candidate_name in self.ranked_machine_names()
+                              if candidate_name != machine_name and candidate_name not in self.failed_machine_names]
+            return candidates[0] if candidates else None
+
+        def load(self):
+            if not self.stats_path:
+                return {}
+            try:
+                with open(self.stats_path, "r") as stats_file_handler:
+                    return json.load(stats_file_handler)
+            except (FileNotFoundError, ValueError):
+                return {}
+
+        def probe(self, machine_name):
+            """
+            Time a cheap request to a machine and determine whether it answered with json.
+            :param machine_name: name of the server machine
+            :return: tuple of latency in seconds and health boolean
+            """
+            root_url = SERVER_ROOT_URL.format(machine_name=machine_name, port=SERVER_PORT_SECURE)
+            start = time.perf_counter()
+            try:
+                response = client_object.post(url=f"{root_url}/{MachineSelectorObject.PROBE_ENDING}",
+                                              data=create_params_for_request(),
+                                              timeout=self.probe_timeout)
+                healthy = response.ok and "application/json" in response.headers.get("Content-Type", "")
+            except requests.exceptions.RequestException:
+                healthy = False
+            return time.perf_counter() - start, healthy
+
+        def probe_all(self):
+            """
+            Probe every machine concurrently, record the results, and return the healthy machines, fastest first.
+            :return: list of machine names
+            """
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.machine_names)) as executor:
+                probe_results = list(executor.map(self.probe, self.machine_names))
+            for machine_name, (latency, healthy) in zip(self.machine_names, probe_results):
+                self.record(machine_name=machine_name, latency=latency if healthy else None, healthy=healthy)
+            healthy_machine_names = {machine_name for machine_name, (latency, healthy)
+                                     in zip(self.machine_names, probe_results) if healthy}
+            self.failed_machine_names = set(self.machine_names) - healthy_machine_names
+            return [machine_name for machine_name in self.ranked_machine_names()
+                    if machine_name in healthy_machine_names]
+
+        def ranked_machine_names(self):
+            """Return every machine name ordered by latency penalised by error rate, best first."""
+            def score(machine_name):
+                machine_stats = self.stats.get(machine_name, {})
+                latency = machine_stats.get("latency")
+                if latency is None:
+                    return float("inf")
+                return latency * (1 + MachineSelectorObject.ERROR_RATE_PENALTY * machine_stats.get("error_rate", 0.0))
+            return sorted(self.machine_names, key=score)
+
+        def record(self, machine_name, latency, healthy):
+            """
+            Fold a latency and health observation into the machine's weighted averages.
+            :param machine_name: name of the server machine
+            :param latency: seconds the machine took to answer, or None when it did not answer
+            :param healthy: whether the machine answered with json
+            :return: None
+            """
+            alpha = MachineSelectorObject.SMOOTHING_FACTOR
+            machine_stats = self.stats.setdefault(machine_name, {"latency": None, "error_rate": 0.0})
+            machine_stats["error_rate"] = (1 - alpha) * machine_stats["error_rate"] + alpha * (0.0 if healthy else 1.0)
+            if latency is not None:
+                previous_latency = machine_stats["latency"]
+                machine_stats["latency"] = latency if previous_latency is None else (
+                        (1 - alpha) * previous_latency + alpha * latency)
+            machine_stats["updated"] = time.time()
+
+        def route(self, url):
+            """
+            Rewrite a url on a machine that failed during this run so that it goes to the current machine instead.
+            :param url: url to which a request will be made
+            :return: url
+            """
+            machine_name, root_url = machine_for_url(url=url)
+            if machine_name in self.failed_machine_names and self.current_machine_name is not None:
+                current_root_url = SERVER_ROOT_URL.format(machine_name=self.current_machine_name,
+                                                          port=SERVER_PORT_SECURE)
+                return current_root_url + url[len(root_url):]
+            return url
+
+        def save(self):
+            if self.stats_path:
+                with self.thread_lock:
+                    write_json_atomically(json_path=self.stats_path, content=self.stats)
+            return
+
+        def select_machine(self):
+            """
+            Probe every machine and make the fastest healthy one the current machine. When no machine answers the
+            probe one is picked at random, as before, and the first request will report the problem.
+            :return: name of the current machine
+            """
+            healthy_machine_names = self.probe_all()
+            if healthy_machine_names:
+                self.current_machine_name = healthy_machine_names[0]
+            else:
+                print("WARNING: No machine answered the probe. Selecting a machine at random.")
+                self.failed_machine_names = set()
+                self.current_machine_name = self.machine_names[create_random_int(upper_integer=len(self.machine_names))]
+            return self.current_machine_name
+
     class NotJSONException(Exception):
         """
         Raise when the url for the request is malformed for our purposes and the server returns html, not json.
@@ -208,41 +890,142 @@ def main():
             """Override the builtin __str__ method"""
             return "Content is not in JSON format. CJuice"
 
+    class PipelineObject:
+        """
+        The PipelineObject class runs the stages of a run that the next step does not need straight away on background
+        threads, so that the run takes as long as its critical path rather than the sum of its steps.
+
+        A stage is submitted by name once what it needs is available and its result is collected by name where it is
+        needed, waiting for it if it has not finished. For every stage the time it ran and the time the run waited for
+        it are kept for the run record. Disabled, a stage runs in the calling thread when its result is collected, so
+        the run is the plain series of steps it was before. The worker threads are kept between daemon cycles.
+        """
+
+        def __init__(self, max_workers, enabled=True):
+            """
+            Instantiate the PipelineObject.
+
+            :param max_workers: most stages run at once
+            :param enabled: run stages in the background when True, otherwise when their result is collected
+            """
+            self.enabled = enabled
+            self.executor = None
+            if enabled:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                                                      thread_name_prefix="pipeline")
+            self.thread_lock = threading.Lock()
+            self.start_run()
+
+        def close(self):
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+
+        def result(self, stage_name):
+            """
+            Wait for a stage to finish and return its result.
+            :param stage_name: name the stage was submitted with
+            :return: value returned by the stage's function, whose exception is raised when it failed
+            """
+            stage = self.stages.pop(stage_name)
+            wait_start = time.perf_counter()
+            try:
+                if stage["future"] is None:
+                    return stage["run"]()
+                return stage["future"].result()
+            finally:
+                with self.thread_lock:
+                    stage["times"]["waited_seconds"] = time.perf_counter() - wait_start
+
+        def run_record(self):
+            with self.thread_lock:
+                return {stage_name: dict(stage_times) for stage_name, stage_times in self.stage_times.items()}
+
+        def start_run(self):
+            """Forget the stages of the last run, for the next cycle of a daemon."""
+            with self.thread_lock:
+                self.stages = {}
+                self.stage_times = {}
+
+        def submit(self, stage_name, function, **kwargs):
+            """
+            Start a stage, in the background when the pipeline is enabled.
+            :param stage_name: name of the stage, unique within a run, for example 'report_delete'
+            :param function: function the stage runs
+            :param kwargs: keyword arguments of the function
+            :return: None
+            """
+            # A stage left running by a failed daemon cycle updates its own times, not those of the next cycle
+            stage_times = {"seconds": 0.0, "waited_seconds": 0.0}
+
+            def run_stage():
+                stage_start = time.perf_counter()
+                try:
+                    return function(**kwargs)
+                finally:
+                    with self.thread_lock:
+                        stage_times["seconds"] = time.perf_counter() - stage_start
+
+            with self.thread_lock:
+                self.stage_times[stage_name] = stage_times
+            future = self.executor.submit(run_stage) if self.executor is not None else None
+            self.stages[stage_name] = {"future": future, "run": run_stage, "times": stage_times}
+            return
+
     class ReportObject(AdminObject):
         """
         The ReportObject class is for service usage reports from ArcGIS Servers. Not all functionality
         is represented, only that which is relevant to the needed processes. There are portions of url's that are
         constants.
         Notes: 'add' is trigger for report creation, 'data' is trigger for querying, 'delete' is trigger for
-        deleting report
+        deleting report, 'edit' is trigger for replacing the definition of an existing report
+        A report is temporary, with a unique name, unless it is given a name. A named report is persistent: it is kept
+        on the server between runs and only edited when its definition changes. Reports created by this script are
+        marked in their metadata so that temporary ones left behind by interrupted runs can be recognised and swept.
         """
 
+        CREATED_BY = "DoIT_StatusDashboardUsageReport"
+        SINCE_BY_WINDOW_HOURS = {24: "LAST_DAY", 168: "LAST_WEEK"}
+        TEMP_TIMER = 1454109613248
         USAGE_REPORT_ENDING__CREATE = "arcgis/admin/usagereports/add"
+        USAGE_REPORT_ENDING__EDIT = "arcgis/admin/usagereports/{report_name}/edit"
+        USAGE_REPORT_ENDING__LIST = "arcgis/admin/usagereports"
         USAGE_REPORT_ENDING__QUERY = "arcgis/admin/usagereports/{report_name}/data"
         USAGE_REPORT_ENDING__DELETE = "arcgis/admin/usagereports/{report_name}/delete"
 
-        def __init__(self, root_machine_url, master_urls_list, basic_request_json):
+        def __init__(self, root_machine_url, master_urls_list, basic_request_json, now_time, start_time,
+                     report_name=None, since="CUSTOM"):
             """
             Instantiate the ReportObject, first instantiating the inherited AdminObject using super(), and set
             attributes using the setter/getter mutator methods. Setting order preserves/honors dependencies. Sets a
             unique name for the report, the current time, the time span of the report query using the to and from
-            attributes, the usage report urls for creating querying and deleting a report, the json definition for
-            specific report content, and the packaged json object for passing to the server for usagereport generation.
+            attributes, the usage report urls for creating querying editing and deleting a report, the json definition
+            for specific report content, and the packaged json object for passing to the server for usagereport
+            generation.
 
             :param root_machine_url: root url for machine
             :param master_urls_list: list of master folder and service urls
             :param basic_request_json: json including token and format
+            :param now_time: utc datetime the report time span ends at. Report shards share one.
+            :param start_time: utc datetime the report time span starts at, for example REPORT_WINDOW_HOURS before
+                now_time or the last collection in incremental mode
+            :param report_name: name of a persistent report, or None for a temporary report with a unique name
+            :param since: 'CUSTOM' for the time span given by the times, or a relative time span such as 'LAST_DAY'
+                that the server resolves when the report is queried
             """
             super().__init__(root_machine_url)
-            self.report_name_id = uuid.uuid4().hex
-            self.now_time = datetime.datetime.utcnow()
+            self.report_name_id = uuid.uuid4().hex if report_name is None else report_name
+            self.is_temp = report_name is None
+            self.since = since
+            self.now_time = now_time
             self.to_time = ReportObject.datetime_to_timestamp_seconds(self.now_time) * 1000
-            self.from_time = ReportObject.datetime_to_timestamp_seconds(self.now_time - datetime.timedelta(hours=48)) * 1000
+            self.from_time = ReportObject.datetime_to_timestamp_seconds(start_time) * 1000
             self.usage_reports_url__create = root_machine_url
             self.usage_reports_url__delete = root_machine_url
+            self.usage_reports_url__edit = root_machine_url
             self.usage_reports_url__query = root_machine_url
             self.report_url_create = None
             self.report_url_delete = None
+            self.report_url_edit = None
             self.report_url_query = None
             self.master_urls_list = master_urls_list
             self.json_definition = None
@@ -258,6 +1041,38 @@ def main():
             """
             return calendar.timegm(date_time_object.utctimetuple())
 
+        def definition_hash(self):
+            """Hash the json definition, so that a persistent report is only edited when its definition changes."""
+            return hashlib.sha256(json.dumps(self.json_definition, sort_keys=True).encode("utf-8")).hexdigest()
+
+        @staticmethod
+        def is_stale_temp_report(report_definition, min_age_seconds):
+            """
+            Determine whether a report listed by the server is a temporary report created by this script, by the
+            current or an earlier version of it, longer ago than the minimum age.
+
+            Reports created by earlier versions are recognised by their unique hex name and fixed tempTimer. Their age
+            is taken from the end of their time span, which was the time they were created.
+            :param report_definition: json definition of a report, as listed by the server
+            :param min_age_seconds: seconds after which a temporary report can no longer belong to a running query
+            :return: boolean
+            """
+            metadata = report_definition.get("metadata") or {}
+            if isinstance(metadata, str):
+                try:
+                    metadata = json.loads(metadata)
+                except ValueError:
+                    return False
+            if not isinstance(metadata, dict) or not metadata.get("temp"):
+                return False
+            created_by_script = metadata.get("createdBy") == ReportObject.CREATED_BY or (
+                    metadata.get("tempTimer") == ReportObject.TEMP_TIMER
+                    and re.fullmatch(r"[0-9a-f]{32}", str(report_definition.get("reportname", ""))) is not None)
+            created_milliseconds = metadata.get("created", report_definition.get("to"))
+            if not created_by_script or not isinstance(created_milliseconds, (int, float)):
+                return False
+            return time.time() * 1000 - created_milliseconds > min_age_seconds * 1000
+
         @property
         def usage_reports_url__create(self):
             return self.__usage_reports_url__create
@@ -274,6 +1089,14 @@ def main():
         def usage_reports_url__delete(self, value):
             self.__usage_reports_url__delete = f"{value}/{ReportObject.USAGE_REPORT_ENDING__DELETE}"
 
+        @property
+        def usage_reports_url__edit(self):
+            return self.__usage_reports_url__edit
+
+        @usage_reports_url__edit.setter
+        def usage_reports_url__edit(self, value):
+            self.__usage_reports_url__edit = f"{value}/{ReportObject.USAGE_REPORT_ENDING__EDIT}"
+
         @property
         def usage_reports_url__query(self):
             return self.__usage_reports_url__query
@@ -300,6 +1123,15 @@ def main():
             delete_url = self.usage_reports_url__delete.format(report_name=self.report_name_id)
             self.__report_url_delete = delete_url
 
+        @property
+        def report_url_edit(self):
+            return self.__report_url_edit
+
+        @report_url_edit.setter
+        def report_url_edit(self, value):
+            edit_url = self.usage_reports_url__edit.format(report_name=self.report_name_id)
+            self.__report_url_edit = edit_url
+
         @property
         def report_url_query(self):
             return self.__report_url_query
@@ -319,13 +1151,15 @@ def main():
             Create usage report JSON definition. This json object goes into the json object submitted to the server. The
             object details indicate what is to be put into the report when it is built. 'resourceURIs' is a list of
             all service and folder urls per Jessie design and she may have borrowed the code from ESRI demo
+            A relative time span has no from and to, so the definition of a persistent report using one only changes
+            when its urls do. The created time of a temporary report lets the sweeper tell how old it is.
 
             :param value:
             :return:
             """
 
             self.__json_definition = {"reportname": self.report_name_id,
-                                      "since": "CUSTOM",
+                                      "since": self.since,
                                       "from": int(self.from_time),
                                       "to": int(self.to_time),
                                       "queries": [
@@ -333,9 +1167,15 @@ def main():
                                            "metrics": ["RequestCount"]}
                                       ],
                                       "aggregationInterval": 60,
-                                      "metadata": {"temp": True,
-                                                   "tempTimer": 1454109613248}
+                                      "metadata": {"temp": self.is_temp,
+                                                   "createdBy": ReportObject.CREATED_BY}
                                       }
+            if self.since != "CUSTOM":
+                del self.__json_definition["from"]
+                del self.__json_definition["to"]
+            if self.is_temp:
+                self.__json_definition["metadata"].update({"tempTimer": ReportObject.TEMP_TIMER,
+                                                           "created": int(time.time() * 1000)})
 
         @property
         def report_json_params(self):
@@ -352,69 +1192,666 @@ def main():
             value.update({"usagereport": json.dumps(self.json_definition)})
             self.__report_json_params = value
 
-    class ServiceObject(AdminObject):
+    class ReportQueryException(Exception):
         """
-        The ServiceObject class is for storing values related to an ArcGIS server service in a services folder and
-        inherits from AdminObject.
+        Raise when a report query is answered with json instead of csv, such as an error saying that the report does
+        not exist.
 
-        This class overrides the __str__ builtin to provide meaningful printing of the object.
+        Inherits from Exception class.
         """
 
-        def __init__(self, folder, service_json, root_machine_url):
+        def __init__(self, response_json):
             """
-            Instantiate the ServiceObject class, first instantiating the inherited AdminObject using super(), and set
-            attributes using the setter/getter mutator methods. Service name is the name of
-            the service and the type is limited to ESRI types (eg. FeatureService)
-            :param folder: name of the service folder
-            :param service_json: json content of services key in response json
-            :param root_machine_url: url for the machine, rather than the web adaptor path
+            Instantiate the object.
+
+            :param response_json: json the query was answered with
             """
-            super().__init__(root_machine_url=root_machine_url)
-            self.folder = folder
-            self.service_name = service_json
-            self.service_type = service_json
-            self.service_short_services_url = None
+            super().__init__(response_json)
+            self.response_json = response_json
 
-        @property
-        def service_name(self):
-            return self.__service_name
+        def __str__(self):
+            """Override the builtin __str__ method"""
+            return f"Report query returned json instead of csv: {self.response_json}"
+
+    class RunMetricsObject:
+        """
+        The RunMetricsObject class records how long each phase of a run takes and the status, size, and latency of
+        every request, and writes them at the end of the run as a json run record and as a Prometheus textfile
+        collector file for the node exporter. The concurrency limit and queue of each machine are included.
+
+        Phases are laps: starting a phase ends the one before it. Request latencies are kept per machine in cumulative
+        histogram buckets, as Prometheus expects. The values describe a single run, so every metric is exported as a
+        gauge that the next run overwrites. An empty path skips writing that file. The metrics of a site run carry a
+        site label, so that the textfiles of several sites can be collected side by side.
+        """
 
-        @service_name.setter
-        def service_name(self, value):
+        LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+        METRIC_PREFIX = "usage_report"
+
+        def __init__(self, run_record_path, prometheus_path, site_name="", run_profiler_object=None):
+            """
+            Instantiate the RunMetricsObject and start timing the run.
+
+            :param run_record_path: path of the json run record, or empty for no run record
+            :param prometheus_path: path of the Prometheus textfile, ending in .prom, or empty for no textfile
+            :param site_name: name of the site of a site run, or empty
+            :param run_profiler_object: RunProfiler.RunProfilerObject that profiles every phase, or None
+            """
+            self.run_record_path = run_record_path
+            self.prometheus_path = prometheus_path
+            self.site_name = site_name
+            self.run_profiler_object = run_profiler_object
+            self.thread_lock = threading.Lock()
+            self.start_run()
+
+        def end_phase(self):
+            if self.current_phase is not None:
+                phase_name, phase_start = self.current_phase
+                self.phases.append({"name": phase_name, "seconds": time.perf_counter() - phase_start})
+                self.current_phase = None
+
+        def finish(self, success):
+            """
+            End the current phase and write the run record and textfile. A failure to write them is reported rather
+            than raised, so that metrics never fail a run.
+            :param success: whether the run completed
+            :return: None
+            """
+            self.end_phase()
+            run_record = self.run_record(success=success)
             try:
-                self.__service_name = value['name']
-            except KeyError as ke:
-                print(f"KeyError: 'name' not found in services json for this service. {ke}")
-                exit()
+                if self.run_record_path:
+                    write_json_atomically(json_path=self.run_record_path, content=run_record)
+                if self.prometheus_path:
+                    write_text_atomically(text_path=self.prometheus_path,
+                                          text=self.prometheus_text(run_record=run_record))
+            except OSError as e:
+                print(f"WARNING: Run metrics could not be written: {e}")
+
+        def format_labels(self, **labels):
+            """Format Prometheus labels, with the site label first in a site run."""
+            if self.site_name:
+                labels = dict(site=self.site_name, **labels)
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}" if labels else ""
+
+        def prometheus_text(self, run_record):
+            """
+            Format a run record in the Prometheus text exposition format.
+            :param run_record: dictionary returned by run_record()
+            :return: string
+            """
+            prefix = RunMetricsObject.METRIC_PREFIX
+            site_labels = self.format_labels()
+            lines = [f"# HELP {prefix}_last_run_timestamp_seconds Time the last run finished.",
+                     f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+                     f"{prefix}_last_run_timestamp_seconds{site_labels} {run_record['finished']:.3f}",
+                     f"# HELP {prefix}_last_run_success Whether the last run completed.",
+                     f"# TYPE {prefix}_last_run_success gauge",
+                     f"{prefix}_last_run_success{site_labels} {int(run_record['success'])}",
+                     f"# HELP {prefix}_last_run_duration_seconds Wall time of the last run.",
+                     f"# TYPE {prefix}_last_run_duration_seconds gauge",
+                     f"{prefix}_last_run_duration_seconds{site_labels} {run_record['duration_seconds']:.6f}",
+                     f"# HELP {prefix}_last_run_csv_bytes Bytes of report csv written by the last run.",
+                     f"# TYPE {prefix}_last_run_csv_bytes gauge",
+                     f"{prefix}_last_run_csv_bytes{site_labels} {run_record['csv_bytes']}",
+                     f"# HELP {prefix}_phase_duration_seconds Wall time of each phase of the last run.",
+                     f"# TYPE {prefix}_phase_duration_seconds gauge"]
+            for phase in run_record["phases"]:
+                lines.append(f'{prefix}_phase_duration_seconds{self.format_labels(phase=phase["name"])} '
+                             f'{phase["seconds"]:.6f}')
+            lines.extend([f"# HELP {prefix}_requests Requests made in the last run by machine and http status.",
+                          f"# TYPE {prefix}_requests gauge"])
+            for machine_name, machine_requests in sorted(run_record["requests"].items()):
+                for status, count in sorted(machine_requests["status_codes"].items()):
+                    lines.append(f'{prefix}_requests{self.format_labels(machine=machine_name, status=status)} {count}')
+            lines.extend([f"# HELP {prefix}_response_bytes Response bytes received in the last run by machine.",
+                          f"# TYPE {prefix}_response_bytes gauge"])
+            for machine_name, machine_requests in sorted(run_record["requests"].items()):
+                lines.append(f'{prefix}_response_bytes{self.format_labels(machine=machine_name)} '
+                             f'{machine_requests["response_bytes"]}')
+            lines.extend([f"# HELP {prefix}_request_duration_seconds Request latency in the last run by machine.",
+                          f"# TYPE {prefix}_request_duration_seconds histogram"])
+            for machine_name, machine_requests in sorted(run_record["requests"].items()):
+                machine_labels = self.format_labels(machine=machine_name)
+                for upper_bound, count in zip(RunMetricsObject.LATENCY_BUCKETS, machine_requests["latency_buckets"]):
+                    lines.append(f'{prefix}_request_duration_seconds_bucket'
+                                 f'{self.format_labels(machine=machine_name, le=upper_bound)} {count}')
+                lines.append(f'{prefix}_request_duration_seconds_bucket'
+                             f'{self.format_labels(machine=machine_name, le="+Inf")} {machine_requests["count"]}')
+                lines.append(f'{prefix}_request_duration_seconds_sum{machine_labels} '
+                             f'{machine_requests["latency_sum"]:.6f}')
+                lines.append(f'{prefix}_request_duration_seconds_count{machine_labels} '
+                             f'{machine_requests["count"]}')
+            for metric_name, key, description in (
+                    ("concurrency_limit", "limit", "Requests allowed in flight at once at the end of the last run"),
+                    ("concurrency_limit_min", "limit_min", "Lowest concurrency limit in the last run"),
+                    ("concurrency_limit_decreases", "decreases", "Times the concurrency limit was lowered"),
+                    ("concurrency_queued_requests", "queued_requests", "Requests that waited for a slot"),
+                    ("concurrency_queue_depth_peak", "queue_depth_peak", "Most requests waiting for a slot at once"),
+                    ("concurrency_queue_wait_seconds", "queue_wait_seconds", "Seconds requests waited for a slot")):
+                lines.extend([f"# HELP {prefix}_{metric_name} {description}, by machine.",
+                              f"# TYPE {prefix}_{metric_name} gauge"])
+                for machine_name, machine_concurrency in sorted(run_record["concurrency"].items()):
+                    lines.append(f'{prefix}_{metric_name}{self.format_labels(machine=machine_name)} '
+                                 f'{machine_concurrency[key]}')
+            for metric_name, key, description in (
+                    ("pipeline_stage_seconds", "seconds", "Wall time of each background stage of the last run"),
+                    ("pipeline_stage_waited_seconds", "waited_seconds", "Seconds the last run waited for each stage")):
+                lines.extend([f"# HELP {prefix}_{metric_name} {description}.",
+                              f"# TYPE {prefix}_{metric_name} gauge"])
+                for stage_name, stage_times in sorted(run_record["pipeline"].items()):
+                    lines.append(f'{prefix}_{metric_name}{self.format_labels(stage=stage_name)} '
+                                 f'{stage_times[key]:.6f}')
+            return "\n".join(lines) + "\n"
+
+        def record_csv(self, csv_bytes):
+            with self.thread_lock:
+                self.csv_bytes += csv_bytes
+
+        def record_request(self, machine_name, status_code, seconds, response_bytes):
+            """
+            Add a request attempt to the stats of the machine it was made to.
+            :param machine_name: name of the server machine, or None for a url that is not on a known machine
+            :param status_code: http status of the response, or None when no response was received
+            :param seconds: time from sending the request to receiving the response
+            :param response_bytes: size of the response body, as far as it is known when the response is received
+            :return: None
+            """
+            with self.thread_lock:
+                machine_requests = self.machine_requests.setdefault(
+                    machine_name or "unknown", {"count": 0, "status_codes": {}, "response_bytes": 0,
+                                                "latency_sum": 0.0,
+                                                "latency_buckets": [0] * len(RunMetricsObject.LATENCY_BUCKETS)})
+                status = str(status_code) if status_code is not None else "error"
+                machine_requests["count"] += 1
+                machine_requests["status_codes"][status] = machine_requests["status_codes"].get(status, 0) + 1
+                machine_requests["response_bytes"] += response_bytes
+                machine_requests["latency_sum"] += seconds
+                for index, upper_bound in enumerate(RunMetricsObject.LATENCY_BUCKETS):
+                    if seconds <= upper_bound:
+                        machine_requests["latency_buckets"][index] += 1
+
+        def run_record(self, success):
+            """
+            Build the json run record.
+            :param success: whether the run completed
+            :return: dictionary
+            """
+            with self.thread_lock:
+                return {"site": self.site_name,
+                        "started": self.started,
+                        "finished": time.time(),
+                        "success": success,
+                        "duration_seconds": time.perf_counter() - self.start,
+                        "phases": list(self.phases),
+                        "requests": json.loads(json.dumps(self.machine_requests)),
+                        "csv_bytes": self.csv_bytes,
+                        "concurrency": concurrency_governor_object.run_record(),
+                        "pipeline": pipeline_object.run_record(),
+                        "latency_bucket_bounds": list(RunMetricsObject.LATENCY_BUCKETS)}
+
+        def start_run(self):
+            """Clear the phases and request stats and start timing a new run, for the next cycle of a daemon."""
+            with self.thread_lock:
+                self.started = time.time()
+                self.start = time.perf_counter()
+                self.phases = []
+                self.current_phase = None
+                self.machine_requests = {}
+                self.csv_bytes = 0
+
+        def start_phase(self, phase_name):
+            """
+            End the current phase, if any, and start timing the next one.
+            :param phase_name: name of the phase, for example 'crawl' or 'report_query'
+            :return: None
+            """
+            self.end_phase()
+            if self.run_profiler_object is not None:
+                self.run_profiler_object.start_phase(phase_name=phase_name)
+            self.current_phase = (phase_name, time.perf_counter())
 
-        @property
-        def service_type(self):
-            return self.__service_type
+    class TokenCacheObject:
+        """
+        The TokenCacheObject class reuses security tokens across runs by storing them, with their expiry, in a local
+        json file keyed by machine name and username.
+
+        A cached token is reused until shortly before it expires, after which a new token is generated and stored.
+        The cache file is guarded by a lock file so that overlapping runs do not overwrite each other's tokens. An
+        empty cache path keeps tokens in memory for the current run only.
+        """
+
+        TOKEN_REJECTION_CODES = (498, 499)
+
+        def __init__(self, cache_path, username, expiry_margin_seconds):
+            """
+            Instantiate the TokenCacheObject. Tokens are generated by get_token() and refresh_token() as needed.
+
+            :param cache_path: path of the json file in which tokens are stored, or empty for no file
+            :param username: username the tokens are generated for, part of the cache key
+            :param expiry_margin_seconds: seconds before expiry at which a cached token is no longer reused
+            """
+            self.cache_path = cache_path
+            self.username = username
+            self.expiry_margin_seconds = expiry_margin_seconds
+            self.memory_cache = {}
+            self.thread_lock = threading.Lock()
+
+        def cache_key(self, machine_name):
+            return f"{machine_name}|{self.username}"
+
+        def generate_token(self, root_url):
+            """
+            Request a new token from the machine and return it with its expiry in epoch milliseconds.
+            :param root_url: root url for machine
+            :return: tuple of token string and expiry integer
+            """
+            generate_token_url = f"{root_url}/{AdminObject.GENERATE_TOKEN_ENDING}"
+            token_params = create_params_for_request(token_action="getToken")
+            token_response = get_response(url=generate_token_url, params=token_params)
+            token = search_json_for_key(response_json=token_response, search_key="token")
+            expires = int(search_json_for_key(response_json=token_response, search_key="expires"))
+            return token, expires
+
+        def get_token(self, machine_name, root_url, rejected_token=None):
+            """
+            Return a valid token for the machine, reusing the cached token when it is not close to expiry.
+
+            When rejected_token is provided a cached token equal to it is not reused. A cached token that differs from
+            the rejected token was refreshed by another request or run and is returned as is.
+            :param machine_name: name of the server machine
+            :param root_url: root url for machine
+            :param rejected_token: token the server rejected, if any
+            :return: token string
+            """
+            key = self.cache_key(machine_name=machine_name)
+            with self.thread_lock, self.locked_cache():
+                entries = self.read_cache()
+                entry = entries.get(key)
+                if entry is not None and entry["token"] != rejected_token and self.is_fresh(entry=entry):
+                    return entry["token"]
+                token, expires = self.generate_token(root_url=root_url)
+                entries[key] = {"token": token, "expires": expires}
+                self.write_cache(entries=entries)
+                return token
+
+        def is_fresh(self, entry):
+            return entry["expires"] / 1000 - self.expiry_margin_seconds > time.time()
 
-        @service_type.setter
-        def service_type(self, value):
+        @staticmethod
+        def is_token_rejection(response_json):
+            """
+            Determine whether a json response is the server rejecting the token, as either an admin or rest error.
+            :param response_json: json returned by the server
+            :return: boolean
+            """
+            if not isinstance(response_json, dict):
+                return False
+            error = response_json.get("error", response_json)
+            if not isinstance(error, dict):
+                return False
+            return error.get("code") in TokenCacheObject.TOKEN_REJECTION_CODES and (
+                    "error" in response_json or response_json.get("status") == "error")
+
+        def locked_cache(self):
+            if not self.cache_path:
+                return contextlib.ExitStack()
+            return lock_file(lock_path=f"{self.cache_path}.lock")
+
+        def read_cache(self):
+            if not self.cache_path:
+                return self.memory_cache
             try:
-                self.__service_type = value['type']
-            except KeyError as ke:
-                print(f"KeyError: 'type' not found in services json for this service. {ke}")
-                exit()
+                with open(self.cache_path, "r") as cache_file_handler:
+                    return json.load(cache_file_handler)
+            except (FileNotFoundError, ValueError):
+                return {}
+
+        def write_cache(self, entries):
+            if not self.cache_path:
+                self.memory_cache = entries
+                return
+            write_json_atomically(json_path=self.cache_path, content=entries, file_mode=0o600)
+
+    class TransientResponseException(Exception):
+        """
+        Raise when the server answers with an error it is expected to recover from, such as an http 503, a bare
+        ArcGIS internal error, or a token rejection, so that the request is retried rather than the script exited.
 
-        @property
-        def service_short_services_url(self):
-            return self.__service_short_services_url
+        ArcGIS reports ordinary, permanent failures, such as a rejected report definition or an unknown report, as
+        json errors with code 500 too, so a json error is only transient when its message is one a busy or restarting
+        server gives, and otherwise is returned to the caller as before.
 
-        @service_short_services_url.setter
-        def service_short_services_url(self, value):
-            self.__service_short_services_url = f"services/{self.service_name}.{self.service_type}"
+        Inherits from Exception class.
+        """
 
-        def __str__(self):
+        TRANSIENT_ERROR_MESSAGE_FRAGMENTS = ("timed out", "timeout", "server is busy", "try again later")
+        TRANSIENT_ERROR_MESSAGES = ("internal server error", "service unavailable")
+        TRANSIENT_STATUS_CODES = (429, 502, 503, 504)
+
+        def __init__(self, message, token_rejected=False):
             """
-            Overriding the __str__ builtin to control the appearance of the object print-out for readability.
-            :return: string
+            Instantiate the object.
+
+            :param message: description of the error
+            :param token_rejected: whether the error is the server rejecting the token
+            """
+            super().__init__(message)
+            self.message = message
+            self.token_rejected = token_rejected
+
+        @staticmethod
+        def is_transient_error(response_json):
+            """
+            Determine whether a json response is an admin or rest error the server is expected to recover from: one
+            whose message is just a generic internal error or unavailable message, or says that the server timed out
+            or is busy. The code is not used, as permanent failures share code 500 with transient ones.
+            :param response_json: json returned by the server
+            :return: boolean
             """
-            return f"SERVICE: {self.service_name}-->\n\ttype = {self.service_type}\n\tfolder = {self.folder}"
+            if not isinstance(response_json, dict):
+                return False
+            error = response_json.get("error", response_json)
+            if not isinstance(error, dict) or not ("error" in response_json or response_json.get("status") == "error"):
+                return False
+            messages = error.get("messages") or [error.get("message")] + list(error.get("details") or [])
+            fragments = TransientResponseException.TRANSIENT_ERROR_MESSAGE_FRAGMENTS
+            for message in messages:
+                message = str(message or "").strip().rstrip(".").lower()
+                if message in TransientResponseException.TRANSIENT_ERROR_MESSAGES or any(
+                        fragment in message for fragment in fragments):
+                    return True
+            return False
+
+        def __str__(self):
+            """Override the builtin __str__ method"""
+            return self.message
 
     # FUNCTIONS
+    def backoff_delay(attempt, remaining_seconds):
+        """
+        Compute how long to wait before retrying a request, by exponential backoff with full jitter so that concurrent
+        requests that failed together do not retry together.
+        :param attempt: number of attempts made so far, from 1
+        :param remaining_seconds: seconds left before the request's deadline, which the wait does not go beyond
+        :return: seconds to wait
+        """
+        ceiling = min(REQUEST_BACKOFF_MAX_SECONDS, REQUEST_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+        return max(0.0, min(remaining_seconds, random.uniform(0, ceiling)))
+
+    def collect_usage_report():
+        """
+        Run the pipeline once: select a machine, get a token, inventory the folders and services, and create, query,
+        and delete the usage report, writing the csv for the dashboard.
+
+        The sessions, machine statistics, tokens, and inventory snapshot it uses are created once in main(), so in
+        daemon mode each cycle starts with open connections, a valid token, and a current inventory. Steps that the
+        report does not wait for run in the background on the pipeline: the time series store is opened while the site
+        is inventoried, and stale reports are swept and the report is deleted while the report is collected and stored.
+        :return: None
+        """
+        if TIME_SERIES_STORE_PATH:
+            pipeline_object.submit(stage_name="time_series_store_open", function=open_time_series_store)
+
+        machine_object, basic_secure_params, master_url_list = inventory_site()
+
+        # The dashboard shows the last REPORT_WINDOW_HOURS. In incremental mode only the time since the last
+        #   successful collection, plus a small overlap, is requested and merged into the existing csv, which is
+        #   trimmed to the window. Times are whole minutes so that the time slices of successive reports line up with
+        #   each other.
+        report_end_time = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+        window_start_time = report_end_time - datetime.timedelta(hours=REPORT_WINDOW_HOURS)
+        report_start_time = window_start_time
+        report_csv_path = CSV_OUTPUT_FILE_PATH
+        #   The collection state also records the definition of the persistent report and when reports were swept.
+        collection_state = read_json_file(json_path=COLLECTION_STATE_PATH, default={})
+
+        # Temporary reports that interrupted runs left on the server are deleted every REPORT_SWEEP_INTERVAL_SECONDS,
+        #   while the report is collected. A failed sweep is reported and tried again on the next run.
+        sweep_reports = 0 < REPORT_SWEEP_INTERVAL_SECONDS <= time.time() - collection_state.get("reports_swept", 0)
+        if sweep_reports:
+            print("Sweeping Reports")
+            pipeline_object.submit(stage_name="report_sweep",
+                                   function=sweep_stale_reports,
+                                   root_machine_url=machine_object.root_url,
+                                   token=machine_object.token)
+
+        if INCREMENTAL_COLLECTION:
+            last_collected_milliseconds = collection_state.get("last_collected")
+            if last_collected_milliseconds is not None and os.path.exists(CSV_OUTPUT_FILE_PATH):
+                overlap_start_time = (datetime.datetime.utcfromtimestamp(last_collected_milliseconds / 1000)
+                                      - datetime.timedelta(minutes=INCREMENTAL_OVERLAP_MINUTES))
+                report_start_time = max(window_start_time, overlap_start_time)
+            report_csv_path = f"{CSV_OUTPUT_FILE_PATH}.increment"
+            print(f"Collecting {report_start_time:%Y-%m-%d %H:%M} to {report_end_time:%Y-%m-%d %H:%M} UTC")
+
+        # The machine breakdown follows the csv: in incremental mode it is merged into the existing breakdown csv.
+        machine_breakdown_csv_path = MACHINE_BREAKDOWN_CSV_PATH
+        if INCREMENTAL_COLLECTION:
+            machine_breakdown_csv_path = f"{MACHINE_BREAKDOWN_CSV_PATH}.increment"
+        machine_breakdown_written = False
+        delete_report = False
+        usage_matrix_object = None
+
+        # A very large resourceURIs list can be split into shards, each its own report, processed in parallel.
+        if 0 < REPORT_SHARD_SIZE < len(master_url_list):
+            if MACHINE_BREAKDOWN_CSV_PATH:
+                print("WARNING: The machine breakdown is not collected with sharded reports")
+            run_metrics_object.start_phase(phase_name="report_shards")
+            create_sharded_usage_report(master_urls_list=master_url_list,
+                                        basic_request_json=basic_secure_params,
+                                        root_machine_url=machine_object.root_url,
+                                        csv_path=report_csv_path,
+                                        shard_size=REPORT_SHARD_SIZE,
+                                        max_workers=REPORT_SHARD_WORKERS,
+                                        now_time=report_end_time,
+                                        start_time=report_start_time)
+        else:
+            # Need to create a new report object for use in generating report on server. A persistent report is named
+            #   and, when the window is a whole day or week and is not collected incrementally, uses a relative time
+            #   span so that its definition does not change from run to run.
+            report_since = "CUSTOM"
+            if PERSISTENT_REPORT_NAME and not INCREMENTAL_COLLECTION:
+                report_since = ReportObject.SINCE_BY_WINDOW_HOURS.get(REPORT_WINDOW_HOURS, "CUSTOM")
+            report_object = ReportObject(root_machine_url=machine_object.root_url,
+                                         master_urls_list=master_url_list,
+                                         basic_request_json=basic_secure_params,
+                                         now_time=report_end_time,
+                                         start_time=report_start_time,
+                                         report_name=PERSISTENT_REPORT_NAME or None,
+                                         since=report_since)
+
+            if PERSISTENT_REPORT_NAME:
+                # A persistent report stays on the server and is only edited when its urls or time span have changed
+                #   since the last run.
+                definition_hash = report_object.definition_hash()
+                if collection_state.get("report_definition_hash") != definition_hash:
+                    run_metrics_object.start_phase(phase_name="report_update")
+                    print("Updating Report")
+                    update_persistent_report(report_object=report_object, token=machine_object.token)
+                    collection_state["report_definition_hash"] = definition_hash
+                    write_json_atomically(json_path=COLLECTION_STATE_PATH, content=collection_state)
+            else:
+                # Report is created on the server. No response is needed. The variable isn't used afterward for that
+                #   reason.
+                run_metrics_object.start_phase(phase_name="report_create")
+                print("Creating Report")
+                usage_report_params = create_params_for_request(token_action=machine_object.token,
+                                                                json_payload=report_object.report_json_params)
+                get_response(url=report_object.report_url_create, params=usage_report_params)
+
+            # Need to get the report contents using the query url
+            # NOTE: Like the 'usagereports' dictionary it appears that any dictionary 'value' that is a dictionary must
+            #   be converted to a string first; using json.dumps()
+            run_metrics_object.start_phase(phase_name="report_query")
+            print("Querying Report")
+            post_data_query = {'filter': json.dumps({'machines': '*'})}
+            report_query_params = create_params_for_request(token_action=machine_object.token,
+                                                            json_payload=post_data_query,
+                                                            response_format='csv')
+
+            # When the time series store or the dashboard payload would read the report back from its csv, it is
+            #   parsed into a usage matrix as it downloads instead. An incremental report is only part of the csv, so
+            #   the dashboard payload is still read from the merged csv.
+            #   NOTE: numpy is only needed for the matrix so it is imported here rather than with the other imports.
+            usage_matrix_builder_object = None
+            if pipeline_object.enabled and (TIME_SERIES_STORE_PATH or (DASHBOARD_PAYLOAD_PATH
+                                                                       and not INCREMENTAL_COLLECTION)):
+                import UsageAggregation
+                usage_matrix_builder_object = UsageAggregation.UsageMatrixBuilderObject()
+
+            # With a machine breakdown the report is also queried once per machine, at the same time as the query of
+            #   the whole site, so the breakdown adds little to the run time.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as machine_breakdown_executor:
+                machine_breakdown_future = None
+                if MACHINE_BREAKDOWN_CSV_PATH:
+                    print("Querying Report by Machine")
+                    machine_breakdown_future = machine_breakdown_executor.submit(query_machine_breakdown,
+                                                                                 report_object=report_object,
+                                                                                 csv_path=machine_breakdown_csv_path)
+
+                # Need to write the report content to csv file. The query response is streamed to disk as it arrives. A
+                #   slow query is hedged to a second machine and a failed download is retried.
+                try:
+                    query_report_to_csv(report_url_query=report_object.report_url_query,
+                                        params=report_query_params,
+                                        csv_path=report_csv_path,
+                                        usage_matrix_builder_object=usage_matrix_builder_object)
+                except ReportQueryException as rqe:
+                    if not PERSISTENT_REPORT_NAME:
+                        raise
+
+                    # The persistent report has been deleted from the server since it was last updated, so it is
+                    #   created again.
+                    print(f"WARNING: {rqe}. Updating the persistent report and querying it again.")
+                    run_metrics_object.start_phase(phase_name="report_update")
+                    update_persistent_report(report_object=report_object, token=machine_object.token)
+                    run_metrics_object.start_phase(phase_name="report_query")
+                    query_report_to_csv(report_url_query=report_object.report_url_query,
+                                        params=report_query_params,
+                                        csv_path=report_csv_path,
+                                        usage_matrix_builder_object=usage_matrix_builder_object)
+                machine_breakdown_written = machine_breakdown_future is not None and machine_breakdown_future.result()
+            if usage_matrix_builder_object is not None:
+                usage_matrix_object = usage_matrix_builder_object.finish()
+
+            # Need to delete the report from the server to reduce bloat, unless it is persistent. Nothing waits for
+            #   it, so it is deleted while the report is stored and merged.
+            if not PERSISTENT_REPORT_NAME:
+                print("Deleting Report")
+                pipeline_object.submit(stage_name="report_delete",
+                                       function=get_response,
+                                       url=report_object.report_url_delete,
+                                       params=basic_secure_params,
+                                       exit_on_error=False)
+                delete_report = True
+
+        # The report is also kept in the local time series store, when there is one, along with the history before it.
+        #   Ingesting it updates the 15 minute, hourly, and daily rollups it falls in. Each level has its own
+        #   retention; a retention of 0 days keeps a rollup level for good.
+        if TIME_SERIES_STORE_PATH:
+            run_metrics_object.start_phase(phase_name="time_series_store")
+            print("Storing Time Series")
+            time_series_store_object = pipeline_object.result(stage_name="time_series_store_open")
+            if usage_matrix_object is not None:
+                time_series_store_object.ingest_usage_matrix(usage_matrix_object=usage_matrix_object)
+            else:
+                time_series_store_object.ingest_csv(csv_path=report_csv_path)
+            report_end_milliseconds = ReportObject.datetime_to_timestamp_seconds(report_end_time) * 1000
+            time_series_store_object.prune(
+                before_milliseconds=report_end_milliseconds - TIME_SERIES_RETENTION_DAYS * 86400000)
+            time_series_store_object.prune_rollups(
+                before_milliseconds_by_interval={interval_seconds: report_end_milliseconds - retention_days * 86400000
+                                                 for interval_seconds, retention_days
+                                                 in TIME_SERIES_ROLLUP_RETENTION_DAYS.items() if retention_days > 0})
+
+        if INCREMENTAL_COLLECTION:
+            run_metrics_object.start_phase(phase_name="merge")
+            window_start_milliseconds = ReportObject.datetime_to_timestamp_seconds(window_start_time) * 1000
+            try:
+                if report_start_time > window_start_time:
+                    print("Merging CSV")
+                    UsageReportCSV.merge_usage_report_csv(older_csv_path=CSV_OUTPUT_FILE_PATH,
+                                                          newer_csv_path=report_csv_path,
+                                                          output_csv_path=CSV_OUTPUT_FILE_PATH,
+                                                          window_start_milliseconds=window_start_milliseconds)
+                else:
+                    os.replace(report_csv_path, CSV_OUTPUT_FILE_PATH)
+            finally:
+                if os.path.exists(report_csv_path):
+                    os.remove(report_csv_path)
+            if machine_breakdown_written:
+                try:
+                    if report_start_time > window_start_time and os.path.exists(MACHINE_BREAKDOWN_CSV_PATH):
+                        UsageReportCSV.merge_usage_report_csv(older_csv_path=MACHINE_BREAKDOWN_CSV_PATH,
+                                                              newer_csv_path=machine_breakdown_csv_path,
+                                                              output_csv_path=MACHINE_BREAKDOWN_CSV_PATH,
+                                                              window_start_milliseconds=window_start_milliseconds)
+                    else:
+                        os.replace(machine_breakdown_csv_path, MACHINE_BREAKDOWN_CSV_PATH)
+                finally:
+                    if os.path.exists(machine_breakdown_csv_path):
+                        os.remove(machine_breakdown_csv_path)
+            collection_state["last_collected"] = ReportObject.datetime_to_timestamp_seconds(report_end_time) * 1000
+            write_json_atomically(json_path=COLLECTION_STATE_PATH, content=collection_state)
+
+        # The dashboard can read compact, pre-aggregated totals and sparklines of the csv, with gzip and brotli copies,
+        #   instead of the whole csv. They only cover whole buckets, so most runs leave them unchanged, and a file is
+        #   only rewritten when its content hash changes.
+        #   NOTE: numpy is only needed for the payload so it is imported here rather than with the other imports.
+        if DASHBOARD_PAYLOAD_PATH:
+            import DashboardPayload
+            run_metrics_object.start_phase(phase_name="dashboard_payload")
+            if usage_matrix_object is not None and not INCREMENTAL_COLLECTION:
+                payload = DashboardPayload.build_payload(usage_matrix_object=usage_matrix_object,
+                                                         bucket_seconds=DASHBOARD_BUCKET_MINUTES * 60,
+                                                         top_count=DASHBOARD_TOP_SERVICES)
+                written_paths = DashboardPayload.write_payload(json_path=DASHBOARD_PAYLOAD_PATH, payload=payload)
+            else:
+                written_paths = DashboardPayload.write_csv_payload(csv_path=CSV_OUTPUT_FILE_PATH,
+                                                                   json_path=DASHBOARD_PAYLOAD_PATH,
+                                                                   bucket_seconds=DASHBOARD_BUCKET_MINUTES * 60,
+                                                                   top_count=DASHBOARD_TOP_SERVICES)
+            print(f"Dashboard payload {'written' if written_paths else 'unchanged'}")
+
+        # The csv is complete, so a report that could not be deleted is only reported. As a temporary report it is
+        #   deleted by a later sweep.
+        if delete_report:
+            run_metrics_object.start_phase(phase_name="report_delete")
+            try:
+                pipeline_object.result(stage_name="report_delete")
+            except Exception as e:
+                print(f"WARNING: The report could not be deleted: {e}")
+        if sweep_reports:
+            run_metrics_object.start_phase(phase_name="report_sweep")
+            try:
+                deleted_count = pipeline_object.result(stage_name="report_sweep")
+                print(f"Deleted {deleted_count} stale temporary report(s)")
+                collection_state["reports_swept"] = time.time()
+                write_json_atomically(json_path=COLLECTION_STATE_PATH, content=collection_state)
+            except Exception as e:
+                print(f"WARNING: Stale reports could not be swept: {e}")
+
+        machine_selector_object.save()
+        return
+
+    def create_backfill_windows(start_time, end_time, window_hours):
+        """
+        Split a time range into consecutive report windows of at most window_hours, the last one ending at end_time.
+        :param start_time: utc datetime the range starts at
+        :param end_time: utc datetime the range ends at
+        :param window_hours: hours in each window
+        :return: list of tuples of window start and end datetimes, oldest first
+        """
+        window_length = datetime.timedelta(hours=max(1, window_hours))
+        windows = []
+        window_start_time = start_time
+        while window_start_time < end_time:
+            window_end_time = min(window_start_time + window_length, end_time)
+            windows.append((window_start_time, window_end_time))
+            window_start_time = window_end_time
+        return windows
+
     def create_params_for_request(token_action=None, json_payload=None, response_format="json"):
         """
         Create parameters to be submitted with the request.
@@ -435,23 +1872,15 @@ def main():
             values = {'token': token_action, 'f': response_format}
         return values
 
-    def create_master_url_list(objects_list):
+    def create_master_url_list(service_inventory_object):
         """
-        Create a list of all urls using Folder objects and Service objects, stored in each Folder, and return the list.
+        Create a list of all urls of the folders and of the services within each folder, and return the list.
 
-        :param objects_list:  list of Folder objects, containing Service objects
+        :param service_inventory_object: ServiceInventoryObject holding the folders and their services
         :return: list of strings that represent urls
         """
-        master_list = []
-        for obj_fold in objects_list:
-            if obj_fold.folder_short_services_url == "services/":
-                # Need to bypass the initial root folder so as not to get the whole 'services/' item, JC 20180911
-                pass
-            else:
-                master_list.append(obj_fold.folder_short_services_url)
-                for obj_serv in obj_fold.service_objects_list:
-                    master_list.append(obj_serv.service_short_services_url)
-        return master_list
+        # The initial root folder is bypassed so as not to get the whole 'services/' item, JC 20180911
+        return service_inventory_object.master_url_list()
 
     def create_random_int(upper_integer):
         """
@@ -463,152 +1892,1080 @@ def main():
         spot = random.randint(0, options)
         return spot
 
-    def get_response(url, params):
+    def create_sharded_usage_report(master_urls_list, basic_request_json, root_machine_url, csv_path, shard_size,
+                                    max_workers, now_time, start_time):
+        """
+        Create, query, and delete one report per batch of the master url list in parallel and merge the results.
+
+        Every shard covers the same time span so the shard csv files share a header and can be merged into a single
+        csv with one header. The shard csv files are written to a temporary folder beside the csv and the merged csv
+        replaces the csv atomically. If any shard fails the csv is left as it was and the script exits.
+        :param master_urls_list: list of master folder and service urls
+        :param basic_request_json: json including token and format, copied for each shard
+        :param root_machine_url: root url for machine
+        :param csv_path: path of the csv file to be written
+        :param shard_size: maximum number of urls in each report
+        :param max_workers: maximum number of shards processed at once
+        :param now_time: utc datetime the report time span ends at
+        :param start_time: utc datetime the report time span starts at
+        :return: None
         """
-        Submit a request with parameters to a url and return the response.
+        url_shards = [master_urls_list[index:index + shard_size]
+                      for index in range(0, len(master_urls_list), max(1, shard_size))]
+        print(f"Creating, Querying, and Deleting {len(url_shards)} Report Shards")
+        with tempfile.TemporaryDirectory(prefix=".report_shards.", dir=os.path.dirname(os.path.abspath(csv_path))) \
+                as shard_folder:
+            shard_csv_paths = [os.path.join(shard_folder, f"shard_{index}.csv") for index in range(len(url_shards))]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = [executor.submit(process_report_shard,
+                                           master_urls_list=url_shard,
+                                           basic_request_json=dict(basic_request_json),
+                                           root_machine_url=root_machine_url,
+                                           csv_path=shard_csv_path,
+                                           now_time=now_time,
+                                           start_time=start_time)
+                           for url_shard, shard_csv_path in zip(url_shards, shard_csv_paths)]
+                shard_errors = []
+                for index, future in enumerate(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Error in report shard {index}: {e}")
+                        shard_errors.append(e)
+            if shard_errors:
+                print(f"{len(shard_errors)} of {len(url_shards)} report shards failed. The csv was not updated.")
+                exit()
+            print("Merging Report Shards")
+            merge_csv_files(csv_paths=shard_csv_paths, csv_path=csv_path)
+        return
 
+    def fail_over_request(url, params, failed_machine_name):
+        """
+        Move the current machine off a machine that failed and return the url rewritten for the next-best machine.
+
+        A token in the parameters is replaced with a token for the new machine, which updates every request sharing
+        the parameters.
+        :param url: url of the request that failed
+        :param params: parameters that accompanied the request
+        :param failed_machine_name: name of the machine that failed
+        :return: rewritten url, or None when there is no healthy machine left to fail over to
+        """
+        if failed_machine_name is None:
+            return None
+        next_machine_name = machine_selector_object.fail_over(failed_machine_name=failed_machine_name)
+        if next_machine_name is None:
+            return None
+        next_root_url = SERVER_ROOT_URL.format(machine_name=next_machine_name, port=SERVER_PORT_SECURE)
+        print(f"Failing over from {failed_machine_name} to {next_machine_name}")
+        if "token" in params:
+            params["token"] = token_cache_object.get_token(machine_name=next_machine_name, root_url=next_root_url)
+        return machine_selector_object.route(url=url)
+
+    def get_response(url, params, exit_on_error=True, stream=False, refresh_rejected_token=True, deadline_seconds=None,
+                     hedge_after_seconds=0.0):
+        """
+        Submit a request with parameters to a url and return the response, retrying transient failures.
+
+        A failed attempt is retried with exponential backoff until REQUEST_MAX_ATTEMPTS attempts have been made or the
+        deadline has passed, and the timeouts of every attempt are cut to the time left before the deadline. When a
+        machine cannot be reached or answers with an html error page the next attempt is failed over to the next-best
+        machine without waiting. When the server rejects the token in the parameters, a refreshed token is put into the
+        parameters, which updates every request sharing them, and the request is resubmitted without waiting. A token
+        rejected again is retried with backoff, as these rejections are random and pass. A csv response is returned as
+        the response object itself. When stream is True its body has not been downloaded yet and is intended to be
+        consumed in chunks by write_response_to_csv().
         :param url: url to which to make a request
         :param params: parameters to accompany the request
+        :param exit_on_error: exit the script on failure when True, otherwise re-raise the exception to the caller
+        :param stream: defer downloading the response body until it is accessed when True
+        :param refresh_rejected_token: refresh the token and resubmit once when the server rejects it
+        :param deadline_seconds: seconds after which no further attempt is made, REQUEST_DEADLINE_SECONDS by default
+        :param hedge_after_seconds: seconds after which a duplicate of an attempt that has not been answered is sent to
+            a second machine and the first answer is used, 0 for no hedging
         :return: response from request
         """
         # Protectionary action, to deal with mixed path characters between url syntax and os.path.join use of "\"
         url = url.replace("\\", "/")
+        deadline = time.monotonic() + (REQUEST_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+        attempt = 0
+        while True:
+            attempt += 1
+
+            # Requests meant for a machine that already failed during this run go to the current machine instead
+            url = machine_selector_object.route(url=url)
+            machine_name, root_url = machine_for_url(url=url)
+            remaining_seconds = max(0.001, deadline - time.monotonic())
+            timeout = (min(HTTP_CONNECT_TIMEOUT, remaining_seconds), min(HTTP_READ_TIMEOUT, remaining_seconds))
+            retry_now = False
+            try:
+                if hedge_after_seconds > 0:
+                    return submit_hedged_request(url=url,
+                                                 params=params,
+                                                 stream=stream,
+                                                 timeout=timeout,
+                                                 hedge_after_seconds=hedge_after_seconds)
+                return submit_request(url=url, params=params, stream=stream, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, NotJSONException) as e:
+                print("Error in response from requests: {}".format(e))
+                error = e
+                fail_over_url = fail_over_request(url=url, params=params, failed_machine_name=machine_name)
+                if fail_over_url is not None:
+                    url = fail_over_url
+                    retry_now = True
+            except TransientResponseException as tre:
+                print(f"Error in response from {machine_name or url}: {tre}")
+                error = tre
+                if tre.token_rejected and refresh_rejected_token and "token" in params and machine_name is not None:
+                    print(f"Token rejected by {machine_name}. Refreshing token and resubmitting request.")
+                    params["token"] = token_cache_object.get_token(machine_name=machine_name,
+                                                                   root_url=root_url,
+                                                                   rejected_token=params["token"])
+                    refresh_rejected_token = False
+                    retry_now = True
+            except (json.decoder.JSONDecodeError, requests.exceptions.ChunkedEncodingError) as e:
+                print("Error decoding response to json: {}".format(e))
+                error = e
+            except Exception as e:
+                print("Error in response from requests: {}".format(e))
+                if not exit_on_error:
+                    raise
+                exit()
 
-        try:
-            # Jessie discovered "verify" option and set to False to bypass the ssl issue
-            response = requests.post(url=url, data=params, verify=False)
-        except Exception as e:
-            print("Error in response from requests: {}".format(e))
-            exit()
+            remaining_seconds = deadline - time.monotonic()
+            if attempt >= REQUEST_MAX_ATTEMPTS or remaining_seconds <= 0:
+                break
+            if not retry_now:
+                delay = backoff_delay(attempt=attempt, remaining_seconds=remaining_seconds)
+                print(f"Retrying in {delay:.1f} seconds (attempt {attempt + 1} of {REQUEST_MAX_ATTEMPTS})")
+                time.sleep(delay)
+
+        print(f"Request failed after {attempt} attempt(s): {url}")
+        if not exit_on_error:
+            raise error
+        exit()
+
+    def inventory_folder_services(service_inventory_object, folder_names, params, root_machine_url, max_workers):
+        """
+        Add the services of every folder to the inventory by requesting the folder contents concurrently.
+
+        Requests are submitted to a bounded pool of worker threads but the results are consumed in the order of the
+        folder names list, so the inventory, and the master url list built from it, is deterministic regardless of
+        the order in which the requests complete. A folder that fails is reported and left without services rather
+        than stopping the crawl.
+        :param service_inventory_object: ServiceInventoryObject to which the services are added
+        :param folder_names: list of names of the folders to be inventoried
+        :param params: parameters to accompany each request
+        :param root_machine_url: url for the machine, rather than the web adaptor path
+        :param max_workers: maximum number of folder requests in flight at once
+        :return: list of (folder name, exception) tuples for the folders that failed
+        """
+        failed_folders = []
+        rest_url_machine_root = AdminObject(root_machine_url=root_machine_url).rest_url_machine_root
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(request_folder_services,
+                                       folder_machine_url=f"{rest_url_machine_root}/{folder_name}",
+                                       params=params)
+                       for folder_name in folder_names]
+            for folder_name, future in zip(folder_names, futures):
+                try:
+                    services_json = future.result()
+
+                    # Need to store the inventory of services that are within each folder
+                    service_inventory_object.add_services_json(folder_name=folder_name, services_json=services_json)
+                except Exception as e:
+                    print(f"Error inventorying folder '{folder_name}': {e}")
+                    failed_folders.append((folder_name, e))
+        return failed_folders
+
+    def inventory_site():
+        """
+        Select a machine, get a token, and inventory the folders and services of the site, from the inventory cache
+        where it is current.
+        :return: tuple of the MachineObject of the selected machine, the basic secure request parameters, and the
+            master url list of folder and service short urls
+        """
+        run_metrics_object.start_phase(phase_name="probe")
+
+        #   The inventory cache file is read while the machines are probed, as neither needs the other.
+        pipeline_object.submit(stage_name="inventory_cache_load", function=inventory_cache_object.ensure_loaded)
+
+        #   Need a machine to which to make a request. Since we are bypassing the web adaptor, all machines are
+        #       probed concurrently and the fastest healthy one is used. Requests fail over to the next-best machine on
+        #       failure.
+        machine = machine_selector_object.select_machine()
+
+        run_metrics_object.start_phase(phase_name="token")
+
+        #   Need a token to make secure requests. A cached token is reused until shortly before it expires.
+        root_server_url = SERVER_ROOT_URL.format(machine_name=machine, port=SERVER_PORT_SECURE)
+        token = token_cache_object.get_token(machine_name=machine, root_url=root_server_url)
+
+        #   Create a machine object for the selected ArcGIS Server machine. To store related values in object. Folders
+        #       variable assigned below
+        machine_object = MachineObject(machine_name=machine,
+                                       root_url=root_server_url,
+                                       security_token=token)
+
+        run_metrics_object.start_phase(phase_name="folders")
+
+        #   The folder and service inventory rarely changes so it is cached between runs. A snapshot checked within
+        #       the TTL is used without any requests. Otherwise the folders list is requested and only added or stale
+        #       folders are crawled again below.
+        basic_secure_params = create_params_for_request(token_action=machine_object.token)
+        pipeline_object.result(stage_name="inventory_cache_load")
+        use_cached_inventory = inventory_cache_object.is_fresh()
+        if not use_cached_inventory:
+            #   Need to make a secure request for response as JSON to be able to access folders and services details. If
+            #       it still fails after its retries the cached inventory, when there is one, is used as is.
+            admin_object = AdminObject(root_machine_url=root_server_url)
+            try:
+                folders_request_response = get_response(url=admin_object.admin_services_url,
+                                                        params=basic_secure_params,
+                                                        exit_on_error=False)
+                folder_names_raw = search_json_for_key(response_json=folders_request_response,
+                                                       search_key="folders",
+                                                       exit_on_error=False)
+            except Exception as e:
+                if not inventory_cache_object.folder_names():
+                    print(f"The folders list could not be requested and there is no cached inventory: {e}")
+                    exit()
+                print(f"WARNING: The folders list could not be requested. Using the cached inventory: {e}")
+                use_cached_inventory = True
+        if use_cached_inventory:
+            folder_names_clean = inventory_cache_object.folder_names()
         else:
-            result = None
+            #   Need folder names list and to clean list; Remove System & Utilities, & append entry for root folder, per
+            #       Jessie
+            #   NOTE: Noticed that Jessie also included 'GeoprocessingServices', but did not in statusdashboard script
+            remove_folders = ["System", "Utilities", "GeoprocessingServices"]
+            folder_names_clean = list(set(folder_names_raw) - set(remove_folders))
+            folder_names_clean.append("")
+            folder_names_clean.sort()
+
+        #   Assign the folder names list to the machine object variable.
+        machine_object.folder_names_list = folder_names_clean
+        print(machine_object)
+
+        #   Need a single list containing all folder url's AND all service url's from within all of those folders.
+        #   It is passed to the server and indicates the resourceURIs for which metrics will be built in the query
+        #       process
+        #   Uses a ServiceInventoryObject, which stores the folder and service names in compact arrays and builds the
+        #       urls from them when they are needed
+        service_inventory_object = ServiceInventory.ServiceInventoryObject()
+        for folder_name in machine_object.folder_names_list:
+            service_inventory_object.add_folder(folder_name=folder_name)
+
+        run_metrics_object.start_phase(phase_name="crawl")
+
+        #   For each folder, need the services in that folder. Cached folders that are still current are restored from
+        #       the snapshot. The rest are requested concurrently by a bounded pool of workers; a folder that fails is
+        #       reported, falls back to its cached services if it has any, and the crawl carries on.
+        folder_names_to_crawl = set() if use_cached_inventory else inventory_cache_object.folder_names_to_crawl(
+            folder_names=folder_names_clean)
+        folders_to_crawl = [folder_name for folder_name in folder_names_clean if folder_name in folder_names_to_crawl]
+        for folder_name in folder_names_clean:
+            if folder_name not in folder_names_to_crawl:
+                inventory_cache_object.restore_services(service_inventory_object=service_inventory_object,
+                                                        folder_name=folder_name)
+        print(f"Crawling {len(folders_to_crawl)} of {len(folder_names_clean)} folders")
+        failed_folders = inventory_folder_services(service_inventory_object=service_inventory_object,
+                                                   folder_names=folders_to_crawl,
+                                                   params=basic_secure_params,
+                                                   root_machine_url=machine_object.root_url,
+                                                   max_workers=CRAWL_MAX_WORKERS)
+        failed_folder_names = {folder_name for folder_name, error in failed_folders}
+        if failed_folders:
+            print(f"WARNING: {len(failed_folders)} folder(s) could not be inventoried: {sorted(failed_folder_names)}")
+            for folder_name in folders_to_crawl:
+                if folder_name in failed_folder_names and not inventory_cache_object.restore_services(
+                        service_inventory_object=service_inventory_object, folder_name=folder_name):
+                    print(f"WARNING: No cached services for folder '{folder_name}'. Its services are missing.")
+        if not use_cached_inventory:
+            inventory_cache_object.save(service_inventory_object=service_inventory_object,
+                                        crawled_folder_names=folder_names_to_crawl - failed_folder_names)
+
+        master_url_list = create_master_url_list(service_inventory_object)
+        return machine_object, basic_secure_params, master_url_list
+
+    @contextlib.contextmanager
+    def lock_file(lock_path):
+        """
+        Hold an exclusive lock on a lock file for the duration of the with block, waiting for other holders.
+        :param lock_path: path of the lock file, created if it does not exist
+        :return: None
+        """
+        with open(lock_path, "a+") as lock_file_handler:
+            if os.name == "nt":
+                lock_file_handler.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lock_file_handler.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after roughly ten seconds; keep waiting for the other holder
+                        continue
+                try:
+                    yield
+                finally:
+                    lock_file_handler.seek(0)
+                    msvcrt.locking(lock_file_handler.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file_handler.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file_handler.fileno(), fcntl.LOCK_UN)
+
+    def machine_for_url(url):
+        """
+        Find the configured machine whose root url begins the url.
+        :param url: url to which a request will be made
+        :return: tuple of machine name and root url, or (None, None) when the url is not on a known machine
+        """
+        for machine_name in SERVER_MACHINE_NAMES.values():
+            root_url = SERVER_ROOT_URL.format(machine_name=machine_name, port=SERVER_PORT_SECURE)
+            if url.startswith(root_url):
+                return machine_name, root_url
+        return None, None
+
+    def merge_csv_files(csv_paths, csv_path):
+        """
+        Concatenate csv files that share a header into a single csv with one header.
+
+        The files are copied in order, in chunks, to a temporary file beside the csv, which is then atomically moved
+        onto the csv path.
+        :param csv_paths: list of paths of the csv files to be merged, in order
+        :param csv_path: path of the merged csv file to be written
+        :return: None
+        """
+        temp_file_descriptor, temp_csv_path = tempfile.mkstemp(prefix=f".{os.path.basename(csv_path)}.",
+                                                               suffix=".tmp",
+                                                               dir=os.path.dirname(os.path.abspath(csv_path)))
+        try:
+            with os.fdopen(temp_file_descriptor, 'wb') as merged_file_handler:
+                first_header = None
+                for shard_csv_path in csv_paths:
+                    with open(shard_csv_path, 'rb') as shard_file_handler:
+                        header = shard_file_handler.readline()
+                        if not header:
+                            continue
+                        if first_header is None:
+                            first_header = header
+                            merged_file_handler.write(header)
+                        elif header.rstrip(b"\r\n") != first_header.rstrip(b"\r\n"):
+                            raise ValueError(f"Csv header of {shard_csv_path} does not match the first csv header")
+                        last_chunk = header
+                        for chunk in iter(lambda: shard_file_handler.read(CSV_CHUNK_SIZE), b""):
+                            merged_file_handler.write(chunk)
+                            last_chunk = chunk
+                        if not last_chunk.endswith(b"\n"):
+                            merged_file_handler.write(b"\n")
+                merged_file_handler.flush()
+                os.fsync(merged_file_handler.fileno())
+            os.chmod(temp_csv_path, 0o644)
+            os.replace(temp_csv_path, csv_path)
+        except BaseException:
+            if os.path.exists(temp_csv_path):
+                os.remove(temp_csv_path)
+            raise
+        return
+
+    def open_time_series_store():
+        """
+        Open the local time series store in TIME_SERIES_STORE_PATH.
+        NOTE: numpy is only needed for the store so it is imported here rather than with the other imports.
+        :return: UsageTimeSeriesStore.TimeSeriesStoreObject
+        """
+        import UsageTimeSeriesStore
+        return UsageTimeSeriesStore.TimeSeriesStoreObject(store_path=TIME_SERIES_STORE_PATH)
+
+    def parse_utc_time(value):
+        """
+        Parse a UTC date, or date and time to the minute, given on the command line.
+        :param value: string, for example '2026-09-01' or '2026-09-01T06:00'
+        :return: naive utc datetime
+        """
+        for time_format in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M"):
             try:
-                if "html" in response.headers["Content-Type"]:
-                    raise NotJSONException
-                elif "text/csv" in response.headers["Content-Type"]:
-                    result = response
-                elif "application/json" in response.headers["Content-Type"]:
-                    result = response.json()
-            except json.decoder.JSONDecodeError as jde:
-                print("Error decoding response to json: {}".format(jde))
-                print(response)
-                print(response.url)
-                print(response.text)
-                exit()
-            except NotJSONException as NJE:
-                print(f"Response appears to be html, not json.")
-                print(response.url)
-                print(response.headers)
-                exit()
-            return result
+                return datetime.datetime.strptime(value, time_format)
+            except ValueError:
+                continue
+        raise ValueError(f"'{value}' is not a date (YYYY-MM-DD) or a date and time (YYYY-MM-DDTHH:MM)")
 
-    def search_json_for_key(response_json, search_key):
-        """Search json for a key of interest and return the found value or exit on Key or Type Error."""
+    def process_report_shard(master_urls_list, basic_request_json, root_machine_url, csv_path, now_time, start_time):
+        """
+        Create a report for a batch of urls on the server, stream its contents to a csv file, and delete it.
+
+        Intended to be run by a worker thread so errors are raised to the caller rather than exiting the script. The
+        report is deleted even when querying it fails.
+        :param master_urls_list: list of folder and service urls in the shard
+        :param basic_request_json: json including token and format, not shared with other shards
+        :param root_machine_url: root url for machine
+        :param csv_path: path of the shard csv file to be written
+        :param now_time: utc datetime the report time span ends at, shared by all shards
+        :param start_time: utc datetime the report time span starts at, shared by all shards
+        :return: None
+        """
+        report_object = ReportObject(root_machine_url=root_machine_url,
+                                     master_urls_list=master_urls_list,
+                                     basic_request_json=basic_request_json,
+                                     now_time=now_time,
+                                     start_time=start_time)
+        usage_report_params = create_params_for_request(token_action=basic_request_json["token"],
+                                                        json_payload=report_object.report_json_params)
+        get_response(url=report_object.report_url_create, params=usage_report_params, exit_on_error=False)
+        try:
+            post_data_query = {'filter': json.dumps({'machines': '*'})}
+            report_query_params = create_params_for_request(token_action=usage_report_params["token"],
+                                                            json_payload=post_data_query,
+                                                            response_format='csv')
+            query_report_to_csv(report_url_query=report_object.report_url_query,
+                                params=report_query_params,
+                                csv_path=csv_path,
+                                exit_on_error=False)
+        finally:
+            try:
+                get_response(url=report_object.report_url_delete,
+                             params=create_params_for_request(token_action=usage_report_params["token"]),
+                             exit_on_error=False)
+            except Exception as e:
+                print(f"WARNING: Report {report_object.report_name_id} could not be deleted: {e}")
+        return
+
+    def query_machine_breakdown(report_object, csv_path):
+        """
+        Query a report once for every machine, filtered to that machine, and combine the results into one csv with a
+        Machine column, so that the requests each machine answered can be compared.
+
+        The queries run concurrently and each is sent to the machine it is filtered to, with that machine's token, so
+        the breakdown takes about as long as the slowest query and spreads the work of building it over the machines.
+        The report holds the usage of the whole site, so any machine can answer any filter; a query to a machine that
+        failed during this run goes to the current machine instead. When any query fails the csv is left as it was.
+        :param report_object: ReportObject of a report that exists on the server
+        :param csv_path: path of the csv file to be written
+        :return: True when the csv was written
+        """
+        report_machine_name, report_root_url = machine_for_url(url=report_object.report_url_query)
+
+        def query_machine(machine_name, machine_csv_path):
+            machine_root_url = SERVER_ROOT_URL.format(machine_name=machine_name, port=SERVER_PORT_SECURE)
+            url = machine_selector_object.route(url=machine_root_url
+                                                + report_object.report_url_query[len(report_root_url):])
+            url_machine_name, url_root_url = machine_for_url(url=url)
+            token = token_cache_object.get_token(machine_name=url_machine_name, root_url=url_root_url)
+            machine_filter = {"machines": [MACHINE_BREAKDOWN_FILTER_TEMPLATE.format(machine_name=machine_name)]}
+            params = create_params_for_request(token_action=token,
+                                               json_payload={'filter': json.dumps(machine_filter)},
+                                               response_format='csv')
+            query_report_to_csv(report_url_query=url, params=params, csv_path=machine_csv_path, exit_on_error=False)
+
+        with tempfile.TemporaryDirectory(prefix=".machine_breakdown.",
+                                         dir=os.path.dirname(os.path.abspath(csv_path))) as breakdown_folder:
+            machine_csv_paths = {machine_name: os.path.join(breakdown_folder, f"machine_{index}.csv")
+                                 for index, machine_name in SERVER_MACHINE_NAMES.items()}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(machine_csv_paths))) as executor:
+                futures = {executor.submit(query_machine, machine_name=machine_name, machine_csv_path=machine_csv_path):
+                           machine_name for machine_name, machine_csv_path in machine_csv_paths.items()}
+                failed_machine_names = []
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
+                    except (Exception, SystemExit) as e:
+                        print(f"WARNING: Machine breakdown query for {futures[future]} failed: {e}")
+                        failed_machine_names.append(futures[future])
+            if failed_machine_names:
+                print("The machine breakdown csv was not updated")
+                return False
+            UsageReportCSV.combine_usage_report_csv(site_csv_paths=machine_csv_paths,
+                                                    output_csv_path=csv_path,
+                                                    label_name="Machine")
+        return True
+
+    def query_report_to_csv(report_url_query, params, csv_path, exit_on_error=True, usage_matrix_builder_object=None):
+        """
+        Query a report and stream its contents to a csv file, retrying when the download fails part way.
+
+        A query that has not been answered after REPORT_HEDGE_AFTER_SECONDS is hedged to a second machine. A failed
+        download leaves the csv as it was and the query is made again with backoff, within REPORT_QUERY_DEADLINE_SECONDS
+        for all attempts together. A query answered with json rather than csv, such as an error saying that the report
+        does not exist, raises ReportQueryException whatever exit_on_error is, so that the caller can decide what to do.
+        :param report_url_query: query url of the report
+        :param params: parameters to accompany the request
+        :param csv_path: path of the csv file to be written
+        :param exit_on_error: exit the script on failure when True, otherwise re-raise the exception to the caller
+        :param usage_matrix_builder_object: UsageAggregation.UsageMatrixBuilderObject that parses the csv as it is
+            downloaded, started again on every attempt, or None
+        :return: None
+        """
+        deadline = time.monotonic() + REPORT_QUERY_DEADLINE_SECONDS
+        attempt = 0
+        while True:
+            attempt += 1
+            report_query_response = get_response(url=report_url_query,
+                                                 params=params,
+                                                 exit_on_error=exit_on_error,
+                                                 stream=True,
+                                                 deadline_seconds=deadline - time.monotonic(),
+                                                 hedge_after_seconds=REPORT_HEDGE_AFTER_SECONDS)
+            if not isinstance(report_query_response, requests.Response):
+                raise ReportQueryException(response_json=report_query_response)
+            if usage_matrix_builder_object is not None:
+                usage_matrix_builder_object.reset()
+            try:
+                write_response_to_csv(response=report_query_response,
+                                      csv_path=csv_path,
+                                      usage_matrix_builder_object=usage_matrix_builder_object)
+                return
+            except requests.exceptions.RequestException as e:
+                print(f"Error downloading report: {e}")
+                remaining_seconds = deadline - time.monotonic()
+                if attempt >= REQUEST_MAX_ATTEMPTS or remaining_seconds <= 0:
+                    if not exit_on_error:
+                        raise
+                    exit()
+                time.sleep(backoff_delay(attempt=attempt, remaining_seconds=remaining_seconds))
+
+    def read_json_file(json_path, default):
+        """
+        Read json content from a file, returning the default when the path is empty, missing, or not valid json.
+        :param json_path: path of the json file
+        :param default: value returned when there is no content to read
+        :return: json content
+        """
+        if not json_path:
+            return default
+        try:
+            with open(json_path, "r") as json_file_handler:
+                return json.load(json_file_handler)
+        except (FileNotFoundError, ValueError):
+            return default
+
+    def request_folder_services(folder_machine_url, params):
+        """
+        Request the contents of a single services folder and return the json for the services within it.
+
+        Intended to be run by a worker thread so errors are raised to the caller rather than exiting the script.
+        :param folder_machine_url: url of the folder on the machine, for example
+            'https://gis-ags-imap02p.mdgov.maryland.gov:6443/arcgis/rest/services/Weather'
+        :param params: parameters to accompany the request
+        :return: list of service json objects
+        """
+        services_request_response = get_response(url=folder_machine_url,
+                                                 params=params,
+                                                 exit_on_error=False)
+        return search_json_for_key(response_json=services_request_response, search_key="services", exit_on_error=False)
+
+    def run_backfill(start_time, end_time):
+        """
+        Collect the usage between two times as a series of report-sized windows fetched in parallel and checkpointed,
+        so that running an interrupted backfill again carries on where it stopped.
+
+        Each window is a temporary report of its own, created, queried into a csv in BACKFILL_PATH, and deleted, with
+        up to BACKFILL_MAX_WORKERS windows at once; the concurrency governor still limits the requests to each
+        machine. A window is recorded in the checkpoint file once its csv has been written and, when there is a time
+        series store, added to it. Windows in the checkpoint whose csv still exists are skipped. A window that fails is
+        reported and left for the next run. SIGTERM and SIGINT stop the backfill once the windows in progress have
+        finished and been checkpointed.
+        :param start_time: utc datetime the backfill starts at
+        :param end_time: utc datetime the backfill ends at
+        :return: True when every window of the range has been collected
+        """
+        os.makedirs(BACKFILL_PATH, exist_ok=True)
+        checkpoint_path = os.path.join(BACKFILL_PATH, "checkpoint.json")
+        checkpoint = read_json_file(json_path=checkpoint_path, default={})
+        completed_windows = checkpoint.setdefault("completed_windows", {})
+        backfill_windows = create_backfill_windows(start_time=start_time,
+                                                   end_time=end_time,
+                                                   window_hours=BACKFILL_WINDOW_HOURS)
+        windows = {f"usage_{window_start_time:%Y%m%dT%H%M}_{window_end_time:%Y%m%dT%H%M}.csv":
+                   (window_start_time, window_end_time) for window_start_time, window_end_time in backfill_windows}
+        pending_window_names = [window_name for window_name in windows if window_name not in completed_windows
+                                or not os.path.exists(os.path.join(BACKFILL_PATH, window_name))]
+        print(f"Backfilling {start_time:%Y-%m-%d %H:%M} to {end_time:%Y-%m-%d %H:%M} UTC in {len(windows)} window(s) "
+              f"of up to {BACKFILL_WINDOW_HOURS} hours, {len(windows) - len(pending_window_names)} already collected")
+        if not pending_window_names:
+            return True
+
+        machine_object, basic_secure_params, master_url_list = inventory_site()
+
+        time_series_store_object = None
+        if TIME_SERIES_STORE_PATH:
+            time_series_store_object = open_time_series_store()
+
+        run_metrics_object.start_phase(phase_name="backfill")
+        stop_event = threading.Event()
+
+        def request_stop(signal_number, frame):
+            print(f"Received signal {signal_number}. Stopping after the windows in progress.")
+            stop_event.set()
+
+        def process_window(window_name):
+            # Windows that have not started when a stop is requested are left for the next run
+            if stop_event.is_set():
+                return False
+            window_start_time, window_end_time = windows[window_name]
+            process_report_shard(master_urls_list=master_url_list,
+                                 basic_request_json=dict(basic_secure_params),
+                                 root_machine_url=machine_object.root_url,
+                                 csv_path=os.path.join(BACKFILL_PATH, window_name),
+                                 now_time=window_end_time,
+                                 start_time=window_start_time)
+            return True
+
+        previous_handlers = {signal_number: signal.signal(signal_number, request_stop)
+                             for signal_number in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, BACKFILL_MAX_WORKERS)) as executor:
+                futures = {executor.submit(process_window, window_name): window_name
+                           for window_name in pending_window_names}
+                for future in concurrent.futures.as_completed(futures):
+                    window_name = futures[future]
+                    try:
+                        if not future.result():
+                            continue
+                    except (Exception, SystemExit) as e:
+                        print(f"WARNING: Backfill window {window_name} failed: {e}")
+                        continue
+
+                    # Only the main thread writes to the store and the checkpoint
+                    window_csv_path = os.path.join(BACKFILL_PATH, window_name)
+                    if time_series_store_object is not None:
+                        time_series_store_object.ingest_csv(csv_path=window_csv_path)
+                    window_start_time, window_end_time = windows[window_name]
+                    completed_windows[window_name] = {
+                        "start": ReportObject.datetime_to_timestamp_seconds(window_start_time) * 1000,
+                        "end": ReportObject.datetime_to_timestamp_seconds(window_end_time) * 1000,
+                        "completed": time.time()}
+                    write_json_atomically(json_path=checkpoint_path, content=checkpoint)
+                    print(f"Backfilled {window_name}")
+        finally:
+            for signal_number, previous_handler in previous_handlers.items():
+                signal.signal(signal_number, previous_handler)
+        machine_selector_object.save()
+
+        remaining_count = sum(1 for window_name in windows if window_name not in completed_windows)
+        if remaining_count:
+            print(f"WARNING: {remaining_count} of {len(windows)} backfill window(s) were not collected. Run the same "
+                  f"backfill again to resume.")
+            return False
+        print("Backfill complete")
+        return True
+
+    def run_collection_cycle():
+        """
+        Run the pipeline once with every phase timed and every request recorded. The run record and Prometheus
+        textfile are written at the end of the cycle, including when it fails.
+        :return: None
+        """
+        run_metrics_object.start_run()
+        concurrency_governor_object.start_run()
+        pipeline_object.start_run()
+        try:
+            collect_usage_report()
+        except BaseException:
+            run_metrics_object.finish(success=False)
+            raise
+        run_metrics_object.finish(success=True)
+        print("Complete!")
+        return
+
+    def run_daemon(interval_seconds, jitter_seconds):
+        """
+        Run collection cycles one after another until SIGTERM or SIGINT is received.
+
+        A cycle starts the interval after the previous one started plus a random jitter, so that scheduled runs on
+        several hosts drift apart. A cycle that takes longer than the interval is followed by the next one straight
+        away, so cycles never overlap. A cycle that fails is reported and the daemon carries on with the next. A
+        signal received during a cycle lets the cycle finish before the daemon stops; one received between cycles
+        stops it at once.
+        :param interval_seconds: seconds from the start of one cycle to the start of the next
+        :param jitter_seconds: maximum random seconds added to the wait before each cycle
+        :return: None
+        """
+        stop_event = threading.Event()
+
+        def request_stop(signal_number, frame):
+            print(f"Received signal {signal_number}. Stopping after the current cycle.")
+            stop_event.set()
+
+        previous_handlers = {signal_number: signal.signal(signal_number, request_stop)
+                             for signal_number in (signal.SIGINT, signal.SIGTERM)}
+        print(f"Daemon started. Collecting every {interval_seconds} seconds.")
+        try:
+            while not stop_event.is_set():
+                cycle_start = time.monotonic()
+                try:
+                    run_collection_cycle()
+                except SystemExit:
+                    # The pipeline exits when it cannot carry on, which ends the cycle rather than the daemon
+                    print("WARNING: The cycle stopped early. The csv was not updated by this cycle.")
+                except Exception as e:
+                    print(f"WARNING: The cycle failed. The csv was not updated by this cycle: {e}")
+                delay = (max(0.0, interval_seconds - (time.monotonic() - cycle_start))
+                         + random.uniform(0, jitter_seconds))
+                if not stop_event.is_set():
+                    print(f"Next cycle in {delay:.0f} seconds")
+                stop_event.wait(timeout=delay)
+        finally:
+            for signal_number, previous_handler in previous_handlers.items():
+                signal.signal(signal_number, previous_handler)
+        print("Daemon stopped")
+        return
+
+    def search_json_for_key(response_json, search_key, exit_on_error=True):
+        """Search json for a key of interest and return the found value or exit (or raise) on Key or Type Error."""
         try:
             value = response_json[search_key]
         except KeyError as ke:
             print("KeyError: {}".format(ke))
+            if not exit_on_error:
+                raise
             exit()
         except TypeError as te:
             print("TypeError: {}".format(te))
             print(response_json)
+            if not exit_on_error:
+                raise
             exit()
         else:
             return value
 
-    def write_response_to_csv(response, csv_path):
-        """Write content to a csv file."""
-        with open(csv_path, 'w') as csv_file_handler:
-            for line in response.text:
-                csv_file_handler.write(line)
+    def submit_hedged_request(url, params, stream, timeout, hedge_after_seconds):
+        """
+        Make an attempt at a request and, if it has not been answered after the hedge delay, send a duplicate to a
+        second machine and use whichever answer comes first.
+
+        The duplicate carries a token for the second machine in a copy of the parameters. The slower response is
+        closed when it arrives so its connection returns to the pool. When both attempts fail the error of the first is
+        raised, so that the caller fails over from, or refreshes the token of, the machine the request was meant for.
+        :param url: url to which to make a request
+        :param params: parameters to accompany the request
+        :param stream: defer downloading the response body until it is accessed when True
+        :param timeout: tuple of connect and read timeouts in seconds
+        :param hedge_after_seconds: seconds to wait for the first attempt before sending the duplicate
+        :return: json content, or the response object itself for a csv response
+        """
+        machine_name, root_url = machine_for_url(url=url)
+        hedge_machine_name = machine_selector_object.hedge_machine_name(machine_name=machine_name)
+        if machine_name is None or hedge_machine_name is None:
+            return submit_request(url=url, params=params, stream=stream, timeout=timeout)
+
+        def close_response(future):
+            if not future.cancelled() and future.exception() is None and hasattr(future.result(), "close"):
+                future.result().close()
+
+        # The executor is not used as a context manager because that would wait for the slower attempt to finish
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            primary_future = executor.submit(submit_request, url=url, params=params, stream=stream, timeout=timeout)
+            done, pending = concurrent.futures.wait([primary_future], timeout=hedge_after_seconds)
+            if done:
+                return primary_future.result()
+
+            hedge_root_url = SERVER_ROOT_URL.format(machine_name=hedge_machine_name, port=SERVER_PORT_SECURE)
+            hedge_params = dict(params)
+            if "token" in hedge_params:
+                hedge_params["token"] = token_cache_object.get_token(machine_name=hedge_machine_name,
+                                                                     root_url=hedge_root_url)
+            print(f"No answer from {machine_name} after {hedge_after_seconds} seconds. "
+                  f"Sending a hedged request to {hedge_machine_name}")
+            hedge_future = executor.submit(submit_request,
+                                           url=hedge_root_url + url[len(root_url):],
+                                           params=hedge_params,
+                                           stream=stream,
+                                           timeout=timeout)
+            pending = {primary_future, hedge_future}
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                answered = [future for future in (primary_future, hedge_future)
+                            if future in done and future.exception() is None]
+                if answered:
+                    winner = answered[0]
+                    for future in (primary_future, hedge_future):
+                        if future is not winner:
+                            future.add_done_callback(close_response)
+                    if winner is hedge_future:
+                        print(f"Hedged request to {hedge_machine_name} answered first")
+                    return winner.result()
+            return primary_future.result()
+        finally:
+            executor.shutdown(wait=False)
+
+    def submit_request(url, params, stream=False, timeout=None):
+        """
+        Make a single attempt at a request and interpret the response.
+
+        Raises NotJSONException for an html error page and TransientResponseException for an http server error, an
+        ArcGIS error the server is expected to recover from, or a token rejection. Connection errors, timeouts, and
+        json decoding errors are raised as they are. The attempt waits for a slot under its machine's concurrency limit
+        and tells the governor how it went.
+        :param url: url to which to make a request
+        :param params: parameters to accompany the request
+        :param stream: defer downloading the response body until it is accessed when True
+        :param timeout: tuple of connect and read timeouts in seconds, the client's timeouts by default
+        :return: json content, or the response object itself for a csv response
+        """
+        machine_name, root_url = machine_for_url(url=url)
+        sent = concurrency_governor_object.acquire(machine_name=machine_name)
+        start = time.perf_counter()
+        healthy = False
+        try:
+            try:
+                response = client_object.post(url=url, data=params, stream=stream, timeout=timeout)
+            except requests.exceptions.RequestException:
+                run_metrics_object.record_request(machine_name=machine_name,
+                                                  status_code=None,
+                                                  seconds=time.perf_counter() - start,
+                                                  response_bytes=0)
+                raise
+
+            # A streamed body has not been downloaded yet, so only its declared length is known
+            run_metrics_object.record_request(machine_name=machine_name,
+                                              status_code=response.status_code,
+                                              seconds=time.perf_counter() - start,
+                                              response_bytes=int(response.headers.get("Content-Length") or 0) if stream
+                                              else len(response.content))
+            content_type = response.headers.get("Content-Type", "")
+            if response.status_code in TransientResponseException.TRANSIENT_STATUS_CODES:
+                response.close()
+                raise TransientResponseException(message=f"HTTP {response.status_code} {response.reason}")
+            result = None
+            if "html" in content_type:
+                print("Response appears to be html, not json.")
+                print(response.url)
+                print(response.headers)
+                response.close()
+                raise NotJSONException
+            elif "text/csv" in content_type:
+                result = response
+            elif "application/json" in content_type:
+                result = response.json()
+            if TokenCacheObject.is_token_rejection(response_json=result):
+                # Token rejections are random and say nothing about how busy the machine is
+                healthy = None
+                raise TransientResponseException(message=f"Token rejected: {result}", token_rejected=True)
+            if TransientResponseException.is_transient_error(response_json=result):
+                raise TransientResponseException(message=f"Server error: {result}")
+            healthy = True
+        finally:
+            concurrency_governor_object.release(machine_name=machine_name,
+                                                sent=sent,
+                                                healthy=healthy,
+                                                latency=None if stream else time.perf_counter() - start)
+        return result
+
+    def sweep_stale_reports(root_machine_url, token):
+        """
+        Delete the temporary reports that runs of this script created but did not delete, for example because they
+        were interrupted, once they are older than REPORT_SWEEP_MIN_AGE_SECONDS.
+
+        Intended to be run after the report has been collected, so errors are raised to the caller rather than exiting
+        the script. A report that cannot be deleted is reported and the sweep carries on.
+        :param root_machine_url: root url for machine
+        :param token: token to accompany the requests
+        :return: number of reports deleted
+        """
+        usage_reports_response = get_response(url=f"{root_machine_url}/{ReportObject.USAGE_REPORT_ENDING__LIST}",
+                                              params=create_params_for_request(token_action=token),
+                                              exit_on_error=False)
+        report_definitions = search_json_for_key(response_json=usage_reports_response,
+                                                 search_key="metrics",
+                                                 exit_on_error=False)
+        deleted_count = 0
+        for report_definition in report_definitions:
+            if not ReportObject.is_stale_temp_report(report_definition=report_definition,
+                                                     min_age_seconds=REPORT_SWEEP_MIN_AGE_SECONDS):
+                continue
+            report_name = report_definition["reportname"]
+            delete_ending = ReportObject.USAGE_REPORT_ENDING__DELETE.format(report_name=report_name)
+            try:
+                get_response(url=f"{root_machine_url}/{delete_ending}",
+                             params=create_params_for_request(token_action=token),
+                             exit_on_error=False)
+                deleted_count += 1
+            except Exception as e:
+                print(f"WARNING: Report {report_name} could not be deleted: {e}")
+        return deleted_count
+
+    def update_persistent_report(report_object, token):
+        """
+        Replace the definition of the persistent report on the server, creating the report when it does not exist.
+        :param report_object: ReportObject of the persistent report
+        :param token: token to accompany the requests
+        :return: None
+        """
+        usage_report_params = create_params_for_request(token_action=token,
+                                                        json_payload=report_object.report_json_params)
+        try:
+            edit_response = get_response(url=report_object.report_url_edit,
+                                         params=usage_report_params,
+                                         exit_on_error=False)
+        except Exception as e:
+            edit_response = {"status": "error", "messages": [str(e)]}
+        if isinstance(edit_response, dict) and edit_response.get("status") == "error":
+            print(f"Report {report_object.report_name_id} could not be edited, so it is created: {edit_response}")
+            create_response = get_response(url=report_object.report_url_create, params=usage_report_params)
+            if isinstance(create_response, dict) and create_response.get("status") == "error":
+                print(f"Report {report_object.report_name_id} could not be created: {create_response}")
+                exit()
+        return
+
+    def write_bytes_atomically(file_path, content, file_mode=0o644):
+        """
+        Write bytes to a temporary file beside the path and atomically move it onto the path, so that readers such as
+        the node exporter never see a partly written file.
+        :param file_path: path of the file to be written
+        :param content: bytes content
+        :param file_mode: permissions applied to the file before it is moved into place
+        :return: None
+        """
+        temp_file_descriptor, temp_file_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.",
+                                                                suffix=".tmp",
+                                                                dir=os.path.dirname(os.path.abspath(file_path)))
+        try:
+            with os.fdopen(temp_file_descriptor, 'wb') as file_handler:
+                file_handler.write(content)
+            os.chmod(temp_file_path, file_mode)
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+        return
+
+    def write_json_atomically(json_path, content, file_mode=0o644):
+        """
+        Write json content to a temporary file beside the json path and atomically move it onto the path.
+        :param json_path: path of the json file to be written
+        :param content: json serializable content
+        :param file_mode: permissions applied to the file before it is moved into place
+        :return: None
+        """
+        write_text_atomically(text_path=json_path, text=json.dumps(content), file_mode=file_mode)
+        return
+
+    def write_response_to_csv(response, csv_path, chunk_size=CSV_CHUNK_SIZE, usage_matrix_builder_object=None):
+        """
+        Write content to a csv file.
+
+        The response body is streamed in large chunks into a temporary file beside the csv and the temporary file is
+        then atomically moved onto the csv path. The dashboard never reads a half-written csv and memory use is set by
+        the chunk size rather than the size of the report. Each chunk can also be fed to a usage matrix builder, so
+        that the report is parsed while the rest of it is still downloading.
+        :param response: csv response from the report query, ideally requested with stream=True
+        :param csv_path: path of the csv file to be written
+        :param chunk_size: number of bytes read from the response and written to the file at a time
+        :param usage_matrix_builder_object: UsageAggregation.UsageMatrixBuilderObject fed every chunk, or None
+        :return: None
+        """
+        csv_folder = os.path.dirname(os.path.abspath(csv_path))
+        temp_file_descriptor, temp_csv_path = tempfile.mkstemp(prefix=f".{os.path.basename(csv_path)}.",
+                                                               suffix=".tmp",
+                                                               dir=csv_folder)
+        csv_bytes = 0
+        try:
+            with os.fdopen(temp_file_descriptor, 'wb') as csv_file_handler:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    csv_file_handler.write(chunk)
+                    csv_bytes += len(chunk)
+                    if usage_matrix_builder_object is not None:
+                        usage_matrix_builder_object.feed(chunk=chunk)
+                csv_file_handler.flush()
+                os.fsync(csv_file_handler.fileno())
+
+            # mkstemp creates the file readable by the owner only; the web server needs to be able to read it
+            os.chmod(temp_csv_path, 0o644)
+            os.replace(temp_csv_path, csv_path)
+        except BaseException:
+            if os.path.exists(temp_csv_path):
+                os.remove(temp_csv_path)
+            raise
+        finally:
+            response.close()
+        run_metrics_object.record_csv(csv_bytes=csv_bytes)
+        return
+
+    def write_text_atomically(text_path, text, file_mode=0o644):
+        """
+        Write text to a temporary file beside the path and atomically move it onto the path, so that readers such as
+        the node exporter never see a partly written file.
+        :param text_path: path of the file to be written
+        :param text: string content
+        :param file_mode: permissions applied to the file before it is moved into place
+        :return: None
+        """
+        write_bytes_atomically(file_path=text_path, content=text.encode("utf-8"), file_mode=file_mode)
         return
 
     # FUNCTIONALITY
-    #   Need a machine to which to make a request. Select at random from 4 total since we are bypassing web adaptor.
-    machine = SERVER_MACHINE_NAMES[create_random_int(upper_integer=len(SERVER_MACHINE_NAMES))]
-
-    #   Need a token to make secure requests
-    root_server_url = SERVER_ROOT_URL.format(machine_name=machine, port=SERVER_PORT_SECURE)
-    generate_token_url = os.path.join(root_server_url, AdminObject.GENERATE_TOKEN_ENDING)
-    token_params = create_params_for_request(token_action="getToken")
-    token_response = get_response(url=generate_token_url, params=token_params)
-    token = search_json_for_key(response_json=token_response, search_key="token")
-
-    #   Create a machine object for the selected ArcGIS Server machine. To store related values in object. Folders
-    #       variable assigned below
-    machine_object = MachineObject(machine_name=machine,
-                                   root_url=root_server_url,
-                                   security_token=token)
-
-    #   Need to make a secure request for response as JSON to be able to access folders and services details
-    basic_secure_params = create_params_for_request(token_action=machine_object.token)
-    admin_object = AdminObject(root_machine_url=root_server_url)
-    folders_request_response = get_response(url=admin_object.admin_services_url, params=basic_secure_params)
-
-    #   Need folder names list and to clean list; Remove System & Utilities, & append entry for root folder, per Jessie
-    #   NOTE: Noticed that Jessie also included 'GeoprocessingServices', but did not in statusdashboard script
-    folder_names_raw = search_json_for_key(response_json=folders_request_response, search_key="folders")
-    remove_folders = ["System", "Utilities", "GeoprocessingServices"]
-    folder_names_clean = list(set(folder_names_raw) - set(remove_folders))
-    folder_names_clean.append("")
-    folder_names_clean.sort()
-
-    #   Assign the folder names list to the machine object variable.
-    machine_object.folder_names_list = folder_names_clean
-    print(machine_object)
-
-    #   Need a single list containing all folder url's AND all service url's from within all of those folders.
-    #   It is passed to the server and indicates the resourceURIs for which metrics will be built in the query process
-    #   Uses Folder objects to store folder urls and Service objects containing urls
-    list_of_folder_objects = [FolderObject(name=folder_name, root_machine_url=machine_object.root_url) for folder_name
-                              in machine_object.folder_names_list]
-
-    #   For each folder, need a list of service objects for services in that folder
-    for fold_obj in list_of_folder_objects:
-
-        # Need a url to which to make a request to learn the services within
-        services_request_response = get_response(url=fold_obj.folder_machine_url, params=basic_secure_params)
-        services_json = search_json_for_key(response_json=services_request_response, search_key="services")
-
-        # Need to store the inventory of services that are within each folder
-        for service in services_json:
-            service_object = ServiceObject(folder=fold_obj.name,
-                                           service_json=service,
-                                           root_machine_url=machine_object.root_url)
-            fold_obj.service_objects_list.append(service_object)
-
-    master_url_list = create_master_url_list(list_of_folder_objects)
-
-    # Need to create a new report object for use in generating report on server.
-    report_object = ReportObject(root_machine_url=machine_object.root_url,
-                                 master_urls_list=master_url_list,
-                                 basic_request_json=basic_secure_params)
-
-    # Report is created on the server. No response is needed. The variable isn't used afterward for that reason.
-    print("Creating Report")
-    usage_report_params = create_params_for_request(token_action=machine_object.token,
-                                                    json_payload=report_object.report_json_params)
-    get_response(url=report_object.report_url_create, params=usage_report_params)
-
-    # Need to get the report contents using the query url
-    # NOTE: Like the 'usagereports' dictionary it appears that any dictionary 'value' that is a dictionary must be
-    #   converted to a string first; using json.dumps()
-    print("Querying Report")
-    post_data_query = {'filter': json.dumps({'machines': '*'})}
-    report_query_params = create_params_for_request(token_action=machine_object.token,
-                                                    json_payload=post_data_query,
-                                                    response_format='csv')
-    report_query_response = get_response(url=report_object.report_url_query, params=report_query_params)
-
-    # Need to write the report content to csv file
-    print("Writing CSV")
-    write_response_to_csv(response=report_query_response, csv_path=CSV_OUTPUT_FILE_PATH)
-
-    # Need to delete the report from the server to reduce bloat
-    print("Deleting Report")
-    get_response(url=report_object.report_url_delete, params=basic_secure_params)
-
-    print("Complete!")
+    #   Every request goes through pooled, keep-alive sessions so each machine's TLS handshake is paid only once. The
+    #       sessions, machine statistics, tokens, and inventory snapshot are kept warm between daemon cycles.
+    client_object = ClientObject(machine_root_urls=[SERVER_ROOT_URL.format(machine_name=machine_name,
+                                                                           port=SERVER_PORT_SECURE)
+                                                    for machine_name in SERVER_MACHINE_NAMES.values()],
+                                 pool_size=HTTP_POOL_SIZE,
+                                 keep_alive=HTTP_KEEP_ALIVE,
+                                 connect_timeout=HTTP_CONNECT_TIMEOUT,
+                                 read_timeout=HTTP_READ_TIMEOUT)
+    #   Every admin call waits for a slot under its machine's concurrency limit, which rises while the machine answers
+    #       promptly and falls when it slows down or fails, so that the machines' production traffic comes first.
+    concurrency_governor_object = ConcurrencyGovernorObject(machine_names=SERVER_MACHINE_NAMES.values(),
+                                                            initial_limit=CONCURRENCY_INITIAL_LIMIT,
+                                                            max_limit=CONCURRENCY_MAX_LIMIT,
+                                                            latency_tolerance=CONCURRENCY_LATENCY_TOLERANCE,
+                                                            enabled=CONCURRENCY_GOVERNOR)
+    machine_selector_object = MachineSelectorObject(machine_names=SERVER_MACHINE_NAMES.values(),
+                                                    stats_path=MACHINE_STATS_PATH,
+                                                    probe_timeout=MACHINE_PROBE_TIMEOUT)
+    token_cache_object = TokenCacheObject(cache_path=TOKEN_CACHE_PATH,
+                                          username=USERNAME,
+                                          expiry_margin_seconds=TOKEN_EXPIRY_MARGIN_SECONDS)
+    inventory_cache_object = InventoryCacheObject(cache_path=INVENTORY_CACHE_PATH,
+                                                  ttl_seconds=INVENTORY_CACHE_TTL_SECONDS,
+                                                  folder_max_age_seconds=INVENTORY_FOLDER_MAX_AGE_SECONDS)
+    #   Steps the report does not wait for run on background threads, so a run takes as long as its critical path.
+    pipeline_object = PipelineObject(max_workers=PIPELINE_MAX_WORKERS, enabled=PIPELINED_EXECUTION)
+    #   With --profile every phase of the run gets its own CPU profile and memory snapshots, written to a run folder.
+    run_profiler_object = None
+    if arguments.profile:
+        import RunProfiler
+        run_profiler_object = RunProfiler.RunProfilerObject(profile_path=arguments.profile)
+        run_profiler_object.start()
+    run_metrics_object = RunMetricsObject(run_record_path=RUN_METRICS_PATH,
+                                          prometheus_path=PROMETHEUS_TEXTFILE_PATH,
+                                          site_name=arguments.site or "",
+                                          run_profiler_object=run_profiler_object)
+    try:
+        if arguments.backfill:
+            #   A backfill collects a past range into window csv files and the time series store rather than the
+            #       dashboard csv. The end is capped at the current minute.
+            try:
+                backfill_start_time, backfill_end_time = [parse_utc_time(value=value) for value in arguments.backfill]
+            except ValueError as ve:
+                print(ve)
+                exit()
+            backfill_end_time = min(backfill_end_time, datetime.datetime.utcnow().replace(second=0, microsecond=0))
+            if backfill_end_time <= backfill_start_time:
+                print("The backfill end must be after its start and not in the future")
+                exit()
+            run_metrics_object.start_run()
+            concurrency_governor_object.start_run()
+            pipeline_object.start_run()
+            try:
+                backfill_complete = run_backfill(start_time=backfill_start_time, end_time=backfill_end_time)
+            except BaseException:
+                run_metrics_object.finish(success=False)
+                raise
+            run_metrics_object.finish(success=backfill_complete)
+        elif arguments.daemon:
+            run_daemon(interval_seconds=DAEMON_INTERVAL_SECONDS, jitter_seconds=DAEMON_JITTER_SECONDS)
+        else:
+            run_collection_cycle()
+    finally:
+        pipeline_object.close()
+        client_object.close()
+        if run_profiler_object is not None:
+            print(f"Profile written to {run_profiler_object.finish()}")
 
 
 if __name__ == "__main__":
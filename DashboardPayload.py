@@ -0,0 +1,231 @@
+"""
+Builds the compact, pre-aggregated json the status dashboard reads instead of the whole usage report csv, and writes
+it beside gzip and, when the brotli package is installed, brotli precompressed copies that a web server can serve as
+they are (for example nginx gzip_static and brotli_static).
+
+The payload holds the request totals of the site, of every folder, and of every service, a sparkline of the site and
+of every folder, and sparklines of the busiest services. Sparklines sum the one minute time slices of the csv into
+buckets aligned to the epoch, hourly by default. Only whole buckets are included: the partial buckets at either end of
+the report window are left out, and the payload holds no time of its own, so it only changes when a bucket completes or
+a count in it is revised rather than on every run. Each file is rewritten only when the SHA-256 hash of its new
+content differs from that of the file on disk, which keeps the web server's ETags and the browsers' caches valid.
+Date: 20261017
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import UsageAggregation
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_SLICE_MILLISECONDS = 60000
+
+
+def build_payload(usage_matrix_object, bucket_seconds=3600, top_count=50):
+    """
+    Aggregate a usage matrix into the dashboard payload.
+    :param usage_matrix_object: UsageAggregation.UsageMatrixObject of the report
+    :param bucket_seconds: seconds in each sparkline bucket
+    :param top_count: number of services, busiest first, that get a sparkline
+    :return: dictionary that serializes to the dashboard json
+    """
+    bucket_milliseconds = int(bucket_seconds) * 1000
+    time_slices = usage_matrix_object.time_slices
+    if len(time_slices) > 1:
+        slice_milliseconds = int(np.diff(time_slices).min())
+    else:
+        slice_milliseconds = DEFAULT_SLICE_MILLISECONDS
+
+    # The first whole bucket starts at or after the first time slice and the last one ends at or before the end of the
+    #   last time slice
+    bucket_starts = np.array([], dtype=np.int64)
+    columns = np.array([], dtype=np.int64)
+    if len(time_slices):
+        first_start = -(-int(time_slices[0]) // bucket_milliseconds) * bucket_milliseconds
+        last_end = (int(time_slices[-1]) + slice_milliseconds) // bucket_milliseconds * bucket_milliseconds
+        bucket_starts = np.arange(first_start, last_end, bucket_milliseconds, dtype=np.int64)
+        columns = np.nonzero((time_slices >= first_start) & (time_slices < last_end))[0]
+
+    # Buckets the csv has no time slices for stay zero, so every sparkline has one value per bucket
+    bucketed = UsageAggregation.UsageMatrixObject(resource_names=usage_matrix_object.resource_names,
+                                                  time_slices=time_slices[columns],
+                                                  values=usage_matrix_object.values[:, columns])
+    bucketed = bucketed.resample(rule=bucket_seconds)
+    counts = np.zeros((len(bucketed.resource_names), len(bucket_starts)), dtype=np.float64)
+    counts[:, np.searchsorted(bucket_starts, bucketed.time_slices)] = bucketed.counts
+    bucketed = UsageAggregation.UsageMatrixObject(resource_names=usage_matrix_object.resource_names,
+                                                  time_slices=bucket_starts,
+                                                  values=counts)
+
+    folder_names, folder_sparklines = bucketed.folder_totals()
+    folder_totals = folder_sparklines.sum(axis=1)
+    service_rows = np.nonzero(bucketed.is_service)[0]
+    service_totals = bucketed.totals()[service_rows]
+    # Busiest first, ties in name order, so that the order does not change between runs with the same counts
+    service_order = sorted(range(len(service_rows)),
+                           key=lambda index: (-service_totals[index], bucketed.resource_names[service_rows[index]]))
+    folder_order = sorted(range(len(folder_names)), key=lambda index: (-folder_totals[index], folder_names[index]))
+
+    services = []
+    for rank, index in enumerate(service_order):
+        row = service_rows[index]
+        service = {"name": str(bucketed.resource_names[row]),
+                   "folder": str(bucketed.folder_names[row]),
+                   "total": round_count(value=service_totals[index])}
+        if rank < top_count:
+            service["sparkline"] = round_counts(values=bucketed.counts[row])
+        services.append(service)
+    return {"metric": "RequestCount",
+            "start": int(bucket_starts[0]) if len(bucket_starts) else None,
+            "end": int(bucket_starts[-1]) + bucket_milliseconds if len(bucket_starts) else None,
+            "bucket_seconds": int(bucket_seconds),
+            "total": round_count(value=folder_totals.sum()),
+            "sparkline": round_counts(values=folder_sparklines.sum(axis=0)),
+            "folders": [{"name": str(folder_names[index]),
+                         "total": round_count(value=folder_totals[index]),
+                         "sparkline": round_counts(values=folder_sparklines[index])} for index in folder_order],
+            "services": services}
+
+
+def compress_content(content):
+    """
+    Compress json content for every precompressed variant that can be written. gzip output has no timestamp, so the
+    same content always compresses to the same bytes.
+    :param content: bytes
+    :return: dictionary of file extension to compressed bytes
+    """
+    variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(content, mode=brotli.MODE_TEXT)
+    return variants
+
+
+def encode_payload(payload):
+    """
+    Serialize a payload to compact UTF-8 json.
+    :param payload: dictionary returned by build_payload()
+    :return: bytes
+    """
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def file_hash(file_path):
+    """
+    Hash the content of a file.
+    :param file_path: path of the file
+    :return: hex SHA-256 digest, or None when the file does not exist
+    """
+    try:
+        with open(file_path, "rb") as file_handler:
+            return hashlib.sha256(file_handler.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def round_count(value):
+    return int(round(float(value)))
+
+
+def round_counts(values):
+    return [int(value) for value in np.rint(values)]
+
+
+def write_if_changed(file_path, content, file_mode=0o644):
+    """
+    Atomically write content to a file unless the file already holds the same content.
+    :param file_path: path of the file
+    :param content: bytes
+    :param file_mode: permissions applied to the file before it is moved into place
+    :return: True when the file was written
+    """
+    if file_hash(file_path=file_path) == hashlib.sha256(content).hexdigest():
+        return False
+    temp_file_descriptor, temp_file_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.",
+                                                            suffix=".tmp",
+                                                            dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with os.fdopen(temp_file_descriptor, "wb") as file_handler:
+            file_handler.write(content)
+        os.chmod(temp_file_path, file_mode)
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+    return True
+
+
+def write_payload(json_path, payload):
+    """
+    Write a payload and its precompressed variants, each only when its content has changed.
+
+    The variants are written after the json so that a reader never finds a variant newer than the json. A brotli
+    variant left by a run that had brotli installed is removed when it is no longer installed, rather than served out
+    of date.
+    :param json_path: path of the json file, the variants are named after it, for example UsageStatistics.json.gz
+    :param payload: dictionary returned by build_payload()
+    :return: list of the paths that were written
+    """
+    content = encode_payload(payload=payload)
+    written_paths = []
+    json_changed = write_if_changed(file_path=json_path, content=content)
+    if json_changed:
+        written_paths.append(json_path)
+    variant_paths = [f"{json_path}{extension}" for extension in ((".gz", ".br") if brotli is not None else (".gz",))]
+    if json_changed or not all(os.path.exists(variant_path) for variant_path in variant_paths):
+        for extension, variant_content in compress_content(content=content).items():
+            if write_if_changed(file_path=f"{json_path}{extension}", content=variant_content):
+                written_paths.append(f"{json_path}{extension}")
+    if brotli is None and os.path.exists(f"{json_path}.br"):
+        os.remove(f"{json_path}.br")
+    return written_paths
+
+
+def write_csv_payload(csv_path, json_path, bucket_seconds=3600, top_count=50):
+    """
+    Build the payload of a usage report csv and write it and its variants where they have changed.
+    :param csv_path: path of the usage report csv
+    :param json_path: path of the json file
+    :param bucket_seconds: seconds in each sparkline bucket
+    :param top_count: number of services that get a sparkline
+    :return: list of the paths that were written
+    """
+    usage_matrix_object = UsageAggregation.read_usage_matrix(csv_path=csv_path)
+    payload = build_payload(usage_matrix_object=usage_matrix_object, bucket_seconds=bucket_seconds,
+                            top_count=top_count)
+    return write_payload(json_path=json_path, payload=payload)
+
+
+def main():
+    """
+    Write the dashboard payload of a usage report csv.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Write the pre-aggregated dashboard json of a usage report csv")
+    parser.add_argument("csv_path")
+    parser.add_argument("json_path")
+    parser.add_argument("--bucket-minutes", type=int, default=60)
+    parser.add_argument("--top", type=int, default=50, help="number of services that get a sparkline")
+    arguments = parser.parse_args()
+
+    written_paths = write_csv_payload(csv_path=arguments.csv_path,
+                                      json_path=arguments.json_path,
+                                      bucket_seconds=arguments.bucket_minutes * 60,
+                                      top_count=arguments.top)
+    for written_path in written_paths:
+        print(f"Wrote {written_path} ({os.path.getsize(written_path)} bytes)")
+    if not written_paths:
+        print("The dashboard payload has not changed")
+
+
+if __name__ == "__main__":
+    main()
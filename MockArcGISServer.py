@@ -0,0 +1,385 @@
+"""
+Local stand-in for the ArcGIS Server endpoints used by CreateUsageReport_MOD.py, so that the script can be run and
+benchmarked without making requests to the production machines.
+
+Emulates generateToken, admin/services, rest/info, rest/services/<folder>, and the usagereports list, add, edit,
+data, and delete endpoints. A single server answers for every machine. The machine names written to the config are
+loopback addresses (127.0.0.1 to 127.0.0.4) and the root url template is 'http://{machine_name}:{port}', so the
+script still sees four separate machines.
+The time taken to answer a report query grows with the number of resourceURIs in the report and the number of report
+queries the server works on at once can be limited, which approximates how a real site builds usage reports. Every
+request can also be slowed down by the number of requests answered at once, as a loaded machine would be. A
+fraction of requests can be answered with errors, and the requests, bytes, and wall time of each endpoint are recorded
+so that a benchmark can report them for every phase of the script.
+Contains MockRequestHandler and MockServerObject classes.
+Date: 20261016
+"""
+import argparse
+import configparser
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    The MockRequestHandler class answers a single request using the settings and state of the MockServerObject that
+    owns the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        """Route the request to the emulated endpoint by the end of its path and record it in the server's stats."""
+        mock_server_object = self.server.mock_server_object
+        start = time.perf_counter()
+        content_length = int(self.headers.get("Content-Length") or 0)
+        form = urllib.parse.parse_qs(self.rfile.read(content_length).decode("utf-8"))
+        path = urllib.parse.urlparse(self.path).path.rstrip("/")
+        endpoint_name = MockServerObject.endpoint_name(path=path)
+        self.bytes_sent = 0
+        with mock_server_object.stats_lock:
+            concurrent_requests = mock_server_object.requests_in_flight
+            mock_server_object.requests_in_flight += 1
+        try:
+            latency = mock_server_object.request_latency + mock_server_object.load_latency * concurrent_requests
+            if latency:
+                time.sleep(latency)
+            self.answer(endpoint_name=endpoint_name, form=form, path=path)
+        finally:
+            with mock_server_object.stats_lock:
+                mock_server_object.requests_in_flight -= 1
+        mock_server_object.record_request(endpoint_name=endpoint_name,
+                                          start=start,
+                                          end=time.perf_counter(),
+                                          bytes_received=content_length,
+                                          bytes_sent=self.bytes_sent,
+                                          is_error=self.is_error)
+
+    def answer(self, endpoint_name, form, path):
+        """
+        Answer the request as the emulated endpoint, or with an injected error.
+        :param endpoint_name: one of MockServerObject.ENDPOINT_NAMES
+        :param form: parsed form parameters of the request
+        :param path: url path of the request
+        :return: None
+        """
+        mock_server_object = self.server.mock_server_object
+        is_error = endpoint_name != "probe" and mock_server_object.inject_error()
+        if is_error:
+            self.send_error_response()
+        elif endpoint_name == "token":
+            self.send_json(content={"token": mock_server_object.token,
+                                    "expires": int((time.time() + 3600) * 1000)})
+        elif form.get("token", [mock_server_object.token])[0] != mock_server_object.token:
+            self.send_json(content={"status": "error", "code": 498, "messages": ["Invalid token."]})
+        elif endpoint_name == "probe":
+            self.send_json(content={"currentVersion": 10.6})
+        elif endpoint_name == "folders":
+            self.send_json(content={"folders": mock_server_object.folder_names + ["System", "Utilities"],
+                                    "services": []})
+        elif endpoint_name == "services":
+            folder_name = path.split("arcgis/rest/services", 1)[1].strip("/")
+            self.send_json(content={"folders": [], "services": mock_server_object.services_json(folder_name)})
+        elif endpoint_name == "report_list":
+            self.send_json(content={"metrics": list(mock_server_object.reports.values())})
+        elif endpoint_name == "report_add":
+            report_definition = json.loads(form["usagereport"][0])
+            if report_definition["reportname"] in mock_server_object.reports:
+                self.send_json(content={"status": "error", "messages": ["Usage report already exists."]})
+            else:
+                mock_server_object.reports[report_definition["reportname"]] = report_definition
+                self.send_json(content={"status": "success"})
+        elif endpoint_name == "report_edit":
+            report_definition = json.loads(form["usagereport"][0])
+            if path.split("/")[-2] not in mock_server_object.reports:
+                # ArcGIS Server answers requests for a report that does not exist with a permanent code 500 error
+                self.send_json(content={"status": "error", "code": 500,
+                                        "messages": [f"Usage report '{path.split('/')[-2]}' does not exist."]})
+            else:
+                mock_server_object.reports[path.split("/")[-2]] = report_definition
+                self.send_json(content={"status": "success"})
+        elif endpoint_name == "report_data":
+            report_definition = mock_server_object.reports.get(path.split("/")[-2])
+            if report_definition is None:
+                self.send_json(content={"status": "error", "code": 500,
+                                        "messages": [f"Usage report '{path.split('/')[-2]}' does not exist."]})
+            else:
+                machine_names = json.loads(form.get("filter", ['{"machines": "*"}'])[0]).get("machines", "*")
+                self.send_body(body=mock_server_object.report_csv(report_definition=report_definition,
+                                                                  machine_names=machine_names),
+                               content_type="text/csv")
+        elif endpoint_name == "report_delete":
+            mock_server_object.reports.pop(path.split("/")[-2], None)
+            self.send_json(content={"status": "success"})
+        else:
+            self.send_body(body=b"<html><body>Not found</body></html>", content_type="text/html")
+        self.is_error = is_error
+
+    def log_message(self, format, *args):
+        """Override the builtin to keep request logging out of benchmark output."""
+        pass
+
+    def send_body(self, body, content_type, status_code=200):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.bytes_sent += len(body)
+
+    def send_error_response(self):
+        """Answer with either an http 503 or an ArcGIS internal error, the two ways a busy site fails a request."""
+        if self.server.mock_server_object.random_generator.random() < 0.5:
+            self.send_body(body=b"<html><body>Service Unavailable</body></html>", content_type="text/html",
+                           status_code=503)
+        else:
+            self.send_json(content={"status": "error", "code": 500, "messages": ["Internal server error."]})
+
+    def send_json(self, content):
+        self.send_body(body=json.dumps(content).encode("utf-8"), content_type="application/json")
+
+
+class MockServerObject:
+    """
+    The MockServerObject class runs a threaded http server on a background thread that emulates an ArcGIS Server site
+    with a configurable number of folders and services.
+    """
+
+    ENDPOINT_NAMES = ("token", "probe", "folders", "services", "report_add", "report_edit", "report_data",
+                      "report_delete", "report_list", "other")
+    MACHINE_NAMES = ("127.0.0.1", "127.0.0.2", "127.0.0.3", "127.0.0.4")
+    METRIC_NAMES = ("RequestCount", "RequestsFailed", "RequestsTimedOut", "RequestMaxResponseTime",
+                    "RequestAvgResponseTime")
+    SINCE_HOURS = {"LAST_DAY": 24, "LAST_WEEK": 168, "LAST_MONTH": 720}
+
+    def __init__(self, folder_count=20, services_per_folder=10, request_latency=0.0, error_rate=0.0,
+                 report_base_latency=0.0, report_uri_latency=0.0, report_concurrency=0, metric_count=1, seed=None,
+                 host="", port=0, load_latency=0.0):
+        """
+        Instantiate the MockServerObject. The server is not started until start() is called.
+
+        :param folder_count: number of service folders in the site, in addition to the root folder
+        :param services_per_folder: number of services in each folder
+        :param request_latency: seconds added to every request
+        :param error_rate: fraction of requests, other than the machine probe, answered with an http 503 or an ArcGIS
+            internal error
+        :param report_base_latency: seconds added to every report query
+        :param report_uri_latency: seconds added to a report query for each resourceURI in the report
+        :param report_concurrency: number of report queries worked on at once, others wait; 0 for no limit
+        :param metric_count: number of metric rows in the report csv for each resourceURI, from 1 to 5, which sets the
+            csv size along with the number of resourceURIs and time slices
+        :param seed: random seed for the injected errors, so that runs are repeatable
+        :param host: address to listen on, all addresses by default
+        :param port: port to listen on, any free port by default
+        :param load_latency: seconds added to a request for every other request the server is answering at once,
+            which approximates a machine slowing down under load
+        """
+        self.folder_names = [f"Folder{index:03d}" for index in range(folder_count)]
+        self.services_per_folder = services_per_folder
+        self.request_latency = request_latency
+        self.load_latency = load_latency
+        self.requests_in_flight = 0
+        self.error_rate = error_rate
+        self.report_base_latency = report_base_latency
+        self.report_uri_latency = report_uri_latency
+        self.report_semaphore = threading.BoundedSemaphore(report_concurrency) if report_concurrency > 0 else None
+        self.metric_names = MockServerObject.METRIC_NAMES[:max(1, metric_count)]
+        self.random_generator = random.Random(seed)
+        self.reports = {}
+        self.stats_lock = threading.Lock()
+        self.endpoint_stats = {}
+        self.token = "mock-token"
+        self.http_server = http.server.ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.mock_server_object = self
+        self.server_thread = None
+
+    @staticmethod
+    def endpoint_name(path):
+        """
+        Name the emulated endpoint a request path is for, which is also the phase of the script it belongs to.
+        :param path: url path of the request
+        :return: one of ENDPOINT_NAMES
+        """
+        if path.endswith("arcgis/admin/generateToken"):
+            return "token"
+        elif path.endswith("arcgis/rest/info"):
+            return "probe"
+        elif path.endswith("arcgis/admin/services"):
+            return "folders"
+        elif "arcgis/rest/services" in path:
+            return "services"
+        elif path.endswith("arcgis/admin/usagereports"):
+            return "report_list"
+        elif path.endswith("arcgis/admin/usagereports/add"):
+            return "report_add"
+        elif path.endswith("/edit"):
+            return "report_edit"
+        elif path.endswith("/data"):
+            return "report_data"
+        elif path.endswith("/delete"):
+            return "report_delete"
+        return "other"
+
+    def inject_error(self):
+        """Decide whether the current request is answered with an error, at the configured error rate."""
+        with self.stats_lock:
+            return self.error_rate > 0 and self.random_generator.random() < self.error_rate
+
+    @property
+    def port(self):
+        return self.http_server.server_address[1]
+
+    def record_request(self, endpoint_name, start, end, bytes_received, bytes_sent, is_error):
+        """
+        Add a request to the stats of its endpoint.
+        :param endpoint_name: one of ENDPOINT_NAMES
+        :param start: time.perf_counter() when the request was received
+        :param end: time.perf_counter() when the response was sent
+        :param bytes_received: bytes in the request body
+        :param bytes_sent: bytes in the response body
+        :param is_error: whether the response was an injected error
+        :return: None
+        """
+        with self.stats_lock:
+            stats = self.endpoint_stats.setdefault(endpoint_name, {"requests": 0, "errors": 0, "bytes_received": 0,
+                                                                   "bytes_sent": 0, "first_start": start,
+                                                                   "last_end": end})
+            stats["requests"] += 1
+            stats["errors"] += int(is_error)
+            stats["bytes_received"] += bytes_received
+            stats["bytes_sent"] += bytes_sent
+            stats["first_start"] = min(stats["first_start"], start)
+            stats["last_end"] = max(stats["last_end"], end)
+
+    def report_csv(self, report_definition, machine_names="*"):
+        """
+        Build the csv contents of a report query, one row per resourceURI and one column per aggregation interval,
+        after waiting the time the report would take to build. A relative time span ends at the current minute. A
+        query filtered to some of the machines is answered with different counts for each of them.
+        :param report_definition: json definition the report was created with
+        :param machine_names: '*' for every machine, or the list of machine names the query is filtered to
+        :return: bytes
+        """
+        resource_uris = report_definition["queries"][0]["resourceURIs"]
+        if self.report_semaphore is not None:
+            self.report_semaphore.acquire()
+        try:
+            time.sleep(self.report_base_latency + self.report_uri_latency * len(resource_uris))
+        finally:
+            if self.report_semaphore is not None:
+                self.report_semaphore.release()
+        interval_milliseconds = report_definition["aggregationInterval"] * 1000
+        if report_definition["since"] == "CUSTOM":
+            from_milliseconds, to_milliseconds = report_definition["from"], report_definition["to"]
+        else:
+            to_milliseconds = int(time.time() // 60 * 60000)
+            from_milliseconds = to_milliseconds - MockServerObject.SINCE_HOURS[report_definition["since"]] * 3600000
+        time_slices = range(from_milliseconds, to_milliseconds, interval_milliseconds)
+        header = ",".join(["Resource", "Metric"] + [str(time_slice) for time_slice in time_slices])
+        machine_offset = 0
+        if machine_names != "*":
+            machine_offset = sum(MockServerObject.MACHINE_NAMES.index(machine_name) + 1
+                                 for machine_name in machine_names if machine_name in MockServerObject.MACHINE_NAMES)
+        value_rows = [",".join(str((index + offset + machine_offset) % 11) for index in range(len(time_slices)))
+                      for offset in range(7)]
+        lines = [header] + [f"{resource_uri},{metric_name},{value_rows[(index + metric_index) % len(value_rows)]}"
+                            for index, resource_uri in enumerate(resource_uris)
+                            for metric_index, metric_name in enumerate(self.metric_names)]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.endpoint_stats = {}
+
+    def services_json(self, folder_name):
+        prefix = f"{folder_name}/" if folder_name else ""
+        return [{"name": f"{prefix}Service{index:03d}", "type": "MapServer"}
+                for index in range(self.services_per_folder)]
+
+    def start(self):
+        self.server_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.server_thread.start()
+        return self
+
+    def stats(self):
+        """
+        Return a copy of the request stats of every endpoint that has been requested since the last reset, with the
+        wall time from the first request received to the last response sent.
+        :return: dictionary of endpoint name to stats dictionary
+        """
+        with self.stats_lock:
+            return {endpoint_name: dict(stats, wall_time=stats["last_end"] - stats["first_start"])
+                    for endpoint_name, stats in self.endpoint_stats.items()}
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def write_config(self, config_path, settings=None):
+        """
+        Write a credentials and settings file that points CreateUsageReport_MOD.py at this server.
+        :param config_path: path of the config file to be written
+        :param settings: dictionary of usage_report_settings options
+        :return: None
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        config["ags_server_credentials"] = {"username": "mock", "password": "mock"}
+        config["ags_prod_machine_names"] = {f"machine{index + 1}": machine_name
+                                            for index, machine_name in enumerate(MockServerObject.MACHINE_NAMES)}
+        config["ags_prod_machine_names"]["secureport"] = str(self.port)
+        config["ags_prod_machine_names"]["root_url"] = "http://{machine_name}:{port}"
+        config["usage_report_settings"] = {key: str(value) for key, value in (settings or {}).items()}
+        with open(config_path, "w") as config_file_handler:
+            config.write(config_file_handler)
+
+
+def main():
+    """
+    Run the mock server in the foreground until interrupted.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the ArcGIS Server endpoints")
+    parser.add_argument("--port", type=int, default=6443)
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--services-per-folder", type=int, default=10)
+    parser.add_argument("--request-latency", type=float, default=0.0)
+    parser.add_argument("--load-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--report-base-latency", type=float, default=0.0)
+    parser.add_argument("--report-uri-latency", type=float, default=0.0)
+    parser.add_argument("--report-concurrency", type=int, default=0)
+    parser.add_argument("--metric-count", type=int, default=1)
+    parser.add_argument("--write-config", help="path of a config file to write for CreateUsageReport_MOD.py")
+    arguments = parser.parse_args()
+
+    mock_server_object = MockServerObject(folder_count=arguments.folders,
+                                          services_per_folder=arguments.services_per_folder,
+                                          request_latency=arguments.request_latency,
+                                          load_latency=arguments.load_latency,
+                                          error_rate=arguments.error_rate,
+                                          report_base_latency=arguments.report_base_latency,
+                                          report_uri_latency=arguments.report_uri_latency,
+                                          report_concurrency=arguments.report_concurrency,
+                                          metric_count=arguments.metric_count,
+                                          port=arguments.port)
+    if arguments.write_config:
+        mock_server_object.write_config(config_path=arguments.write_config)
+    print(f"Mock ArcGIS Server listening on port {mock_server_object.port}")
+    try:
+        mock_server_object.http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock_server_object.http_server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Collects usage from several ArcGIS Server sites on the same schedule by running CreateUsageReport_MOD.py once per
+site, each in its own worker process, and combines the site csv files into one csv with a Site column.
+
+A site is a [site:<name>] section of the config. It holds the site's machine names (machine1, machine2, ...), its
+secureport, and optionally its root_url, username, and password, which replace the ags_prod_machine_names and
+ags_server_credentials values, and any usage_report_settings option that applies to that site only. Every file a
+site run writes is its own: the site name is inserted before the extension of the csv, cache, state, and metrics
+paths, for example UsageStatistics.prod.csv, unless the site section sets the path itself.
+Sites are isolated from each other. A site run is CreateUsageReport_MOD.main() with --site in a process of its own,
+started for that site and cycle only, so a site that exits, raises, or crashes its process is reported and the other
+sites, and the next cycle of a daemon, carry on. The combined csv is written from whatever csv each site has, so a
+failed site contributes the csv of its last successful run.
+Date: 20261017
+"""
+import concurrent.futures
+import configparser
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import re
+import signal
+import threading
+import time
+
+import UsageReportCSV
+
+PATH_OPTIONS = {"backfill_path": "backfill",
+                "collection_state_path": "collection_state.json",
+                "csv_output_file_path": "UsageStatistics.csv",
+                "dashboard_payload_path": "",
+                "inventory_cache_path": "inventory_cache.bin",
+                "machine_breakdown_csv_path": "",
+                "machine_stats_path": "machine_stats.json",
+                "prometheus_textfile_path": "",
+                "run_metrics_path": "",
+                "time_series_store_path": "",
+                "token_cache_path": "token_cache.json"}
+SITE_SECTION_PREFIX = "site:"
+
+
+def apply_site_section(config, site_name):
+    """
+    Replace the machines, credentials, and settings of a config with those of one site, and name its files after it.
+
+    File paths fall back to the same defaults as CreateUsageReport_MOD.py, in the folder of this module, which is
+    the project folder. An empty path stays empty, so a file that is disabled for every site stays disabled.
+    :param config: ConfigParser holding the whole config, changed in place
+    :param site_name: name of the site, as in its [site:<name>] section
+    :return: None
+    """
+    section_name = f"{SITE_SECTION_PREFIX}{site_name}"
+    if not config.has_section(section_name):
+        raise ValueError(f"The config has no [{section_name}] section")
+    site_section = config[section_name]
+    if not config.has_section("usage_report_settings"):
+        config.add_section("usage_report_settings")
+    settings = config["usage_report_settings"]
+
+    project_path = os.path.dirname(os.path.abspath(__file__))
+    for option, default_file_name in PATH_OPTIONS.items():
+        path = settings.get(option, os.path.join(project_path, default_file_name) if default_file_name else "")
+        if option not in site_section and path:
+            settings[option] = site_file_path(path=path, site_name=site_name)
+
+    machine_options = {}
+    for option in config.options(section_name):
+        value = config.get(section_name, option, raw=True)
+        if re.fullmatch(r"machine\d+", option) or option in ("secureport", "root_url"):
+            machine_options[option] = value
+        elif option in ("username", "password"):
+            if not config.has_section("ags_server_credentials"):
+                config.add_section("ags_server_credentials")
+            config.set("ags_server_credentials", option, value)
+        else:
+            config.set("usage_report_settings", option, value)
+    config.remove_section("ags_prod_machine_names")
+    config.add_section("ags_prod_machine_names")
+    for option, value in machine_options.items():
+        config.set("ags_prod_machine_names", option, value)
+    return
+
+
+def collect_sites(config_path, config, daemon=False):
+    """
+    Collect every site in parallel worker processes and write the combined csv, once or, as a daemon, every
+    usage_report_settings/daemon_interval_seconds plus jitter until SIGTERM or SIGINT.
+    :param config_path: path of the config file, passed on to the site runs
+    :param config: ConfigParser holding the config
+    :param daemon: keep collecting when True
+    :return: None
+    """
+    site_names = list_site_names(config=config)
+    if not site_names:
+        print(f"The config has no [{SITE_SECTION_PREFIX}<name>] sections")
+        return
+    max_workers = config.getint("usage_report_settings", "multi_site_max_workers", fallback=4)
+    combined_csv_path = config.get("usage_report_settings", "multi_site_combined_csv_path",
+                                   fallback=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "UsageStatisticsAllSites.csv"))
+    interval_seconds = config.getfloat("usage_report_settings", "daemon_interval_seconds", fallback=300.0)
+    jitter_seconds = config.getfloat("usage_report_settings", "daemon_jitter_seconds", fallback=30.0)
+
+    stop_event = threading.Event()
+    previous_handlers = {}
+    if daemon:
+        def request_stop(signal_number, frame):
+            print(f"Received signal {signal_number}. Stopping after the current cycle.")
+            stop_event.set()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signal_number] = signal.signal(signal_number, request_stop)
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            collect_sites_once(config_path=config_path,
+                               site_names=site_names,
+                               combined_csv_path=combined_csv_path,
+                               max_workers=max_workers)
+            if not daemon or stop_event.is_set():
+                break
+            wait_seconds = max(0.0, interval_seconds - (time.monotonic() - cycle_start))
+            wait_seconds += random.uniform(0, max(0.0, jitter_seconds))
+            print(f"Next cycle in {wait_seconds:.0f} seconds")
+            if stop_event.wait(timeout=wait_seconds):
+                break
+    finally:
+        for signal_number, previous_handler in previous_handlers.items():
+            signal.signal(signal_number, previous_handler)
+    return
+
+
+def collect_sites_once(config_path, site_names, combined_csv_path, max_workers=4, run_function=None):
+    """
+    Run every site in its own worker process, at most max_workers at once, print each site's output as it finishes,
+    and write the combined csv.
+    :param config_path: path of the config file
+    :param site_names: list of site names
+    :param combined_csv_path: path of the combined csv, or empty for none
+    :param max_workers: most sites collected at once
+    :param run_function: function run in the worker process in place of run_site(), for benchmarks
+    :return: list of the names of the sites that failed
+    """
+    failed_site_names = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(site_names)))) as executor:
+        futures = {executor.submit(run_site_process, config_path=config_path, site_name=site_name,
+                                   run_function=run_function): site_name for site_name in site_names}
+        for future in concurrent.futures.as_completed(futures):
+            site_name = futures[future]
+            try:
+                success, output, seconds = future.result()
+            except Exception as e:
+                # The worker process itself died, for example killed for running out of memory
+                success, output, seconds = False, f"{type(e).__name__}: {e}", 0.0
+            for line in output.splitlines():
+                print(f"[{site_name}] {line}")
+            print(f"[{site_name}] {'Complete' if success else 'FAILED'} in {seconds:.1f} seconds")
+            if not success:
+                failed_site_names.append(site_name)
+    if failed_site_names:
+        print(f"WARNING: {len(failed_site_names)} of {len(site_names)} site(s) failed: {sorted(failed_site_names)}")
+
+    if combined_csv_path:
+        site_csv_paths = {}
+        for site_name in site_names:
+            site_config = configparser.ConfigParser()
+            site_config.read(config_path)
+            apply_site_section(config=site_config, site_name=site_name)
+            csv_path = site_config.get("usage_report_settings", "csv_output_file_path")
+            if os.path.exists(csv_path):
+                site_csv_paths[site_name] = csv_path
+        row_count = UsageReportCSV.combine_usage_report_csv(site_csv_paths=site_csv_paths,
+                                                            output_csv_path=combined_csv_path)
+        print(f"Combined {row_count} rows from {len(site_csv_paths)} site(s) into {combined_csv_path}")
+    return failed_site_names
+
+
+def list_site_names(config):
+    """
+    List the sites in a config, in the order of their sections.
+    :param config: ConfigParser holding the config
+    :return: list of site names
+    """
+    site_names = []
+    for section_name in config.sections():
+        if section_name.startswith(SITE_SECTION_PREFIX):
+            site_name = section_name[len(SITE_SECTION_PREFIX):]
+            if not re.fullmatch(r"[A-Za-z0-9_-]+", site_name):
+                raise ValueError(f"Site names are used in file names and may only contain letters, digits, '_', "
+                                 f"and '-': [{section_name}]")
+            site_names.append(site_name)
+    return site_names
+
+
+def run_site(config_path, site_name):
+    """
+    Run the whole collection for one site and capture what it prints. Runs in a worker process.
+    :param config_path: path of the config file
+    :param site_name: name of the site
+    :return: tuple of success boolean, printed output, and seconds taken
+    """
+    import CreateUsageReport_MOD
+    output = io.StringIO()
+    start = time.perf_counter()
+    success = False
+    try:
+        with contextlib.redirect_stdout(output):
+            CreateUsageReport_MOD.main(["--config", config_path, "--site", site_name])
+        success = True
+    except SystemExit:
+        # The script exits on errors it cannot recover from, having printed the reason
+        pass
+    except Exception as e:
+        output.write(f"{type(e).__name__}: {e}\n")
+    return success, output.getvalue(), time.perf_counter() - start
+
+
+def run_site_process(config_path, site_name, run_function=None):
+    """
+    Run one site in a worker process started for it alone and wait for its result.
+
+    The process has a pool of its own, so a process that dies abruptly, such as one killed for running out of memory,
+    breaks only that pool: the site is reported as failed and no other site, nor the next cycle, shares the pool.
+    Processes are spawned rather than forked, as the sites are started from several threads at once.
+    :param config_path: path of the config file
+    :param site_name: name of the site
+    :param run_function: function run in the worker process in place of run_site()
+    :return: tuple of success boolean, printed output, and seconds taken, raising BrokenProcessPool when the process
+        died
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_function or run_site, config_path=config_path, site_name=site_name).result()
+
+
+def site_file_path(path, site_name):
+    """
+    Name a file or folder after a site by inserting the site name before its extension.
+    :param path: path of the file or folder, for example 'UsageStatistics.csv'
+    :param site_name: name of the site
+    :return: path, for example 'UsageStatistics.prod.csv'
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{site_name}{extension}"
@@ -0,0 +1,333 @@
+"""
+Profiles a run of CreateUsageReport_MOD.py for CPU and memory hot spots, phase by phase, and compares two profiled
+runs to find regressions.
+
+The run is profiled with cProfile and tracemalloc. The phases are those of the run metrics (probe, token, folders,
+crawl, report_query, ...), so every phase has its own CPU profile, its own peak of traced memory, and the allocation
+sites that grew the most between its start and its end. Before Python 3.12 cProfile only follows the thread it was
+enabled in, and only that thread can switch it, so every thread started while profiling gets a profile of its own for
+the phase current when it starts. Thread pool workers, such as those of the crawl, the shards, and the pipeline, live
+across phases, so while profiling every task submitted to a ThreadPoolExecutor first moves its worker to a profile
+of the phase current when the task starts. A task, or a thread outside a pool, that runs on across a phase boundary
+is counted towards the phase it started in. From Python 3.12 cProfile follows every thread by itself and the thread
+profiles are not needed. tracemalloc slows a run down by a factor of two or more, so the timings are only comparable
+between profiled runs.
+A profiled run writes a folder named after its start time holding profile.pstats, the CPU profile of the whole run
+for pstats or snakeviz, profile.txt, the sorted stats and top allocation sites of every phase, and profile.json, the
+summary the comparison reads.
+Contains RunProfilerObject class.
+Date: 20261017
+"""
+import argparse
+import concurrent.futures
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class RunProfilerObject:
+    """
+    The RunProfilerObject class keeps a CPU profile and memory snapshots of every phase of a run and writes them to a
+    run folder.
+    """
+
+    ALLOCATION_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                          tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                          tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                          tracemalloc.Filter(False, "<unknown>"))
+
+    def __init__(self, profile_path, top_count=30):
+        """
+        Instantiate the RunProfilerObject. Profiling does not start until start() is called.
+
+        :param profile_path: folder in which a folder is created for the run
+        :param top_count: number of functions and allocation sites listed for each phase
+        """
+        self.profile_path = profile_path
+        self.top_count = top_count
+        self.thread_lock = threading.Lock()
+        self.phases = []
+        self.current_phase = None
+        self.thread_profiles = []
+        self.thread_state = threading.local()
+        self.original_submit = None
+        self.run_path = None
+
+    def end_phase(self):
+        """
+        Stop profiling the current phase, if any, and record its time, memory, and top allocation sites.
+        :return: None
+        """
+        if self.current_phase is None:
+            return
+        phase_name, phase_profile, phase_start, start_snapshot, start_memory = self.current_phase
+        phase_profile.disable()
+        seconds = time.perf_counter() - phase_start
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        end_snapshot = tracemalloc.take_snapshot().filter_traces(RunProfilerObject.ALLOCATION_FILTERS)
+        allocation_stats = end_snapshot.compare_to(start_snapshot, "lineno")
+        self.phases.append({"name": phase_name,
+                            "profile": phase_profile,
+                            "seconds": seconds,
+                            "memory_peak_bytes": peak_memory,
+                            "memory_net_bytes": current_memory - start_memory,
+                            "allocations": [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                                             "size_bytes": stat.size_diff,
+                                             "count": stat.count_diff}
+                                            for stat in allocation_stats[:self.top_count] if stat.size_diff > 0]})
+        self.current_phase = None
+
+    def finish(self):
+        """
+        End the current phase, stop profiling, and write profile.pstats, profile.txt, and profile.json to the run
+        folder.
+        :return: path of the run folder
+        """
+        self.end_phase()
+        threading.setprofile(None)
+        if self.original_submit is not None:
+            concurrent.futures.ThreadPoolExecutor.submit = self.original_submit
+            self.original_submit = None
+        tracemalloc.stop()
+
+        # Thread profiles are read only now that profiling has stopped in this thread, as reading a profile disables it
+        phase_stats = []
+        for phase_index, phase in enumerate(self.phases):
+            stats = pstats.Stats(phase.pop("profile"), stream=io.StringIO())
+            with self.thread_lock:
+                for thread_phase_index, thread_profile in self.thread_profiles:
+                    if thread_phase_index == phase_index:
+                        stats.add(thread_profile)
+            phase_stats.append(stats)
+            phase["functions"] = self.top_functions(stats=stats)
+
+        os.makedirs(self.profile_path, exist_ok=True)
+        run_name = time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.started))
+        self.run_path = os.path.join(self.profile_path, run_name)
+        suffix = 1
+        while os.path.exists(self.run_path):
+            suffix += 1
+            self.run_path = os.path.join(self.profile_path, f"{run_name}_{suffix}")
+        os.makedirs(self.run_path)
+
+        report = io.StringIO()
+        run_stats = pstats.Stats(stream=report)
+        for stats in phase_stats:
+            run_stats.add(stats)
+        if phase_stats:
+            run_stats.dump_stats(os.path.join(self.run_path, "profile.pstats"))
+            report.write(f"Whole run, {sum(phase['seconds'] for phase in self.phases):.3f} seconds\n")
+            run_stats.sort_stats("cumulative").print_stats(self.top_count)
+        for phase, stats in zip(self.phases, phase_stats):
+            report.write(f"\nPhase {phase['name']}, {phase['seconds']:.3f} seconds, memory peak "
+                         f"{phase['memory_peak_bytes'] / 1048576:.1f} MiB, "
+                         f"net {phase['memory_net_bytes'] / 1048576:+.1f} MiB\n")
+            stats.stream = report
+            stats.sort_stats("tottime").print_stats(self.top_count)
+            report.write("Top allocation sites\n")
+            for allocation in phase["allocations"]:
+                report.write(f"{allocation['size_bytes'] / 1024:>12.1f} KiB {allocation['count']:>9} blocks  "
+                             f"{allocation['site']}\n")
+        with open(os.path.join(self.run_path, "profile.txt"), "w") as report_file_handler:
+            report_file_handler.write(report.getvalue())
+        with open(os.path.join(self.run_path, "profile.json"), "w") as summary_file_handler:
+            json.dump({"started": self.started, "python": sys.version.split()[0], "phases": self.phases},
+                      summary_file_handler, indent=2)
+        return self.run_path
+
+    def profile_current_phase(self):
+        """
+        Move the calling thread to a profile of the current phase, unless it is profiling that phase already. Only
+        the thread itself can switch its profile, so it is called in the thread.
+        :return: None
+        """
+        phase_index = len(self.phases)
+        thread_profile = getattr(self.thread_state, "profile", None)
+        if thread_profile is not None and self.thread_state.phase_index == phase_index:
+            return
+        if thread_profile is not None:
+            thread_profile.disable()
+        thread_profile = cProfile.Profile()
+        try:
+            thread_profile.enable()
+        except ValueError:
+            # From Python 3.12 only one profiler can be active, and it already covers every thread
+            return
+        self.thread_state.profile, self.thread_state.phase_index = thread_profile, phase_index
+        with self.thread_lock:
+            self.thread_profiles.append((phase_index, thread_profile))
+
+    def profile_thread(self, frame, event, arg):
+        """
+        Start a profile for a thread started while profiling. Installed with threading.setprofile(), so it is called
+        once, at the first event of every new thread, and replaced by the thread's own profiler.
+        """
+        sys.setprofile(None)
+        self.profile_current_phase()
+
+    def profile_task_submit(self):
+        """
+        Build a replacement for ThreadPoolExecutor.submit() that runs every task in a profile of the phase current
+        when the task starts, so that pool workers are not counted towards the phase they were started in.
+        :return: function
+        """
+        original_submit = self.original_submit
+
+        def submit(executor, function, /, *args, **kwargs):
+            def run_task(*task_args, **task_kwargs):
+                self.profile_current_phase()
+                return function(*task_args, **task_kwargs)
+
+            return original_submit(executor, run_task, *args, **kwargs)
+
+        return submit
+
+    def start(self, phase_name="start"):
+        """
+        Start tracing memory allocations and profiling the first phase.
+        :param phase_name: name of the phase before the first phase of the run metrics
+        :return: None
+        """
+        self.started = time.time()
+        tracemalloc.start()
+        threading.setprofile(self.profile_thread)
+        self.original_submit = concurrent.futures.ThreadPoolExecutor.submit
+        concurrent.futures.ThreadPoolExecutor.submit = self.profile_task_submit()
+        self.start_phase(phase_name=phase_name)
+
+    def start_phase(self, phase_name):
+        """
+        End the current phase, if any, and start profiling the next one.
+        :param phase_name: name of the phase, for example 'crawl' or 'report_query'
+        :return: None
+        """
+        self.end_phase()
+        tracemalloc.reset_peak()
+        start_snapshot = tracemalloc.take_snapshot().filter_traces(RunProfilerObject.ALLOCATION_FILTERS)
+        start_memory = tracemalloc.get_traced_memory()[0]
+        phase_profile = cProfile.Profile()
+        self.current_phase = (phase_name, phase_profile, time.perf_counter(), start_snapshot, start_memory)
+        phase_profile.enable()
+
+    def top_functions(self, stats):
+        """
+        List the functions that took the most time of their own in a phase.
+        :param stats: pstats.Stats of the phase
+        :return: list of dictionaries of function, calls, own seconds, and cumulative seconds
+        """
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top_count]
+        return [{"function": f"{file_name}:{line_number}({function_name})",
+                 "calls": call_count,
+                 "tottime": own_seconds,
+                 "cumtime": cumulative_seconds}
+                for (file_name, line_number, function_name), (primitive_call_count, call_count, own_seconds,
+                                                              cumulative_seconds, callers) in functions]
+
+
+def compare_profiles(profile, baseline, tolerance, min_seconds=0.05, min_bytes=1048576):
+    """
+    Compare the summary of a profiled run to that of an earlier run and describe every phase and function that
+    regressed. Phases that ran more than once, such as report_query after a report update, are added up. Functions
+    are compared by their own time, leaving out built-in functions.
+    :param profile: summary of the run, read from its profile.json
+    :param baseline: summary of the earlier run
+    :param tolerance: fraction by which a time or memory peak may grow before it counts as a regression
+    :param min_seconds: growth in seconds below which a time does not count as a regression
+    :param min_bytes: growth in bytes below which a memory peak does not count as a regression
+    :return: list of regression descriptions
+    """
+    def summarize(summary):
+        phases = {}
+        for phase in summary["phases"]:
+            totals = phases.setdefault(phase["name"], {"seconds": 0.0, "memory_peak_bytes": 0, "functions": {}})
+            totals["seconds"] += phase["seconds"]
+            totals["memory_peak_bytes"] = max(totals["memory_peak_bytes"], phase["memory_peak_bytes"])
+            for function in phase["functions"]:
+                totals["functions"][function["function"]] = (totals["functions"].get(function["function"], 0.0)
+                                                             + function["tottime"])
+        return phases
+
+    def grew(value, baseline_value, minimum):
+        return value > baseline_value * (1 + tolerance) and value - baseline_value > minimum
+
+    regressions = []
+    phases = summarize(summary=profile)
+    baseline_phases = summarize(summary=baseline)
+    for phase_name, phase in phases.items():
+        baseline_phase = baseline_phases.get(phase_name)
+        if baseline_phase is None:
+            continue
+        if grew(phase["seconds"], baseline_phase["seconds"], min_seconds):
+            regressions.append(f"{phase_name}: {baseline_phase['seconds'] * 1000:.1f} ms -> "
+                               f"{phase['seconds'] * 1000:.1f} ms")
+        if grew(phase["memory_peak_bytes"], baseline_phase["memory_peak_bytes"], min_bytes):
+            regressions.append(f"{phase_name}: memory peak {baseline_phase['memory_peak_bytes'] / 1048576:.1f} MiB -> "
+                               f"{phase['memory_peak_bytes'] / 1048576:.1f} MiB")
+        for function_name, own_seconds in phase["functions"].items():
+            # The own time of built-in functions is mostly time spent waiting on sockets and locks, which the phase
+            #   time already covers
+            if function_name.startswith("~:"):
+                continue
+            # A function missing from the baseline's top list took less time than the last function on it
+            baseline_seconds = baseline_phase["functions"].get(function_name,
+                                                               min(baseline_phase["functions"].values(), default=0.0))
+            if grew(own_seconds, baseline_seconds, min_seconds):
+                regressions.append(f"{phase_name}: {function_name} {baseline_seconds * 1000:.1f} ms -> "
+                                   f"{own_seconds * 1000:.1f} ms")
+    if profile.get("python") != baseline.get("python"):
+        print("WARNING: The baseline was profiled with a different version of Python")
+    return regressions
+
+
+def read_summary(run_path):
+    """
+    Read the summary of a profiled run.
+    :param run_path: run folder, or the path of its profile.json
+    :return: dictionary
+    """
+    if os.path.isdir(run_path):
+        run_path = os.path.join(run_path, "profile.json")
+    with open(run_path, "r") as summary_file_handler:
+        return json.load(summary_file_handler)
+
+
+def main():
+    """
+    Print the phases of a profiled run and, when asked to, compare it to an earlier run.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Summarise a profiled run and compare it to an earlier one")
+    parser.add_argument("run_path", help="run folder written by CreateUsageReport_MOD.py --profile")
+    parser.add_argument("--compare", help="run folder of an earlier profiled run to compare the run to")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction a time or memory peak may grow by")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="smallest growth in seconds that counts")
+    parser.add_argument("--min-mib", type=float, default=1.0, help="smallest memory peak growth in MiB that counts")
+    arguments = parser.parse_args()
+
+    profile = read_summary(run_path=arguments.run_path)
+    print(f"{'phase':<18} {'wall':>10} {'peak MiB':>9} {'net MiB':>8}  top function")
+    for phase in profile["phases"]:
+        top_function = phase["functions"][0]["function"] if phase["functions"] else ""
+        print(f"{phase['name']:<18} {phase['seconds'] * 1000:>7.1f} ms {phase['memory_peak_bytes'] / 1048576:>9.1f} "
+              f"{phase['memory_net_bytes'] / 1048576:>+8.1f}  {top_function}")
+    if arguments.compare:
+        regressions = compare_profiles(profile=profile,
+                                       baseline=read_summary(run_path=arguments.compare),
+                                       tolerance=arguments.tolerance,
+                                       min_seconds=arguments.min_seconds,
+                                       min_bytes=arguments.min_mib * 1048576)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
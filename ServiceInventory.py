@@ -0,0 +1,225 @@
+"""
+Compact, indexed inventory of the folders and services in an ArcGIS Server site.
+
+The inventory is a struct of arrays rather than an object per folder and service. Folder names, service names, and
+service types are each held once in plain lists, services refer to their folder and type by integer id in typed
+arrays, and urls are formatted only when they are asked for. Indexes by folder, by service type, and by short url are
+built on first use and dropped whenever a service is added. The inventory saves to, and loads from, a small binary
+format: a header, the typed arrays as raw bytes, and the strings as one NUL separated UTF-8 block.
+Short urls are the resourceURIs of a usage report: 'services/<folder>' for a folder and 'services/<name>.<type>' for
+a service, where the name of a service outside the root folder already starts with its folder.
+Contains ServiceInventoryObject class.
+Date: 20261016
+"""
+import array
+import struct
+import sys
+
+
+class ServiceInventoryObject:
+    """
+    The ServiceInventoryObject class holds the folders and services of a site as parallel arrays with lazily built
+    indexes, and serializes them to bytes.
+    """
+
+    FORMAT_VERSION = 1
+    HEADER_FORMAT = "<4sHIII"
+    MAGIC = b"SINV"
+
+    __slots__ = ("folder_names", "folder_ids", "folder_crawled", "service_names", "service_folder_ids",
+                 "service_type_ids", "type_names", "type_ids", "folder_service_index", "type_service_index",
+                 "short_url_index")
+
+    def __init__(self):
+        """
+        Instantiate an empty ServiceInventoryObject.
+        """
+        self.folder_names = []
+        self.folder_ids = {}
+        self.folder_crawled = array.array("d")
+        self.service_names = []
+        self.service_folder_ids = array.array("i")
+        self.service_type_ids = array.array("i")
+        self.type_names = []
+        self.type_ids = {}
+        self.clear_indexes()
+
+    def __len__(self):
+        return len(self.service_names)
+
+    def add_folder(self, folder_name, crawled=0.0):
+        """
+        Add a folder, or return the id of a folder already in the inventory.
+        :param folder_name: name of the folder, '' for the root folder
+        :param crawled: epoch seconds when the folder's services were requested, 0 when they have not been
+        :return: folder id
+        """
+        folder_id = self.folder_ids.get(folder_name)
+        if folder_id is None:
+            folder_id = len(self.folder_names)
+            self.folder_names.append(folder_name)
+            self.folder_ids[folder_name] = folder_id
+            self.folder_crawled.append(crawled)
+        return folder_id
+
+    def add_service(self, folder_name, service_name, service_type):
+        """
+        Add a service to a folder, adding the folder if it is not in the inventory.
+        :param folder_name: name of the folder the service is in
+        :param service_name: name of the service as listed by the folder, including the folder for non-root folders
+        :param service_type: type of the service, for example 'MapServer'
+        :return: service index
+        """
+        type_id = self.type_ids.get(service_type)
+        if type_id is None:
+            type_id = len(self.type_names)
+            self.type_names.append(service_type)
+            self.type_ids[service_type] = type_id
+        self.service_names.append(service_name)
+        self.service_folder_ids.append(self.add_folder(folder_name=folder_name))
+        self.service_type_ids.append(type_id)
+        self.clear_indexes()
+        return len(self.service_names) - 1
+
+    def add_services_json(self, folder_name, services_json):
+        """
+        Add the services listed in a folder's rest response.
+        :param folder_name: name of the folder the services are in
+        :param services_json: list of service json objects, each with a 'name' and a 'type'
+        :return: None
+        """
+        # Validate the whole list first so that a bad entry does not leave the folder half added
+        services = [(service_json["name"], service_json["type"]) for service_json in services_json]
+        for service_name, service_type in services:
+            self.add_service(folder_name=folder_name, service_name=service_name, service_type=service_type)
+
+    def clear_indexes(self):
+        self.folder_service_index = None
+        self.type_service_index = None
+        self.short_url_index = None
+
+    def find_short_url(self, short_url):
+        """
+        Look up a folder or service by its short url.
+        :param short_url: short url, for example 'services/Weather' or 'services/Weather/Radar.MapServer'
+        :return: tuple of folder name, service name, and service type, with None for the service name and type of a
+            folder, or None when the url is not in the inventory
+        """
+        if self.short_url_index is None:
+            self.short_url_index = {self.service_short_url(service_index=service_index): service_index
+                                    for service_index in range(len(self.service_names))}
+        service_index = self.short_url_index.get(short_url)
+        if service_index is not None:
+            return (self.folder_names[self.service_folder_ids[service_index]], self.service_names[service_index],
+                    self.type_names[self.service_type_ids[service_index]])
+        folder_name = short_url[len("services/"):] if short_url.startswith("services/") else None
+        if folder_name in self.folder_ids:
+            return folder_name, None, None
+        return None
+
+    def folder_short_url(self, folder_name):
+        return f"services/{folder_name}"
+
+    def master_url_list(self):
+        """
+        List the short url of every folder followed by those of its services, in the order the folders were added.
+        The root folder itself is left out, as its short url would be the whole 'services/' tree.
+        :return: list of strings
+        """
+        service_names = self.service_names
+        service_type_ids = self.service_type_ids
+        type_suffixes = [f".{type_name}" for type_name in self.type_names]
+        master_list = []
+        for folder_name in self.folder_names:
+            if folder_name != "":
+                master_list.append(self.folder_short_url(folder_name=folder_name))
+                master_list.extend([f"services/{service_names[service_index]}"
+                                    f"{type_suffixes[service_type_ids[service_index]]}"
+                                    for service_index in self.services_in_folder(folder_name=folder_name)])
+        return master_list
+
+    def service_short_url(self, service_index):
+        return f"services/{self.service_names[service_index]}.{self.type_names[self.service_type_ids[service_index]]}"
+
+    def services_in_folder(self, folder_name):
+        """
+        List the indexes of the services in a folder, in the order they were added.
+        :param folder_name: name of the folder
+        :return: list of service indexes, empty when the folder is not in the inventory
+        """
+        if self.folder_service_index is None:
+            self.folder_service_index = [[] for _ in self.folder_names]
+            for service_index, folder_id in enumerate(self.service_folder_ids):
+                self.folder_service_index[folder_id].append(service_index)
+        folder_id = self.folder_ids.get(folder_name)
+        return [] if folder_id is None else self.folder_service_index[folder_id]
+
+    def services_of_type(self, service_type):
+        """
+        List the indexes of the services of a type, in the order they were added.
+        :param service_type: type of service, for example 'MapServer'
+        :return: list of service indexes, empty when there are none
+        """
+        if self.type_service_index is None:
+            self.type_service_index = [[] for _ in self.type_names]
+            for service_index, type_id in enumerate(self.service_type_ids):
+                self.type_service_index[type_id].append(service_index)
+        type_id = self.type_ids.get(service_type)
+        return [] if type_id is None else self.type_service_index[type_id]
+
+    def to_bytes(self):
+        """
+        Serialize the inventory. Numbers are stored little-endian whatever the platform.
+        :return: bytes
+        """
+        arrays = [self.folder_crawled, self.service_folder_ids, self.service_type_ids]
+        if sys.byteorder == "big":
+            arrays = [array.array(values.typecode, values) for values in arrays]
+            for values in arrays:
+                values.byteswap()
+        strings = "\0".join(self.folder_names + self.type_names + self.service_names).encode("utf-8")
+        header = struct.pack(ServiceInventoryObject.HEADER_FORMAT, ServiceInventoryObject.MAGIC,
+                             ServiceInventoryObject.FORMAT_VERSION, len(self.folder_names), len(self.type_names),
+                             len(self.service_names))
+        return b"".join([header] + [values.tobytes() for values in arrays] + [strings])
+
+    @classmethod
+    def from_bytes(cls, content):
+        """
+        Deserialize an inventory written by to_bytes().
+        :param content: bytes
+        :return: ServiceInventoryObject
+        """
+        header_size = struct.calcsize(ServiceInventoryObject.HEADER_FORMAT)
+        if len(content) < header_size:
+            raise ValueError("Inventory content is shorter than its header")
+        magic, version, folder_count, type_count, service_count = struct.unpack_from(
+            ServiceInventoryObject.HEADER_FORMAT, content)
+        if magic != ServiceInventoryObject.MAGIC or version != ServiceInventoryObject.FORMAT_VERSION:
+            raise ValueError("Content is not a serialized inventory of this version")
+
+        service_inventory_object = cls()
+        offset = header_size
+        for attribute_name, typecode, count in (("folder_crawled", "d", folder_count),
+                                                ("service_folder_ids", "i", service_count),
+                                                ("service_type_ids", "i", service_count)):
+            values = array.array(typecode)
+            values.frombytes(content[offset:offset + values.itemsize * count])
+            if len(values) != count:
+                raise ValueError("Inventory content is truncated")
+            if sys.byteorder == "big":
+                values.byteswap()
+            setattr(service_inventory_object, attribute_name, values)
+            offset += values.itemsize * count
+
+        strings = content[offset:].decode("utf-8").split("\0") if folder_count + type_count + service_count else []
+        if len(strings) != folder_count + type_count + service_count:
+            raise ValueError("Inventory content has the wrong number of names")
+        service_inventory_object.folder_names = strings[:folder_count]
+        service_inventory_object.type_names = strings[folder_count:folder_count + type_count]
+        service_inventory_object.service_names = strings[folder_count + type_count:]
+        service_inventory_object.folder_ids = {folder_name: folder_id for folder_id, folder_name
+                                               in enumerate(service_inventory_object.folder_names)}
+        service_inventory_object.type_ids = {type_name: type_id for type_id, type_name
+                                             in enumerate(service_inventory_object.type_names)}
+        return service_inventory_object
@@ -0,0 +1,302 @@
+"""
+Vectorized aggregation of usage report data: top services, per-folder totals, percentiles, and resampling to coarser
+time buckets.
+
+A usage report csv is parsed once into a UsageMatrixObject, which holds a NumPy array with one row per resource uri
+and one column per time bucket. Every rollup is then computed with array operations over whole rows and columns
+instead of looping over csv rows in Python. Folders are derived from the resource uris built by
+create_master_url_list() in CreateUsageReport_MOD.py: 'services/<folder>' is a folder and
+'services/<folder>/<name>.<type>' is a service in it. Services in the root folder, 'services/<name>.<type>', belong to
+the folder named ''. Folder totals add up the service rows only, so that the folder rows the server reports are not
+counted twice. A csv can also be parsed from chunks of bytes while it is being downloaded.
+Contains UsageMatrixBuilderObject and UsageMatrixObject classes.
+Date: 20261016
+"""
+import argparse
+import codecs
+import csv
+
+import numpy as np
+
+import UsageReportCSV
+
+RESAMPLE_RULES = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "1d": 86400}
+
+# ArcGIS Server service types. A resource uri names a service only when it ends in one of them, so that a folder with
+#   a dot in its name, such as 'services/Dept.Data', is still a folder
+SERVICE_TYPES = frozenset(["FeatureServer", "GeocodeServer", "GeoDataServer", "GeometryServer", "GlobeServer",
+                           "GPServer", "ImageServer", "KmlServer", "MapServer", "MobileServer", "NAServer",
+                           "SceneServer", "SchematicsServer", "StreamServer", "VectorTileServer", "WCSServer",
+                           "WFSServer", "WMSServer", "WMTSServer"])
+
+
+def folder_of_resource(resource_uri):
+    """
+    Derive the folder name of a resource uri and whether the uri is a service rather than a folder.
+    :param resource_uri: resource uri, for example 'services/Weather/Radar.MapServer'
+    :return: tuple of folder name and service boolean
+    """
+    parts = resource_uri.strip("/").split("/")
+    if parts and parts[0] == "services":
+        parts = parts[1:]
+    if not parts:
+        return "", False
+    if parts[-1].rpartition(".")[2] in SERVICE_TYPES:
+        return "/".join(parts[:-1]), True
+    return "/".join(parts), False
+
+
+def parse_values(value_texts, column_count):
+    """
+    Convert the comma separated values of every row to a float32 array in one call, reading empty values as NaN.
+    :param value_texts: list of strings, one per row, each holding the row's time slice values joined by commas
+    :param column_count: number of time slice columns
+    :return: 2d float32 array with one row per string
+    """
+    if not value_texts or not column_count:
+        return np.zeros((len(value_texts), column_count), dtype=np.float32)
+    text = ",".join(value_texts)
+    if ",," in text or text.startswith(",") or text.endswith(","):
+        text = ",".join("nan" if value == "" else value for value in text.split(","))
+    values = np.fromstring(text, dtype=np.float32, sep=",")
+    if values.size != len(value_texts) * column_count:
+        raise ValueError(f"Csv rows do not all have {column_count} time slice values")
+    return values.reshape(len(value_texts), column_count)
+
+
+def read_usage_matrix(csv_path, metric_name="RequestCount", chunk_size=1024 * 1024):
+    """
+    Parse a usage report csv into a UsageMatrixObject.
+
+    Rows for other metrics are skipped when the csv has a metric column. Empty values are read as NaN.
+    :param csv_path: path of a usage report csv
+    :param metric_name: metric whose rows are kept
+    :param chunk_size: bytes read from the csv at a time
+    :return: UsageMatrixObject
+    """
+    usage_matrix_builder_object = UsageMatrixBuilderObject(metric_name=metric_name)
+    with open(csv_path, "rb") as csv_file_handler:
+        for chunk in iter(lambda: csv_file_handler.read(chunk_size), b""):
+            usage_matrix_builder_object.feed(chunk=chunk)
+    return usage_matrix_builder_object.finish()
+
+
+class UsageMatrixBuilderObject:
+    """
+    The UsageMatrixBuilderObject class parses a usage report csv from chunks of bytes as they arrive, for example
+    while the report query is downloaded, and builds a UsageMatrixObject from it once the last chunk has been fed.
+
+    Chunks may end anywhere, including inside a line or a multi-byte character. Each complete line is split into its
+    labels and its values text when its chunk is fed, and the values are converted to numbers a block of BLOCK_ROWS
+    rows at a time, so that little is left to do once the last chunk has arrived. A row with more or fewer values than
+    the header has time slices, such as one cut short, raises ValueError naming its line.
+    """
+
+    BLOCK_ROWS = 1024
+
+    def __init__(self, metric_name="RequestCount"):
+        """
+        Instantiate the UsageMatrixBuilderObject.
+
+        :param metric_name: metric whose rows are kept when the csv has a metric column
+        """
+        self.metric_name = metric_name
+        self.reset()
+
+    def feed(self, chunk):
+        """
+        Parse the complete lines in a chunk and keep the incomplete line at its end for the next chunk.
+        :param chunk: bytes of the csv, following those of the previous chunk
+        :return: None
+        """
+        lines = (self.partial_line + self.decoder.decode(chunk)).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line=line)
+
+    def finish(self):
+        """
+        Parse the last line and build the matrix.
+        :return: UsageMatrixObject
+        """
+        self.parse_line(line=self.partial_line + self.decoder.decode(b"", final=True))
+        self.partial_line = ""
+        if self.time_slices is None:
+            return UsageMatrixObject(resource_names=[], time_slices=[], values=np.zeros((0, 0), dtype=np.float32))
+        self.value_blocks.append(parse_values(value_texts=self.value_texts, column_count=len(self.time_slices)))
+        self.value_texts = []
+        return UsageMatrixObject(resource_names=self.resource_names,
+                                 time_slices=self.time_slices,
+                                 values=np.concatenate(self.value_blocks, axis=0))
+
+    def parse_line(self, line):
+        """
+        Parse one csv line: the header when none has been parsed yet, otherwise a row.
+        :param line: line of the csv without its line ending
+        :return: None
+        """
+        self.line_number += 1
+        line = line.rstrip("\r")
+        if not line:
+            return
+        if self.time_slices is None:
+            header = next(csv.reader([line]))
+            self.label_count, self.time_slices = UsageReportCSV.split_header(header=header)
+            self.metric_column = next((index for index, column_name in enumerate(header[:self.label_count])
+                                       if column_name.strip().lower() == "metric"), None)
+            return
+        label_count = self.label_count
+        if '"' in line:
+            row = next(csv.reader([line]))
+            labels, value_text = row[:label_count], ",".join(row[label_count:])
+        else:
+            # Resource uris do not contain commas, so a plain split is much faster than the csv module
+            parts = line.split(",", label_count)
+            labels, value_text = parts[:label_count], parts[label_count] if len(parts) > label_count else ""
+        if self.metric_column is not None and labels[self.metric_column] != self.metric_name:
+            return
+        column_count = len(self.time_slices)
+        value_count = value_text.count(",") + 1 if column_count or value_text else 0
+        if value_count != column_count:
+            raise ValueError(f"Csv line {self.line_number} ({labels[0]}) has {value_count} time slice values, not "
+                             f"{column_count}")
+        self.resource_names.append(labels[0])
+        self.value_texts.append(value_text)
+        if len(self.value_texts) >= UsageMatrixBuilderObject.BLOCK_ROWS:
+            self.value_blocks.append(parse_values(value_texts=self.value_texts, column_count=len(self.time_slices)))
+            self.value_texts = []
+
+    def reset(self):
+        """Discard everything fed so far, for example when a download is restarted."""
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.partial_line = ""
+        self.line_number = 0
+        self.label_count = 0
+        self.time_slices = None
+        self.metric_column = None
+        self.resource_names = []
+        self.value_texts = []
+        self.value_blocks = []
+
+
+class UsageMatrixObject:
+    """
+    The UsageMatrixObject class holds usage counts as a resource by time bucket array and computes rollups of it.
+    """
+
+    def __init__(self, resource_names, time_slices, values):
+        """
+        Instantiate the UsageMatrixObject and derive the folder of every resource.
+
+        :param resource_names: list of resource uris, one per row
+        :param time_slices: list of epoch milliseconds, one per column, in ascending order
+        :param values: 2d array of counts with shape (len(resource_names), len(time_slices)), NaN for no data
+        """
+        self.resource_names = np.asarray(resource_names, dtype=object)
+        self.time_slices = np.asarray(time_slices, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.zero_filled_values = None
+        folders_and_flags = [folder_of_resource(resource_uri=resource_name) for resource_name in resource_names]
+        self.folder_names = np.array([folder for folder, is_service in folders_and_flags], dtype=object)
+        self.is_service = np.array([is_service for folder, is_service in folders_and_flags], dtype=bool)
+
+    @property
+    def counts(self):
+        """Values with no data counted as zero requests. Computed once and kept."""
+        if self.zero_filled_values is None:
+            self.zero_filled_values = np.nan_to_num(self.values, nan=0.0)
+        return self.zero_filled_values
+
+    def folder_totals(self):
+        """
+        Sum the service rows of each folder for every time bucket.
+        :return: tuple of an array of folder names and an array with one row per folder
+        """
+        service_rows = np.nonzero(self.is_service)[0]
+        if not len(service_rows):
+            return np.array([], dtype=str), np.zeros((0, len(self.time_slices)), dtype=np.float32)
+        folder_names, folder_ids = np.unique(self.folder_names[service_rows].astype(str), return_inverse=True)
+
+        # Sorting rows by folder makes every folder a contiguous run of rows that reduceat sums in one pass
+        order = np.argsort(folder_ids, kind="stable")
+        group_starts = np.concatenate(([0], np.nonzero(np.diff(folder_ids[order]))[0] + 1))
+        totals = np.add.reduceat(self.counts[service_rows[order]], group_starts, axis=0)
+        return folder_names, totals
+
+    def percentiles(self, percentiles=(50, 95, 99), services_only=True):
+        """
+        Compute percentiles of each resource's counts across its time buckets, ignoring buckets with no data.
+        :param percentiles: sequence of percentiles between 0 and 100
+        :param services_only: leave out the folder rows when True
+        :return: tuple of an array of resource names and an array with one row per resource and one column per
+            percentile
+        """
+        rows = self.is_service if services_only else np.ones(len(self.resource_names), dtype=bool)
+        values = self.values[rows]
+        if not values.size:
+            return self.resource_names[rows], np.zeros((len(values), len(percentiles)), dtype=np.float32)
+        # nanpercentile is several times slower than percentile, so it is only used when there is missing data
+        percentile_function = np.nanpercentile if np.isnan(values).any() else np.percentile
+        result = percentile_function(values, percentiles, axis=1).T
+        return self.resource_names[rows], result
+
+    def resample(self, rule):
+        """
+        Sum the time buckets into coarser buckets aligned to the epoch, for example '5m', '1h' or '1d'.
+        :param rule: key of RESAMPLE_RULES, or a number of seconds
+        :return: new UsageMatrixObject whose time slices are the start of each coarser bucket
+        """
+        width_milliseconds = int(RESAMPLE_RULES.get(rule, rule)) * 1000
+        if not len(self.time_slices):
+            return UsageMatrixObject(resource_names=self.resource_names, time_slices=[], values=self.values)
+        bucket_starts = self.time_slices - self.time_slices % width_milliseconds
+        column_starts = np.concatenate(([0], np.nonzero(np.diff(bucket_starts))[0] + 1))
+        has_data = np.add.reduceat(~np.isnan(self.values), column_starts, axis=1) > 0
+        sums = np.add.reduceat(self.counts, column_starts, axis=1)
+        sums[~has_data] = np.nan
+        return UsageMatrixObject(resource_names=self.resource_names,
+                                 time_slices=bucket_starts[column_starts],
+                                 values=sums)
+
+    def top_services(self, count=10):
+        """
+        Find the services with the most requests over the whole time span.
+        :param count: number of services to return
+        :return: list of (resource name, total) tuples, most requests first
+        """
+        service_rows = np.nonzero(self.is_service)[0]
+        totals = self.totals()[service_rows]
+        count = min(count, len(totals))
+        if count <= 0:
+            return []
+        top = np.argpartition(-totals, count - 1)[:count]
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(self.resource_names[service_rows[index]], float(totals[index])) for index in top]
+
+    def totals(self):
+        """Sum each resource's counts over the whole time span, one value per row."""
+        return self.counts.sum(axis=1)
+
+
+def main():
+    """
+    Print the top services and folder totals of a usage report csv.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Summarise a usage report csv")
+    parser.add_argument("csv_path")
+    parser.add_argument("--top", type=int, default=10)
+    arguments = parser.parse_args()
+
+    usage_matrix_object = read_usage_matrix(csv_path=arguments.csv_path)
+    print(f"Top {arguments.top} services")
+    for resource_name, total in usage_matrix_object.top_services(count=arguments.top):
+        print(f"{total:>12.0f}  {resource_name}")
+    print("Folder totals")
+    folder_names, totals = usage_matrix_object.folder_totals()
+    for folder_name, total in zip(folder_names, totals.sum(axis=1)):
+        print(f"{total:>12.0f}  {folder_name or '(root)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Reads, merges, and combines the csv files produced by querying an ArcGIS Server usage report.
+
+A usage report csv has one row per resource and metric and one column per aggregation interval. The leading columns
+label the row (resource uri, metric) and every following column header is the start of a time slice, either as epoch
+milliseconds or as a date and time. Merging streams the older csv one row at a time so that memory use is set by the
+size of the newer csv, which in incremental collection only covers the minutes since the previous run. Combining
+streams the csv files of several sites, or of the machines of one site, into one csv with a Site or Machine column.
+Date: 20261016
+"""
+import csv
+import datetime
+import os
+import tempfile
+
+TIME_COLUMN_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M",
+                       "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%SZ", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M")
+
+
+def parse_time_column(column_name):
+    """
+    Convert a time slice column header to epoch milliseconds.
+    :param column_name: csv header value
+    :return: integer milliseconds, or None when the header is not a time slice
+    """
+    value = column_name.strip().strip('"')
+    if value.isdigit():
+        return int(value)
+    for time_format in TIME_COLUMN_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        return int(parsed.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    return None
+
+
+def split_header(header):
+    """
+    Split a usage report csv header into the label columns and the time slice columns.
+    :param header: list of csv header values
+    :return: tuple of label column count and list of time slice milliseconds, one per remaining column
+    """
+    label_count = 0
+    while label_count < len(header) and parse_time_column(header[label_count]) is None:
+        label_count += 1
+    time_slices = [parse_time_column(column_name) for column_name in header[label_count:]]
+    if None in time_slices:
+        raise ValueError(f"Csv header has a label column after a time slice column: {header}")
+    return label_count, time_slices
+
+
+def combine_usage_report_csv(site_csv_paths, output_csv_path, fill_value="0", label_name="Site"):
+    """
+    Combine the usage report csv files of several sites, or of the machines of one site, into one csv and atomically
+    write it.
+
+    A Site column, or a column of another label name, is added after the label columns and the time slice columns are
+    the union of those of every csv, so rows of sites whose reports ended a minute apart still line up. Each csv is
+    streamed in turn and its rows are filled with the fill value for the time slices it does not cover.
+    :param site_csv_paths: dictionary of site name to the path of the site's csv, in the order the sites are written
+    :param output_csv_path: path of the combined csv to be written
+    :param fill_value: value written for time slices a row has no data for
+    :param label_name: header of the column holding the site name
+    :return: number of rows written, not counting the header
+    """
+    headers = {}
+    for site_name, csv_path in site_csv_paths.items():
+        with open(csv_path, "r", newline="") as csv_file_handler:
+            header = next(csv.reader(csv_file_handler), None)
+        if header is not None:
+            headers[site_name] = header
+    label_header = ["Resource", "Metric"]
+    output_header_slices = {}
+    label_count = None
+    for site_name, header in headers.items():
+        site_label_count, time_slices = split_header(header=header)
+        if label_count is None:
+            label_count, label_header = site_label_count, header[:site_label_count]
+        elif site_label_count != label_count:
+            raise ValueError(f"The csv of site {site_name} has different label columns")
+        output_header_slices.update(zip(time_slices, header[site_label_count:]))
+    output_time_slices = sorted(output_header_slices)
+
+    temp_file_descriptor, temp_csv_path = tempfile.mkstemp(prefix=f".{os.path.basename(output_csv_path)}.",
+                                                           suffix=".tmp",
+                                                           dir=os.path.dirname(os.path.abspath(output_csv_path)))
+    row_count = 0
+    try:
+        with os.fdopen(temp_file_descriptor, "w", newline="") as output_file_handler:
+            writer = csv.writer(output_file_handler, lineterminator="\n")
+            writer.writerow(label_header + [label_name] + [output_header_slices[time_slice]
+                                                           for time_slice in output_time_slices])
+            for site_name, header in headers.items():
+                column_index = {time_slice: index for index, time_slice
+                                in enumerate(split_header(header=header)[1])}
+                column_sources = [(time_slice in column_index, column_index.get(time_slice, 0))
+                                  for time_slice in output_time_slices]
+                with open(site_csv_paths[site_name], "r", newline="") as csv_file_handler:
+                    reader = csv.reader(csv_file_handler)
+                    next(reader)
+                    for row in reader:
+                        if not row:
+                            continue
+                        writer.writerow(merge_row(labels=tuple(row[:label_count]) + (site_name,),
+                                                  older_values=None,
+                                                  newer_values=row[label_count:],
+                                                  column_sources=column_sources,
+                                                  fill_value=fill_value))
+                        row_count += 1
+            output_file_handler.flush()
+            os.fsync(output_file_handler.fileno())
+        os.chmod(temp_csv_path, 0o644)
+        os.replace(temp_csv_path, output_csv_path)
+    except BaseException:
+        if os.path.exists(temp_csv_path):
+            os.remove(temp_csv_path)
+        raise
+    return row_count
+
+
+def merge_usage_report_csv(older_csv_path, newer_csv_path, output_csv_path, window_start_milliseconds,
+                           fill_value="0"):
+    """
+    Merge a newer usage report csv into an older one, drop time slices before the window start, and atomically write
+    the result.
+
+    Rows are matched on their label columns. Where both csv files have a time slice the newer value is kept, so an
+    overlap between the two windows is de-duplicated. Rows that appear in only one of the files are filled with the
+    fill value for the time slices the other file covers. Rows from the older csv keep their order and new rows
+    follow them.
+    :param older_csv_path: path of the csv holding the data collected previously
+    :param newer_csv_path: path of the csv holding the data collected in this run
+    :param output_csv_path: path of the merged csv to be written, which may be the older csv path
+    :param window_start_milliseconds: epoch milliseconds of the first time slice to keep
+    :param fill_value: value written for time slices a row has no data for
+    :return: number of rows written, not counting the header
+    """
+    with open(newer_csv_path, "r", newline="") as newer_file_handler:
+        newer_reader = csv.reader(newer_file_handler)
+        newer_header = next(newer_reader)
+        label_count, newer_time_slices = split_header(header=newer_header)
+        newer_rows = {tuple(row[:label_count]): row[label_count:] for row in newer_reader if row}
+
+    temp_file_descriptor, temp_csv_path = tempfile.mkstemp(prefix=f".{os.path.basename(output_csv_path)}.",
+                                                           suffix=".tmp",
+                                                           dir=os.path.dirname(os.path.abspath(output_csv_path)))
+    try:
+        with open(older_csv_path, "r", newline="") as older_file_handler, \
+                os.fdopen(temp_file_descriptor, "w", newline="") as output_file_handler:
+            older_reader = csv.reader(older_file_handler)
+            older_header = next(older_reader, None) or newer_header[:label_count]
+            older_label_count, older_time_slices = split_header(header=older_header)
+            if older_label_count != label_count:
+                raise ValueError("The older and newer csv files have different label columns")
+
+            # Plan where every output column comes from once, then apply the plan to each row as it is streamed
+            newer_column_index = {time_slice: index for index, time_slice in enumerate(newer_time_slices)}
+            output_time_slices = sorted(set(newer_time_slices).union(
+                time_slice for time_slice in older_time_slices if time_slice >= window_start_milliseconds))
+            older_column_index = {time_slice: index for index, time_slice in enumerate(older_time_slices)}
+            column_sources = [(True, newer_column_index[time_slice]) if time_slice in newer_column_index
+                              else (False, older_column_index[time_slice]) for time_slice in output_time_slices]
+            output_header_slices = {time_slice: column_name for time_slice, column_name
+                                    in zip(older_time_slices, older_header[label_count:])}
+            output_header_slices.update(zip(newer_time_slices, newer_header[label_count:]))
+
+            writer = csv.writer(output_file_handler, lineterminator="\n")
+            writer.writerow(newer_header[:label_count] + [output_header_slices[time_slice]
+                                                          for time_slice in output_time_slices])
+            written_labels = set()
+            for older_row in older_reader:
+                if not older_row:
+                    continue
+                labels = tuple(older_row[:label_count])
+                writer.writerow(merge_row(labels=labels,
+                                          older_values=older_row[label_count:],
+                                          newer_values=newer_rows.get(labels),
+                                          column_sources=column_sources,
+                                          fill_value=fill_value))
+                written_labels.add(labels)
+            for labels, newer_values in newer_rows.items():
+                if labels not in written_labels:
+                    writer.writerow(merge_row(labels=labels,
+                                              older_values=None,
+                                              newer_values=newer_values,
+                                              column_sources=column_sources,
+                                              fill_value=fill_value))
+                    written_labels.add(labels)
+            output_file_handler.flush()
+            os.fsync(output_file_handler.fileno())
+        os.chmod(temp_csv_path, 0o644)
+        os.replace(temp_csv_path, output_csv_path)
+    except BaseException:
+        if os.path.exists(temp_csv_path):
+            os.remove(temp_csv_path)
+        raise
+    return len(written_labels)
+
+
+def merge_row(labels, older_values, newer_values, column_sources, fill_value):
+    """
+    Build one merged csv row from the older and newer values of a row using the column plan.
+    :param labels: tuple of label column values
+    :param older_values: list of time slice values from the older csv, or None
+    :param newer_values: list of time slice values from the newer csv, or None
+    :param column_sources: list of (is_newer, index) tuples, one per output time slice
+    :param fill_value: value written for time slices the row has no data for
+    :return: list of csv values
+    """
+    row = list(labels)
+    for is_newer, index in column_sources:
+        values = newer_values if is_newer else older_values
+        row.append(values[index] if values is not None and index < len(values) else fill_value)
+    return row
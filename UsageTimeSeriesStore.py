@@ -0,0 +1,394 @@
+"""
+Local columnar store for the RequestCount series in usage report csv files, so that weeks of history can be kept and
+queried without re-parsing csv text.
+
+The store is a folder holding an index and one NumPy array file per segment of time (a UTC day by default). A segment
+has one row per resource and one column per aggregation interval, holds float32 counts, and marks intervals with no
+data as NaN. Segments are memory-mapped, so a range query or a per-service lookup only reads the rows and columns it
+needs and appending a report only touches the segments it covers. The index maps resource names to row numbers; new
+resources are given the next row and a segment is widened the first time a row beyond its end is written.
+The store keeps a pyramid of rollups next to the one minute data: 15 minute, hourly, and daily sums, each a store of
+its own in the rollups folder with its own retention. Appending data recomputes only the rollup intervals it touches,
+each from the level below, and long-range queries read the coarsest level that still gives enough time slices
+instead of the minute data.
+The store assumes a single writer at a time.
+Contains TimeSeriesStoreObject class.
+Date: 20261016
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import UsageAggregation
+
+# Interval seconds and slices per segment of each rollup level, finest first: 15 minutes in weekly segments, hours in
+#   30 day segments, and days in segments of a year
+ROLLUP_LEVELS = ((900, 672), (3600, 720), (86400, 366))
+
+
+class TimeSeriesStoreObject:
+    """
+    The TimeSeriesStoreObject class appends usage report data to, and queries it from, a folder of memory-mapped
+    NumPy segments with a resource name index.
+    """
+
+    INDEX_FILE_NAME = "index.json"
+    METRIC_NAME = "RequestCount"
+    ROLLUP_FOLDER_NAME = "rollups"
+    SEGMENT_FOLDER_NAME = "segments"
+
+    def __init__(self, store_path, interval_seconds=60, slices_per_segment=1440, rollup_levels=ROLLUP_LEVELS):
+        """
+        Instantiate the TimeSeriesStoreObject, creating the store folder and index if they do not exist. The interval
+        and segment length of an existing store are read from its index and the arguments are ignored.
+
+        :param store_path: path of the store folder
+        :param interval_seconds: seconds in each aggregation interval, matching the report aggregationInterval
+        :param slices_per_segment: number of intervals in each segment file
+        :param rollup_levels: tuple of (interval seconds, slices per segment) tuples of the rollup levels kept with the
+            store, finest first, each interval a multiple of the one before it; empty for none
+        """
+        self.store_path = store_path
+        self.segment_folder = os.path.join(store_path, TimeSeriesStoreObject.SEGMENT_FOLDER_NAME)
+        os.makedirs(self.segment_folder, exist_ok=True)
+        self.index = self.load_index(interval_seconds=interval_seconds, slices_per_segment=slices_per_segment)
+        self.resource_ids = {resource_name: resource_id
+                             for resource_id, resource_name in enumerate(self.index["resources"])}
+        self.open_segments = {}
+        self.rollup_stores = []
+        finer_interval_seconds = self.index["interval_seconds"]
+        for rollup_interval_seconds, rollup_slices_per_segment in rollup_levels:
+            if rollup_interval_seconds % finer_interval_seconds:
+                raise ValueError(f"Rollup interval {rollup_interval_seconds} is not a multiple of the "
+                                 f"{finer_interval_seconds} second interval below it")
+            self.rollup_stores.append(TimeSeriesStoreObject(
+                store_path=os.path.join(store_path, TimeSeriesStoreObject.ROLLUP_FOLDER_NAME,
+                                        str(rollup_interval_seconds)),
+                interval_seconds=rollup_interval_seconds,
+                slices_per_segment=rollup_slices_per_segment,
+                rollup_levels=()))
+            finer_interval_seconds = rollup_interval_seconds
+
+    @property
+    def interval_milliseconds(self):
+        return self.index["interval_seconds"] * 1000
+
+    @property
+    def resource_names(self):
+        return list(self.index["resources"])
+
+    @property
+    def segment_milliseconds(self):
+        return self.interval_milliseconds * self.index["slices_per_segment"]
+
+    def append(self, resource_names, time_slices, values):
+        """
+        Write a block of values into the store, replacing any values already stored for the same resources and times,
+        and update the rollup intervals the block falls in.
+
+        :param resource_names: list of resource names, one per row of values
+        :param time_slices: list of epoch milliseconds, one per column of values, on the store's interval grid
+        :param values: 2d array-like of counts with shape (len(resource_names), len(time_slices))
+        :return: None
+        """
+        values = np.asarray(values, dtype=np.float32)
+        time_slices = np.asarray(time_slices, dtype=np.int64)
+        if values.shape != (len(resource_names), len(time_slices)):
+            raise ValueError(f"Values shape {values.shape} does not match {len(resource_names)} resources and "
+                             f"{len(time_slices)} time slices")
+        if np.any(time_slices % self.interval_milliseconds):
+            raise ValueError("Time slices are not on the store's aggregation interval grid")
+
+        row_ids = np.array([self.resource_id(resource_name=resource_name, create=True)
+                            for resource_name in resource_names], dtype=np.int64)
+        self.save_index()
+        segment_numbers = time_slices // self.segment_milliseconds
+        for segment_number in np.unique(segment_numbers):
+            columns_in_segment = np.nonzero(segment_numbers == segment_number)[0]
+            segment_columns = ((time_slices[columns_in_segment] % self.segment_milliseconds)
+                               // self.interval_milliseconds)
+            segment = self.segment(segment_number=int(segment_number), minimum_rows=len(self.resource_ids))
+            segment[np.ix_(row_ids, segment_columns)] = values[:, columns_in_segment]
+            segment.flush()
+        if len(time_slices):
+            self.update_rollups(start_milliseconds=int(time_slices.min()),
+                                end_milliseconds=int(time_slices.max()) + self.interval_milliseconds)
+
+    def ingest_csv(self, csv_path):
+        """
+        Append the RequestCount rows of a usage report csv to the store. The resource name is the first label column.
+        The csv is parsed by UsageAggregation.read_usage_matrix(), so a row with more or fewer values than the header
+        has time slices raises ValueError naming its line rather than being stored misaligned.
+        :param csv_path: path of a usage report csv
+        :return: tuple of the number of resources and the number of time slices ingested
+        """
+        usage_matrix_object = UsageAggregation.read_usage_matrix(csv_path=csv_path,
+                                                                 metric_name=TimeSeriesStoreObject.METRIC_NAME)
+        return self.ingest_usage_matrix(usage_matrix_object=usage_matrix_object)
+
+    def ingest_usage_matrix(self, usage_matrix_object):
+        """
+        Append a usage report already parsed into a UsageAggregation.UsageMatrixObject, for example while it was
+        downloaded, to the store. The matrix holds the RequestCount rows only.
+        :param usage_matrix_object: UsageAggregation.UsageMatrixObject of the report
+        :return: tuple of the number of resources and the number of time slices ingested
+        """
+        resource_names = list(usage_matrix_object.resource_names)
+        if resource_names:
+            self.append(resource_names=resource_names,
+                        time_slices=usage_matrix_object.time_slices,
+                        values=usage_matrix_object.values)
+        return len(resource_names), len(usage_matrix_object.time_slices)
+
+    def load_index(self, interval_seconds, slices_per_segment):
+        index_path = os.path.join(self.store_path, TimeSeriesStoreObject.INDEX_FILE_NAME)
+        try:
+            with open(index_path, "r") as index_file_handler:
+                return json.load(index_file_handler)
+        except FileNotFoundError:
+            return {"interval_seconds": interval_seconds, "slices_per_segment": slices_per_segment, "resources": []}
+
+    def prune(self, before_milliseconds):
+        """
+        Delete the segments that end at or before a time, to enforce a retention period.
+        :param before_milliseconds: epoch milliseconds before which data is no longer needed
+        :return: number of segments deleted
+        """
+        deleted_count = 0
+        for segment_number in self.segment_numbers():
+            if (segment_number + 1) * self.segment_milliseconds <= before_milliseconds:
+                self.open_segments.pop(segment_number, None)
+                os.remove(self.segment_path(segment_number=segment_number))
+                deleted_count += 1
+                self.index["pruned_before"] = max(self.index.get("pruned_before", 0),
+                                                  (segment_number + 1) * self.segment_milliseconds)
+        if deleted_count:
+            self.save_index()
+        return deleted_count
+
+    def prune_rollups(self, before_milliseconds_by_interval):
+        """
+        Delete the rollup segments that end before the retention period of their level.
+        :param before_milliseconds_by_interval: dictionary of rollup interval seconds to the epoch milliseconds before
+            which that level is no longer needed; levels not in it are kept
+        :return: number of segments deleted
+        """
+        deleted_count = 0
+        for rollup_store in self.rollup_stores:
+            before_milliseconds = before_milliseconds_by_interval.get(rollup_store.index["interval_seconds"])
+            if before_milliseconds is not None:
+                deleted_count += rollup_store.prune(before_milliseconds=before_milliseconds)
+        return deleted_count
+
+    def query(self, start_milliseconds, end_milliseconds, resource_names=None):
+        """
+        Read the values for a time range, for every resource or only those named.
+
+        :param start_milliseconds: epoch milliseconds of the first time slice, inclusive
+        :param end_milliseconds: epoch milliseconds of the last time slice, exclusive
+        :param resource_names: list of resource names, or None for every resource in the store
+        :return: tuple of the list of resource names, an int64 array of time slices, and a float32 array of values
+            with one row per resource and NaN where there is no data
+        """
+        if resource_names is None:
+            resource_names = self.resource_names
+        row_ids = np.array([self.resource_ids.get(resource_name, -1) for resource_name in resource_names],
+                           dtype=np.int64)
+        interval = self.interval_milliseconds
+        first_slice = -(-start_milliseconds // interval) * interval
+        time_slices = np.arange(first_slice, end_milliseconds, interval, dtype=np.int64)
+        values = np.full((len(resource_names), len(time_slices)), np.nan, dtype=np.float32)
+        if not len(time_slices) or not len(row_ids):
+            return list(resource_names), time_slices, values
+
+        segment_numbers = time_slices // self.segment_milliseconds
+        known_rows = np.nonzero(row_ids >= 0)[0]
+        for segment_number in np.unique(segment_numbers):
+            segment = self.segment(segment_number=int(segment_number), create=False)
+            if segment is None:
+                continue
+            columns_in_segment = np.nonzero(segment_numbers == segment_number)[0]
+            first_column = int((time_slices[columns_in_segment[0]] % self.segment_milliseconds) // interval)
+            segment_block = segment[:, first_column:first_column + len(columns_in_segment)]
+            stored_rows = known_rows[row_ids[known_rows] < segment.shape[0]]
+            values[np.ix_(stored_rows, columns_in_segment)] = segment_block[row_ids[stored_rows]]
+        return list(resource_names), time_slices, values
+
+    def query_rollup(self, start_milliseconds, end_milliseconds, resource_names=None, max_slices=1000):
+        """
+        Read a time range from the finest level, the store itself or one of its rollups, that covers the range in no
+        more than max_slices time slices and has not pruned data from the start of the range, so that a long range is
+        read from a coarse level instead of the minute data. The range is widened to whole intervals of the level read.
+
+        :param start_milliseconds: epoch milliseconds of the start of the range, inclusive
+        :param end_milliseconds: epoch milliseconds of the end of the range, exclusive
+        :param resource_names: list of resource names, or None for every resource in the store
+        :param max_slices: most time slices wanted
+        :return: tuple of the list of resource names, an int64 array of time slices, a float32 array of values with
+            one row per resource and NaN where there is no data, and the interval seconds of the level read
+        """
+        levels = [self] + self.rollup_stores
+        level = levels[-1]
+        for candidate in levels:
+            interval = candidate.interval_milliseconds
+            slice_count = -(-end_milliseconds // interval) - start_milliseconds // interval
+            if slice_count <= max_slices and candidate.index.get("pruned_before", 0) <= start_milliseconds:
+                level = candidate
+                break
+        names, time_slices, values = level.query(
+            start_milliseconds=start_milliseconds // level.interval_milliseconds * level.interval_milliseconds,
+            end_milliseconds=end_milliseconds,
+            resource_names=resource_names if resource_names is not None else self.resource_names)
+        return names, time_slices, values, level.index["interval_seconds"]
+
+    def rebuild_rollups(self):
+        """
+        Recompute every rollup level from the store's data, for a store that was written before it had rollups.
+        :return: None
+        """
+        segment_numbers = self.segment_numbers()
+        if segment_numbers:
+            self.update_rollups(start_milliseconds=segment_numbers[0] * self.segment_milliseconds,
+                                end_milliseconds=(segment_numbers[-1] + 1) * self.segment_milliseconds)
+
+    def resource_id(self, resource_name, create=False):
+        """
+        Look up the row number of a resource in the index.
+        :param resource_name: resource name, as in the report resourceURIs
+        :param create: add the resource to the index when it is not already there
+        :return: row number, or None when the resource is not in the store and create is False
+        """
+        resource_id = self.resource_ids.get(resource_name)
+        if resource_id is None and create:
+            resource_id = len(self.index["resources"])
+            self.index["resources"].append(resource_name)
+            self.resource_ids[resource_name] = resource_id
+        return resource_id
+
+    def save_index(self):
+        index_path = os.path.join(self.store_path, TimeSeriesStoreObject.INDEX_FILE_NAME)
+        temp_file_descriptor, temp_index_path = tempfile.mkstemp(prefix=".index.", suffix=".tmp", dir=self.store_path)
+        with os.fdopen(temp_file_descriptor, "w") as index_file_handler:
+            json.dump(self.index, index_file_handler)
+        os.replace(temp_index_path, index_path)
+
+    def segment(self, segment_number, minimum_rows=0, create=True):
+        """
+        Open a segment as a writable memory map, creating it or widening it to at least minimum_rows rows.
+        :param segment_number: number of segments since the epoch
+        :param minimum_rows: number of rows the segment must have
+        :param create: create the segment when it does not exist
+        :return: memory-mapped float32 array, or None when the segment does not exist and create is False
+        """
+        segment = self.open_segments.get(segment_number)
+        segment_path = self.segment_path(segment_number=segment_number)
+        if segment is None and os.path.exists(segment_path):
+            segment = np.load(segment_path, mmap_mode="r+")
+        if segment is None and not create:
+            return None
+        if segment is None or segment.shape[0] < minimum_rows:
+            # Rows are added with headroom so that a segment is not rewritten for every new resource
+            row_count = max(minimum_rows, 64, 0 if segment is None else segment.shape[0] * 2)
+            widened = np.lib.format.open_memmap(f"{segment_path}.tmp", mode="w+", dtype=np.float32,
+                                                shape=(row_count, self.index["slices_per_segment"]))
+            widened[:] = np.nan
+            if segment is not None:
+                widened[:segment.shape[0]] = segment
+            widened.flush()
+            del widened
+            segment = None
+            self.open_segments.pop(segment_number, None)
+            os.replace(f"{segment_path}.tmp", segment_path)
+            segment = np.load(segment_path, mmap_mode="r+")
+        self.open_segments[segment_number] = segment
+        return segment
+
+    def segment_numbers(self):
+        return sorted(int(file_name[:-len(".npy")]) for file_name in os.listdir(self.segment_folder)
+                      if file_name.endswith(".npy") and file_name[:-len(".npy")].isdigit())
+
+    def segment_path(self, segment_number):
+        return os.path.join(self.segment_folder, f"{segment_number}.npy")
+
+    def series(self, resource_name, start_milliseconds, end_milliseconds):
+        """
+        Read the values of a single resource for a time range.
+        :param resource_name: resource name, as in the report resourceURIs
+        :param start_milliseconds: epoch milliseconds of the first time slice, inclusive
+        :param end_milliseconds: epoch milliseconds of the last time slice, exclusive
+        :return: tuple of an int64 array of time slices and a float32 array of values
+        """
+        names, time_slices, values = self.query(start_milliseconds=start_milliseconds,
+                                                end_milliseconds=end_milliseconds,
+                                                resource_names=[resource_name])
+        return time_slices, values[0]
+
+    def update_rollups(self, start_milliseconds, end_milliseconds):
+        """
+        Recompute the rollup intervals that overlap a time range, each level from the level below it. A rollup interval
+        is the sum of the intervals below it that have data, and NaN when none of them has.
+        :param start_milliseconds: epoch milliseconds of the start of the changed range
+        :param end_milliseconds: epoch milliseconds of the end of the changed range, exclusive
+        :return: None
+        """
+        finer_store = self
+        for rollup_store in self.rollup_stores:
+            interval = rollup_store.interval_milliseconds
+            start_milliseconds = start_milliseconds // interval * interval
+            end_milliseconds = -(-end_milliseconds // interval) * interval
+            names, finer_time_slices, finer_values = finer_store.query(start_milliseconds=start_milliseconds,
+                                                                       end_milliseconds=end_milliseconds)
+            if names:
+                ratio = interval // finer_store.interval_milliseconds
+                finer_values = finer_values.reshape(len(names), -1, ratio)
+                has_data = ~np.isnan(finer_values)
+                values = np.where(has_data.any(axis=2), np.nansum(finer_values, axis=2), np.nan)
+                rollup_store.append(resource_names=names,
+                                    time_slices=finer_time_slices[::ratio],
+                                    values=values)
+            finer_store = rollup_store
+
+
+def main():
+    """
+    Ingest a usage report csv into a store, rebuild its rollups, or print the request totals of a store for the last
+    number of hours.
+    :return: None
+    """
+    import time
+
+    parser = argparse.ArgumentParser(description="Ingest usage report csv files into, and query, a local store")
+    parser.add_argument("store_path")
+    parser.add_argument("--ingest", help="path of a usage report csv to ingest")
+    parser.add_argument("--hours", type=float, default=48, help="hours of history to total")
+    parser.add_argument("--resource", action="append", help="resource to total, every resource by default")
+    parser.add_argument("--max-slices", type=int, default=1000,
+                        help="read the finest level that covers the hours in at most this many time slices")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute the rollups from the minute data")
+    arguments = parser.parse_args()
+
+    store_object = TimeSeriesStoreObject(store_path=arguments.store_path)
+    if arguments.ingest:
+        resource_count, time_slice_count = store_object.ingest_csv(csv_path=arguments.ingest)
+        print(f"Ingested {resource_count} resources x {time_slice_count} time slices")
+        return
+    if arguments.rebuild_rollups:
+        store_object.rebuild_rollups()
+        print("Rollups rebuilt")
+        return
+    end_milliseconds = int(time.time() * 1000)
+    names, time_slices, values, interval_seconds = store_object.query_rollup(
+        start_milliseconds=end_milliseconds - int(arguments.hours * 3600 * 1000),
+        end_milliseconds=end_milliseconds,
+        resource_names=arguments.resource,
+        max_slices=arguments.max_slices)
+    print(f"Totals of {len(time_slices)} time slices of {interval_seconds} seconds")
+    for resource_name, total in zip(names, np.nansum(values, axis=1)):
+        print(f"{total:>12.0f}  {resource_name}")
+
+
+if __name__ == "__main__":
+    main()